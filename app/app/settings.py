@@ -57,6 +57,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ProfilerMiddleware',
+    'core.middleware.SlowQueryMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -117,16 +121,63 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds and pinged before
+# their first use in each request. DB_POOL_MAX > 0 takes connections from an
+# in-process pool instead (pair it with DB_CONN_MAX_AGE=0 so they are handed
+# back after each request). Set DB_PGBOUNCER=1 when DB_HOST is a pgbouncer in
+# transaction pooling mode, which cannot keep server-side cursors open.
+
+DB_PGBOUNCER = bool(int(os.environ.get('DB_PGBOUNCER', 0)))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql',
         'HOST' : os.environ.get('DB_HOST'),
+        'PORT' : os.environ.get('DB_PORT', ''),
         'NAME' : os.environ.get('DB_NAME'),
         'USER' : os.environ.get('DB_USER'),
-        'PASSWORD': os.environ.get('DB_PASS')
+        'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
+        'POOL_MAX_SIZE': 0 if DB_PGBOUNCER else int(
+            os.environ.get('DB_POOL_MAX', 0)),
+        'POOL_MIN_SIZE': int(os.environ.get('DB_POOL_MIN', 1)),
+    }
+}
+
+# Safe requests on viewsets using core.db.routers.ReplicaReadMixin read
+# from the replica when DB_REPLICA_HOST is set. After a write the user
+# stays on the primary for REPLICA_PIN_SECONDS to read their own writes.
+
+DB_REPLICA_HOST = os.environ.get('DB_REPLICA_HOST')
+if DB_REPLICA_HOST:
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        HOST=DB_REPLICA_HOST,
+        PORT=os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        TEST={'MIRROR': 'default'},
+    )
+REPLICA_DATABASE = 'replica' if DB_REPLICA_HOST else None
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+DATABASE_ROUTERS = ['core.db.routers.PrimaryReplicaRouter']
+
+
+# Cache shared by the uwsgi workers of a task
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', '/tmp/django-cache'),
     }
 }
 
+LISTING_FACETS_CACHE_SECONDS = 60
+MAP_CLUSTERS_CACHE_SECONDS = 60
+AUTOCOMPLETE_CACHE_SECONDS = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -182,7 +233,8 @@ PHONENUMBER_DEFAULT_REGION = 'US'
 AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'EXCEPTION_HANDLER': 'core.uploads.exception_handler',
 }
 
 SPECTACULAR_SETTINGS = {
@@ -191,9 +243,69 @@ SPECTACULAR_SETTINGS = {
 
 S3_STORAGE_BACKEND = bool(int(os.environ.get('S3_STORAGE_BACKEND', 1)))
 if S3_STORAGE_BACKEND is True:
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    DEFAULT_FILE_STORAGE = 'core.storage.MediaStorage'
 
 AWS_DEFAULT_ACL = 'public-read'
 AWS_STORAGE_BUCKET_NAME = os.environ.get('S3_STORAGE_BUCKET_NAME')
 AWS_S3_REGION_NAME = os.environ.get('S3_STORAGE_BUCKET_REGION', 'us-east-1')
 AWS_QUERYSTRING_AUTH = False
+# Media URLs use this host instead of the bucket's when set, e.g. a CDN
+# in front of the bucket, see core.storage
+AWS_S3_CUSTOM_DOMAIN = os.environ.get('MEDIA_CDN_HOST') or None
+AWS_S3_MAX_POOL_CONNECTIONS = int(
+    os.environ.get('AWS_S3_MAX_POOL_CONNECTIONS', 10))
+
+# Metrics
+# Each worker writes its metrics to METRICS_DIR so /metrics can merge them
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Names this container's files in METRICS_DIR, which the api and worker
+# containers share
+METRICS_SOURCE = os.environ.get('METRICS_SOURCE', 'api')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Staff can profile a request with the X-Profile header, see
+# core.middleware.ProfilerMiddleware
+
+PROFILER_DIR = os.environ.get('PROFILER_DIR', '/tmp/profiles')
+
+# Slow query log, see core.slow_queries
+# A negative threshold disables the log
+
+SLOW_QUERY_THRESHOLD_MS = float(
+    os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 100))
+SLOW_QUERY_ASYNC = True
+
+# Background jobs, see core.jobs and the run_workers command
+# Uploaded images wait under UPLOAD_STAGING_PREFIX of the file storage,
+# which every api and worker task shares, until a worker moves them
+
+UPLOAD_STAGING_PREFIX = 'staging/'
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_SECONDS = float(os.environ.get('JOB_RETRY_SECONDS', 30))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 600))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+# Stored images nothing references are deleted after this long, see
+# core.blobs
+BLOB_GRACE_SECONDS = float(os.environ.get('BLOB_GRACE_SECONDS', 86400))
+
+# Upload limits, see core.uploads
+# Uploaded files are spooled to disk, hashed, and refused once over the caps
+
+FILE_UPLOAD_HANDLERS = [
+    'core.uploads.LimitedUploadHandler',
+    'core.uploads.HashingUploadHandler',
+]
+UPLOAD_MAX_FILE_BYTES = int(
+    os.environ.get('UPLOAD_MAX_FILE_BYTES', 15 * 1024 * 1024))
+UPLOAD_MAX_REQUEST_BYTES = int(
+    os.environ.get('UPLOAD_MAX_REQUEST_BYTES', 60 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 50000000))
+# Pillow reports many phone JPEGs as MPO
+UPLOAD_IMAGE_FORMATS = ['JPEG', 'MPO', 'PNG', 'WEBP']
+# Batch uploads take this many files, staged by this many threads
+UPLOAD_BATCH_MAX_FILES = int(os.environ.get('UPLOAD_BATCH_MAX_FILES', 20))
+UPLOAD_BATCH_THREADS = int(os.environ.get('UPLOAD_BATCH_THREADS', 4))
+# Presigned forms for uploads straight to storage, see core.direct_uploads
+UPLOAD_INTENT_SECONDS = int(os.environ.get('UPLOAD_INTENT_SECONDS', 900))
@@ -19,8 +19,12 @@ from drf_spectacular.views import (
     SpectacularAPIView, SpectacularSwaggerView)
 from django.conf.urls.static import static
 from django.conf import settings
+from core import views as core_views
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', core_views.metrics, name='metrics'),
+    path('api/uploads/direct', core_views.direct_upload,
+         name='direct-upload'),
     path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
     path('api/docs/',
          SpectacularSwaggerView.as_view(url_name='api-schema'),
@@ -75,3 +75,9 @@ admin.site.register(models.Address)
 admin.site.register(models.Saved)
 admin.site.register(models.Orders)
 admin.site.register(models.UserReview)
+admin.site.register(models.SlowQuery)
+admin.site.register(models.ZipCentroid)
+admin.site.register(models.Job)
+admin.site.register(models.ImageBlob)
+admin.site.register(models.Checkpoint)
+admin.site.register(models.ReplicaPin)
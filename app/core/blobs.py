@@ -0,0 +1,84 @@
+"""
+Content-addressed storage of uploaded images
+
+Uploads are hashed with SHA-256 as they stream in, see
+core.uploads.HashingUploadHandler, and each distinct file is stored once
+under blob_file_path(). An ImageBlob row maps the digest to the stored
+name and counts the ListingImage and UserImage rows using it, so a photo
+uploaded again costs a reference instead of a storage write.
+
+Blobs nobody references are deleted with their derivatives by
+core.images.collect_blobs once BLOB_GRACE_SECONDS have passed.
+"""
+
+import hashlib
+import os
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+
+from core.models import ImageBlob
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def blob_file_path(sha256, ext):
+    """Return the storage name of the file with a digest"""
+    return os.path.join('uploads', 'blobs', sha256[:2],
+                        f'{sha256}{ext.lower()}')
+
+
+def file_sha256(file):
+    """Return the SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def add_reference(sha256):
+    """Take a reference to the blob with a digest and return its name
+
+    Returns None if no file with that digest is stored.
+    """
+    with transaction.atomic():
+        name = ImageBlob.objects \
+            .select_for_update() \
+            .filter(sha256=sha256) \
+            .values_list('name', flat=True) \
+            .first()
+        if name is not None:
+            ImageBlob.objects \
+                .filter(sha256=sha256) \
+                .update(refcount=F('refcount') + 1, released_at=None)
+    return name
+
+
+def register(sha256, name, size):
+    """Record a newly stored file with one reference and return its name
+
+    If another worker stored the same file first, a reference to theirs is
+    taken and its name returned instead, and the caller should delete the
+    file it stored.
+    """
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(sha256=sha256, name=name, size=size,
+                                     refcount=1)
+        return name
+    except IntegrityError:
+        return add_reference(sha256)
+
+
+def release(name):
+    """Drop a reference to the file stored as name, if it is a blob"""
+    if not name:
+        return
+    ImageBlob.objects.filter(name=name).update(
+        refcount=F('refcount') - 1,
+        released_at=Case(When(refcount__lte=1, then=Value(timezone.now())),
+                         default=None,
+                         output_field=DateTimeField()))
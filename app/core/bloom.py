@@ -0,0 +1,37 @@
+"""
+Bloom filter for set membership in bounded memory
+
+A name added is always found again; a name never added is reported as
+present with probability about error_rate. Callers should only act on a
+miss, such as deleting a file no row can reference.
+"""
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Fixed-size set of strings that may report false positives"""
+
+    def __init__(self, capacity, error_rate=0.0001):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
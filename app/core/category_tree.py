@@ -0,0 +1,145 @@
+"""
+Category tree helpers
+
+CategoryClosure holds one row per (ancestor, descendant) pair so a whole
+subtree can be matched with a single indexed lookup on ancestor.
+
+The nested tree served by the API is built once per process and reused
+until the version stored in the cache changes, which core.signals does
+whenever a category or listing is saved or deleted.
+"""
+
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from core.metrics import record_cache
+from core.models import Category, CategoryClosure
+
+TREE_VERSION_KEY = 'category_tree_version'
+
+_tree_lock = threading.Lock()
+_tree = {'version': None, 'nodes': None}
+
+
+def closure_rows(parents):
+    """Yield closure rows for a {category id: parent id} mapping"""
+    for category_id in parents:
+        ancestor_id, depth = category_id, 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            yield CategoryClosure(ancestor_id=ancestor_id,
+                                  descendant_id=category_id,
+                                  depth=depth)
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+
+
+def rebuild_closure():
+    """Recompute the whole closure table from Category rows"""
+    parents = dict(Category.objects.values_list('id', 'parent_category_id'))
+    with transaction.atomic():
+        CategoryClosure.objects.all().delete()
+        CategoryClosure.objects.bulk_create(closure_rows(parents),
+                                            batch_size=1000)
+    return len(parents)
+
+
+def link_category(category):
+    """Attach a new or moved category and its subtree under its parent"""
+    parent_id = category.parent_category_id
+    with transaction.atomic():
+        CategoryClosure.objects.get_or_create(
+            ancestor=category, descendant=category, defaults={'depth': 0})
+        current_parent = CategoryClosure.objects \
+            .filter(descendant=category, depth=1) \
+            .values_list('ancestor_id', flat=True) \
+            .first()
+        if current_parent == parent_id:
+            return
+
+        subtree = list(CategoryClosure.objects
+                       .filter(ancestor=category)
+                       .values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+        if parent_id in subtree_ids:
+            raise ValueError('A category cannot be its own ancestor.')
+
+        CategoryClosure.objects \
+            .filter(descendant_id__in=subtree_ids) \
+            .exclude(ancestor_id__in=subtree_ids) \
+            .delete()
+        if parent_id is None:
+            return
+        ancestors = CategoryClosure.objects \
+            .filter(descendant_id=parent_id) \
+            .values_list('ancestor_id', 'depth')
+        CategoryClosure.objects.bulk_create([
+            CategoryClosure(ancestor_id=ancestor_id,
+                            descendant_id=descendant_id,
+                            depth=ancestor_depth + descendant_depth + 1)
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, descendant_depth in subtree
+        ])
+
+
+def descendant_ids(category_ids):
+    """Return the ids of the categories and their subtrees
+
+    Fetched up front rather than used as a subquery: given a literal list
+    the planner merges the listing and listing category indexes instead of
+    probing the closure table once per listing.
+    """
+    return list(CategoryClosure.objects
+                .filter(ancestor_id__in=category_ids)
+                .values_list('descendant_id', flat=True)
+                .distinct())
+
+
+def tree_version():
+    """Return the current tree version shared by all workers"""
+    return cache.get_or_set(TREE_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def invalidate_tree():
+    """Make every worker rebuild the tree on its next request"""
+    cache.set(TREE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def build_tree():
+    """Return the nested category tree with listing counts per subtree"""
+    counts = dict(CategoryClosure.objects
+                  .values('ancestor_id')
+                  .annotate(count=Count('descendant__listing', distinct=True))
+                  .values_list('ancestor_id', 'count'))
+    nodes = {}
+    for category_id, name, parent_id in Category.objects \
+            .order_by('name') \
+            .values_list('id', 'name', 'parent_category_id'):
+        nodes[category_id] = {
+            'id': category_id,
+            'name': name,
+            'parent_category': parent_id,
+            'listing_count': counts.get(category_id, 0),
+            'children': [],
+        }
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node['parent_category'])
+        (parent['children'] if parent else roots).append(node)
+    return roots
+
+
+def get_tree():
+    """Return (version, tree), rebuilding only if the version moved on"""
+    version = tree_version()
+    with _tree_lock:
+        hit = _tree['version'] == version
+        record_cache('category_tree', hit)
+        if not hit:
+            _tree['nodes'] = build_tree()
+            _tree['version'] = version
+        return version, _tree['nodes']
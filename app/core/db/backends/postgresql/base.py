@@ -0,0 +1,99 @@
+"""
+PostgreSQL backend with connection health checks and an optional pool
+
+Extra keys in a DATABASES entry:
+    CONN_HEALTH_CHECKS  ping a reused connection before its first use in
+                        each request (same meaning as in Django 4.1+)
+    POOL_MAX_SIZE       when > 0, take connections from an in-process
+                        psycopg2 pool instead of opening new ones
+    POOL_MIN_SIZE       connections the pool keeps open
+"""
+
+import os
+import threading
+
+import psycopg2.extras
+import psycopg2.pool
+from django.db.backends.postgresql import base
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict, conn_params):
+    """Return the process's pool for a database alias, creating it once"""
+    max_size = settings_dict.get('POOL_MAX_SIZE') or 0
+    if max_size <= 0:
+        return None
+    pid = os.getpid()
+    with _pools_lock:
+        pool_pid, pool = _pools.get(alias, (None, None))
+        # uwsgi forks workers, never share the parent's sockets
+        if pool is None or pool_pid != pid:
+            min_size = min(settings_dict.get('POOL_MIN_SIZE', 1), max_size)
+            pool = psycopg2.pool.ThreadedConnectionPool(
+                min_size, max_size, **conn_params)
+            _pools[alias] = (pid, pool)
+        return pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Postgres connection with health checks and optional pooling"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_enabled = self.settings_dict.get(
+            'CONN_HEALTH_CHECKS', False)
+        self.health_check_done = False
+        self._pool = None
+
+    def get_new_connection(self, conn_params):
+        self._pool = get_pool(self.alias, self.settings_dict, conn_params)
+        if self._pool is None:
+            return super().get_new_connection(conn_params)
+
+        connection = self._pool.getconn()
+        # Mirror the setup Django does on a freshly opened connection
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def connect(self):
+        super().connect()
+        # A pooled connection may have sat idle, check it like a reused one
+        self.health_check_done = self._pool is None
+
+    def _close(self):
+        if self._pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # The pool rolls back open transactions before reuse
+            self._pool.putconn(self.connection,
+                               close=bool(self.connection.closed))
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        """Close a connection that the server has dropped"""
+        if (self.connection is None or
+                not self.health_check_enabled or
+                self.health_check_done):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
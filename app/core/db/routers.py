@@ -0,0 +1,110 @@
+"""
+Database router sending safe reads to a replica
+
+Reads only go to settings.REPLICA_DATABASE while a request has opted in
+through ReplicaReadMixin. Any query routed for writing pins the rest of the
+request to the primary. If a statement then actually changes data,
+ReplicaRoutingMiddleware keeps the user pinned for REPLICA_PIN_SECONDS
+afterwards so they read their own writes despite lag.
+
+The pin is a ReplicaPin row on the primary, keyed by the user the request
+authenticated as. API clients send a token rather than cookies, and every
+task behind the load balancer sees the row.
+"""
+
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.permissions import SAFE_METHODS
+
+
+PRIMARY_DATABASE = 'default'
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+_state = threading.local()
+
+
+def start_request(pinned=False):
+    """Reset the routing state at the start of a request"""
+    _state.replica_reads = False
+    _state.pinned = pinned
+    _state.wrote = False
+
+
+def end_request():
+    """Forget the routing state once a request is done"""
+    start_request()
+
+
+def allow_replica_reads():
+    """Let reads in the current request go to the replica"""
+    _state.replica_reads = True
+
+
+def wrote_in_request():
+    """Return True if the current request wrote to the primary"""
+    return getattr(_state, 'wrote', False)
+
+
+def record_writes(execute, sql, params, many, context):
+    """Execute wrapper noting statements that change data"""
+    # get_or_create and select_for_update are routed for writing even
+    # when they only read
+    if sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+        _state.wrote = True
+    return execute(sql, params, many, context)
+
+
+def pin(user):
+    """Keep a user's reads on the primary for REPLICA_PIN_SECONDS"""
+    from core.models import ReplicaPin
+
+    until = timezone.now() + timedelta(seconds=settings.REPLICA_PIN_SECONDS)
+    ReplicaPin.objects.update_or_create(user_id=user.pk,
+                                        defaults={'until': until})
+
+
+def is_pinned(user):
+    """Return True if a user wrote within the last REPLICA_PIN_SECONDS"""
+    from core.models import ReplicaPin
+
+    if not user.is_authenticated:
+        return False
+    return ReplicaPin.objects \
+        .filter(user_id=user.pk, until__gt=timezone.now()) \
+        .exists()
+
+
+class PrimaryReplicaRouter:
+    """Route opted-in reads to the replica and everything else to primary"""
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(settings, 'REPLICA_DATABASE', None)
+        if (replica and
+                getattr(_state, 'replica_reads', False) and
+                not getattr(_state, 'pinned', False)):
+            return replica
+        return PRIMARY_DATABASE
+
+    def db_for_write(self, model, **hints):
+        _state.pinned = True
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DATABASE
+
+
+class ReplicaReadMixin:
+    """Serve the safe methods of a viewset from the replica"""
+
+    def initial(self, request, *args, **kwargs):
+        # Authenticates first; this lookup still reads from the primary
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and \
+                settings.REPLICA_DATABASE and not is_pinned(request.user):
+            allow_replica_reads()
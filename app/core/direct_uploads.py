@@ -0,0 +1,156 @@
+"""
+Uploads sent by the client straight to the file storage
+
+Instead of posting image bytes through the API, a client asks for an
+upload intent, POSTs the file to the URL and form fields it returns, then
+completes the upload with the intent's token:
+
+    1. create_intent    the key the file must be stored under, a form the
+                        storage accepts for that key only, and a signed token
+    2. client POST      url with fields, then the file as the last field
+    3. complete         registers the image row; its post_save signal queues
+                        a process_image job, which checks and resizes it
+
+With the S3 backend the form is a presigned POST, so S3 itself enforces the
+key, content type and UPLOAD_MAX_FILE_BYTES. Any other storage gets a form
+for core.views.direct_upload, which checks a signed policy carrying the
+same conditions and saves the file through the storage.
+"""
+
+import os
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from core import blobs
+from core.models import (
+    IMAGE_STATUS_PENDING,
+    Listing,
+    ListingImage,
+    UserImage,
+    listing_image_file_path,
+    user_image_file_path,
+    )
+from core.uploads import UploadTooLarge
+
+INTENT_SALT = 'core.direct_uploads.intent'
+POLICY_SALT = 'core.direct_uploads.policy'
+# kind -> (image model, upload_to)
+IMAGE_KINDS = {
+    'listing': (ListingImage, listing_image_file_path),
+    'user': (UserImage, user_image_file_path),
+}
+
+
+def content_types():
+    """Return the content types of the accepted image formats"""
+    Image.init()
+    return [Image.MIME[image_format]
+            for image_format in settings.UPLOAD_IMAGE_FORMATS]
+
+
+def presigned_post(storage, key, content_type):
+    """Return (url, fields) of a form that uploads one file to key"""
+    max_bytes = settings.UPLOAD_MAX_FILE_BYTES
+    if not isinstance(storage, S3Boto3Storage):
+        policy = signing.dumps({'key': key,
+                                'content_type': content_type,
+                                'max_bytes': max_bytes}, salt=POLICY_SALT)
+        return reverse('direct-upload'), {'key': key,
+                                          'Content-Type': content_type,
+                                          'policy': policy}
+
+    fields = {'Content-Type': content_type}
+    conditions = [{'Content-Type': content_type},
+                  ['content-length-range', 1, max_bytes]]
+    if storage.default_acl:
+        fields['acl'] = storage.default_acl
+        conditions.append({'acl': storage.default_acl})
+    post = storage.bucket.meta.client.generate_presigned_post(
+        storage.bucket_name,
+        storage._normalize_name(storage._clean_name(key)),
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=int(settings.UPLOAD_INTENT_SECONDS))
+    return post['url'], post['fields']
+
+
+def create_intent(kind, user, params, listing=None):
+    """Return the url, form fields, key and token for one upload"""
+    filename = params.get('filename') or ''
+    content_type = params.get('content_type')
+    if not os.path.splitext(filename)[1]:
+        raise ValidationError({'filename': 'Must have an extension.'})
+    if content_type not in content_types():
+        raise ValidationError(
+            {'content_type': f'Must be one of {", ".join(content_types())}.'})
+    try:
+        size = int(params.get('size'))
+    except (TypeError, ValueError):
+        raise ValidationError({'size': 'Must be an integer.'})
+    if size > settings.UPLOAD_MAX_FILE_BYTES:
+        raise UploadTooLarge(
+            f'{filename} is over {settings.UPLOAD_MAX_FILE_BYTES} bytes.')
+
+    _, upload_to = IMAGE_KINDS[kind]
+    key = upload_to(None, filename)
+    url, fields = presigned_post(default_storage, key, content_type)
+    token = signing.dumps({'kind': kind,
+                           'key': key,
+                           'user': user.pk,
+                           'listing': listing.pk if listing else None},
+                          salt=INTENT_SALT)
+    return {'url': url, 'fields': fields, 'key': key, 'token': token}
+
+
+def complete(kind, user, token, **fields):
+    """Register the image row for a finished upload and return it"""
+    try:
+        # A client may start its POST just before the form expires
+        intent = signing.loads(token or '', salt=INTENT_SALT,
+                               max_age=settings.UPLOAD_INTENT_SECONDS * 2)
+    except signing.BadSignature:
+        raise ValidationError({'token': 'Invalid or expired token.'})
+    if intent['kind'] != kind or intent['user'] != user.pk:
+        raise ValidationError({'token': 'Invalid or expired token.'})
+
+    Model, _ = IMAGE_KINDS[kind]
+    key = intent['key']
+    if not default_storage.exists(key):
+        raise ValidationError({'token': 'Nothing was uploaded.'})
+    if default_storage.size(key) > settings.UPLOAD_MAX_FILE_BYTES:
+        default_storage.delete(key)
+        raise UploadTooLarge()
+
+    fields.update(image=key, status=IMAGE_STATUS_PENDING)
+    with transaction.atomic():
+        # Completions for the same user or listing wait on its row, so a
+        # token completed twice at once registers one image
+        if kind == 'user':
+            owner = get_user_model().objects.filter(pk=user.pk)
+        else:
+            owner = Listing.objects.filter(id=intent['listing'], user=user)
+        if not owner.select_for_update().values_list('pk', flat=True):
+            raise ValidationError({'token': 'Listing not found.'})
+        if Model.objects.filter(image=key).exists():
+            raise ValidationError({'token': 'Upload already completed.'})
+
+        if kind == 'user':
+            # Users have one profile image, replaced by each upload
+            previous = UserImage.objects \
+                .filter(user_id=user) \
+                .values_list('image', flat=True) \
+                .first()
+            image, _ = UserImage.objects.update_or_create(
+                user_id=user, defaults=dict(fields, staged_file=''))
+            blobs.release(previous)
+            return image
+        return ListingImage.objects.create(listing_id=intent['listing'],
+                                           **fields)
@@ -0,0 +1,58 @@
+"""
+Zip code geography helpers
+
+Distances are great-circle miles on a spherical earth, which is plenty for
+"near me" searches over zip code centroids.
+"""
+
+import math
+
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, \
+    Sin, Sqrt
+
+from core.models import Address, ZipCentroid
+
+EARTH_RADIUS_MI = 3958.8
+MILES_PER_DEGREE = EARTH_RADIUS_MI * math.pi / 180
+
+
+def bounding_box(latitude, longitude, radius_mi):
+    """Return (min lat, max lat, min lon, max lon) around a point"""
+    dlat = radius_mi / MILES_PER_DEGREE
+    # Degrees of longitude shrink towards the poles; clamp so the box
+    # stays finite however far north the point is.
+    dlon = radius_mi / (MILES_PER_DEGREE *
+                        max(math.cos(math.radians(latitude)), 0.01))
+    return (latitude - dlat, latitude + dlat,
+            longitude - dlon, longitude + dlon)
+
+
+def haversine_mi(latitude, longitude, lat_field, lon_field):
+    """Return an expression for the distance from a point to a row"""
+    lat1 = math.radians(latitude)
+    lat2 = Radians(F(lat_field))
+    a = Power(Sin((lat2 - lat1) / 2), 2) + \
+        math.cos(lat1) * Cos(lat2) * \
+        Power(Sin((Radians(F(lon_field)) - math.radians(longitude)) / 2), 2)
+    return 2 * EARTH_RADIUS_MI * ASin(Sqrt(Least(a, 1.0)))
+
+
+def centroid(zip_code):
+    """Return (latitude, longitude) for a zip code, or None if unknown"""
+    return ZipCentroid.objects.filter(zip_code=zip_code) \
+        .values_list('latitude', 'longitude') \
+        .first()
+
+
+def centroids_loaded():
+    """Return whether load_zip_centroids has filled the table"""
+    return ZipCentroid.objects.exists()
+
+
+def backfill_addresses():
+    """Copy centroid coordinates onto every address in one UPDATE"""
+    centroids = ZipCentroid.objects.filter(zip_code=OuterRef('zip_code'))
+    return Address.objects.update(
+        latitude=Subquery(centroids.values('latitude')[:1]),
+        longitude=Subquery(centroids.values('longitude')[:1]))
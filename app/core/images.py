@@ -0,0 +1,361 @@
+"""
+Resized derivatives of uploaded images
+
+Each original gets a JPEG and a WebP copy per width in DERIVATIVE_WIDTHS
+up to its own, stored next to it as <name>_w<width>.<ext>. An original
+narrower than every width gets one copy at its own width. The copies are
+rotated upright and carry no EXIF data. The image row's variants field
+records which original they were made from and which widths exist.
+
+Uploads are not stored as images inside the request. They are saved under
+UPLOAD_STAGING_PREFIX of the file storage, which every api and worker task
+shares, and a process_image job moves them to their final name and renders
+the derivatives, see core.jobs. Files uploaded
+straight to the file storage skip staging and are checked by the job
+instead, see core.direct_uploads. Either way the job stores each distinct
+file once and reuses its derivatives, see core.blobs.
+"""
+
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, get_storage_class
+from django.db import transaction
+from django.utils import timezone
+from django.utils.functional import LazyObject
+from PIL import Image, ImageOps
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from core import blobs, jobs
+from core.models import (
+    IMAGE_STATUS_FAILED,
+    IMAGE_STATUS_PENDING,
+    IMAGE_STATUS_READY,
+    ImageBlob,
+    ListingImage,
+    UserImage,
+    )
+from core.uploads import InvalidImage, inspect_image
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (160, 480, 1200)
+# Pillow format, file extension and save options
+DERIVATIVE_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True,
+                             'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+
+def derivative_name(name, width, fmt):
+    """Return the storage name of one derivative of an original"""
+    stem = os.path.splitext(name)[0]
+    return f'{stem}_w{width}.{DERIVATIVE_FORMATS[fmt][1]}'
+
+
+def _encode(image, fmt):
+    pil_format, _, options = DERIVATIVE_FORMATS[fmt]
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in image.mode or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    out = io.BytesIO()
+    image.save(out, pil_format, **options)
+    return out.getvalue()
+
+
+def render_derivatives(file):
+    """Yield (width, format, bytes) for each derivative of an image file"""
+    with Image.open(file) as original:
+        # Refuse to decode anything bigger than an accepted upload
+        if original.width * original.height > settings.UPLOAD_MAX_PIXELS:
+            raise InvalidImage('too_many_pixels')
+        # Saving without exif= drops the metadata, so apply the
+        # orientation tag to the pixels first.
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    widths = [width for width in DERIVATIVE_WIDTHS if width <= image.width] \
+        or [min(DERIVATIVE_WIDTHS[0], image.width)]
+    for width in widths:
+        resized = image.copy()
+        resized.thumbnail((width, resized.height), Image.LANCZOS)
+        for fmt in DERIVATIVE_FORMATS:
+            yield width, fmt, _encode(resized, fmt)
+
+
+def generate_derivatives(instance, field='image'):
+    """Render and store the derivatives of an image row's file"""
+    fieldfile = getattr(instance, field)
+    widths = set()
+    with fieldfile.open('rb') as f:
+        for width, fmt, data in render_derivatives(f):
+            name = derivative_name(fieldfile.name, width, fmt)
+            if fieldfile.storage.exists(name):
+                fieldfile.storage.delete(name)
+            fieldfile.storage.save(name, ContentFile(data))
+            widths.add(width)
+
+    instance.variants = {'source': fieldfile.name,
+                         'widths': sorted(widths)}
+    type(instance).objects \
+        .filter(pk=instance.pk) \
+        .update(variants=instance.variants)
+    return instance.variants
+
+
+def has_current_derivatives(instance, field='image'):
+    fieldfile = getattr(instance, field)
+    return instance.variants.get('source') == fieldfile.name
+
+
+def srcset(instance, field='image'):
+    """Return {format: srcset string} for an image row's derivatives"""
+    fieldfile = getattr(instance, field)
+    if not fieldfile or not has_current_derivatives(instance, field):
+        return {}
+    storage, name = fieldfile.storage, fieldfile.name
+    return {
+        fmt: ', '.join(
+            f'{storage.url(derivative_name(name, width, fmt))} {width}w'
+            for width in instance.variants['widths'])
+        for fmt in DERIVATIVE_FORMATS
+    }
+
+
+def thumbnail_url(instance, width, field='image'):
+    """Return the URL of the narrowest JPEG derivative at least width wide
+
+    Falls back to the widest derivative, or to the original if it has no
+    derivatives yet.
+    """
+    fieldfile = getattr(instance, field)
+    if not fieldfile:
+        return None
+    if not has_current_derivatives(instance, field):
+        return fieldfile.url
+    widths = instance.variants['widths']
+    best = next((w for w in widths if w >= width), widths[-1])
+    return fieldfile.storage.url(derivative_name(fieldfile.name, best, 'jpeg'))
+
+
+class StagingStorage(LazyObject):
+    """The file storage, with staged files private and never overwritten
+
+    Staged files are not validated yet, and two uploads of the same file
+    each need their own copy for their job to move.
+    """
+    def _setup(self):
+        storage_class = get_storage_class()
+        if issubclass(storage_class, S3Boto3Storage):
+            self._wrapped = storage_class(default_acl='private',
+                                          file_overwrite=False)
+        else:
+            self._wrapped = storage_class()
+
+
+staging_storage = StagingStorage()
+
+
+def _stage(upload):
+    # Named by digest so the job need not hash it again
+    digest = getattr(upload, 'sha256', None) or blobs.file_sha256(upload)
+    ext = os.path.splitext(upload.name)[1]
+    return staging_storage.save(
+        f'{settings.UPLOAD_STAGING_PREFIX}{digest}{ext}', upload)
+
+
+def stage_upload(validated_data, field='image'):
+    """Swap an uploaded file in serializer data for a staged copy"""
+    upload = validated_data.pop(field, None)
+    if upload is not None:
+        validated_data['staged_file'] = _stage(upload)
+        validated_data['status'] = IMAGE_STATUS_PENDING
+    return validated_data
+
+
+def stage_uploads(uploads):
+    """Stage several uploads at once and return their staged names"""
+    with ThreadPoolExecutor(settings.UPLOAD_BATCH_THREADS) as pool:
+        return list(pool.map(_stage, uploads))
+
+
+def _job_payload(instance):
+    return {'model': instance._meta.model_name,
+            'pk': instance.pk,
+            'staged_file': instance.staged_file}
+
+
+def queue_processing(instance):
+    """Queue a job for a staged upload or an image missing derivatives"""
+    return jobs.enqueue('process_image', **_job_payload(instance))
+
+
+def queue_processing_many(instances):
+    """Queue the jobs for several image rows with one insert"""
+    return jobs.enqueue_many('process_image',
+                             [_job_payload(instance)
+                              for instance in instances])
+
+
+class StagedUploadMixin:
+    """Serializer mixin staging the uploaded image and queueing a job"""
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            instance = super().create(stage_upload(validated_data))
+            if instance.staged_file:
+                queue_processing(instance)
+        return instance
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            instance = super().update(instance, stage_upload(validated_data))
+            if 'staged_file' in validated_data:
+                queue_processing(instance)
+        return instance
+
+
+def known_variants(name):
+    """Return the variants of any image row with derivatives of name"""
+    for Model in (ListingImage, UserImage):
+        variants = Model.objects \
+            .filter(image=name, variants__source=name) \
+            .values_list('variants', flat=True) \
+            .first()
+        if variants:
+            return variants
+    return None
+
+
+def _store_staged(staged_file, storage):
+    """Store a staged upload once by content and return its name"""
+    with staging_storage.open(staged_file) as f:
+        digest = os.path.basename(staged_file)[:64]
+        if not blobs.SHA256_RE.match(digest):
+            digest = blobs.file_sha256(f)
+        name = blobs.add_reference(digest)
+        if name is None:
+            ext = os.path.splitext(staged_file)[1]
+            stored = storage.save(blobs.blob_file_path(digest, ext), File(f))
+            name = blobs.register(digest, stored, f.size)
+            if name != stored:
+                storage.delete(stored)
+    return name
+
+
+def _store_direct(fieldfile):
+    """Check and register a file uploaded straight to storage
+
+    Returns the name to use, which is an earlier copy if there is one.
+    """
+    with fieldfile.open('rb') as f:
+        inspect_image(f)
+        digest = blobs.file_sha256(f)
+    return blobs.add_reference(digest) or \
+        blobs.register(digest, fieldfile.name, fieldfile.size)
+
+
+def _mark_failed(model, pk, staged_file):
+    apps.get_model('core', model).objects \
+        .filter(pk=pk, staged_file=staged_file) \
+        .update(status=IMAGE_STATUS_FAILED)
+    if staged_file:
+        staging_storage.delete(staged_file)
+
+
+@jobs.handler('process_image', on_failure=_mark_failed)
+def process_image(model, pk, staged_file):
+    """Move a staged upload to the file storage and resize it"""
+    Model = apps.get_model('core', model)
+    instance = Model.objects.filter(pk=pk).first()
+    if instance is None or instance.staged_file != staged_file:
+        # Deleted or replaced by a newer upload with its own job
+        if staged_file:
+            staging_storage.delete(staged_file)
+        return
+    if staged_file and not staging_storage.exists(staged_file):
+        # Retrying cannot bring it back
+        logger.error('Staged file %s of %s %s is missing',
+                     staged_file, model, pk)
+        _mark_failed(model, pk, staged_file)
+        return
+
+    previous = instance.image.name
+    storage = instance.image.storage
+    upload = name = None
+    if staged_file:
+        name = _store_staged(staged_file, storage)
+    elif instance.image and instance.status == IMAGE_STATUS_PENDING:
+        # Uploaded straight to the file storage, never validated
+        upload = instance.image.name
+        try:
+            name = _store_direct(instance.image)
+        except InvalidImage as error:
+            logger.warning('Refused %s %s: %s', model, pk, error.code)
+            # Uploaded public; never leave unchecked bytes served from here
+            Model.objects \
+                .filter(pk=pk, staged_file=staged_file, image=upload) \
+                .update(image='', status=IMAGE_STATUS_FAILED)
+            storage.delete(upload)
+            return
+        # The upload itself was never counted
+        previous = None
+
+    try:
+        if name:
+            instance.image.name = name
+            instance.variants = known_variants(name) or instance.variants
+        if instance.image and not has_current_derivatives(instance):
+            generate_derivatives(instance)
+        # Only finish if no newer upload arrived while this one was
+        # processed
+        done = Model.objects \
+            .filter(pk=pk, staged_file=staged_file) \
+            .update(image=instance.image.name, variants=instance.variants,
+                    staged_file='', status=IMAGE_STATUS_READY)
+    except Exception:
+        blobs.release(name)
+        raise
+
+    if name:
+        # The row's reference moves from its old file to the new one
+        blobs.release(previous if done else name)
+    if done and upload and upload != name:
+        # The same file was stored already
+        storage.delete(upload)
+    if staged_file:
+        staging_storage.delete(staged_file)
+
+
+def collect_blobs(limit=100):
+    """Delete blobs unreferenced for BLOB_GRACE_SECONDS, with derivatives
+
+    Returns how many were deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.BLOB_GRACE_SECONDS)
+    with transaction.atomic():
+        # Locked while their files go, so nobody takes a new reference
+        unused = list(ImageBlob.objects
+                      .select_for_update(skip_locked=True)
+                      .filter(refcount__lte=0, released_at__lt=cutoff)
+                      .values_list('sha256', 'name')[:limit])
+        for _, name in unused:
+            default_storage.delete(name)
+            # The copy of an original narrower than every width is left
+            # for sweep_media, its width is not known here
+            for width in DERIVATIVE_WIDTHS:
+                for fmt in DERIVATIVE_FORMATS:
+                    default_storage.delete(derivative_name(name, width, fmt))
+        ImageBlob.objects \
+            .filter(sha256__in=[sha256 for sha256, _ in unused]) \
+            .delete()
+    return len(unused)
@@ -0,0 +1,156 @@
+"""
+Database-backed job queue
+
+Jobs are rows in the Job table, inserted in the same transaction as the
+change that needs them. Workers claim due jobs with SELECT ... FOR UPDATE
+SKIP LOCKED so any number of them can share the queue without handing the
+same job out twice. Failed jobs are retried with exponential backoff up to
+JOB_MAX_ATTEMPTS, and jobs left running by a worker that died are put back
+in the queue after JOB_STALE_SECONDS.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.metrics import registry
+from core.models import (
+    Job,
+    JOB_STATUS_DONE,
+    JOB_STATUS_FAILED,
+    JOB_STATUS_QUEUED,
+    JOB_STATUS_RUNNING,
+    )
+
+logger = logging.getLogger(__name__)
+
+# kind -> (handler, on_failure)
+_handlers = {}
+
+
+def handler(kind, on_failure=None):
+    """Register a function to run jobs of a kind with their payload
+
+    on_failure is called with the payload once the job has used up all of
+    its attempts.
+    """
+    def register(func):
+        _handlers[kind] = (func, on_failure)
+        return func
+    return register
+
+
+def enqueue(kind, **payload):
+    """Add a job to the queue"""
+    if kind not in _handlers:
+        raise ValueError(f'No handler for {kind} jobs')
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def enqueue_many(kind, payloads):
+    """Add a job per payload to the queue with one insert"""
+    if kind not in _handlers:
+        raise ValueError(f'No handler for {kind} jobs')
+    return Job.objects.bulk_create(
+        [Job(kind=kind, payload=payload) for payload in payloads])
+
+
+def claim(limit=1):
+    """Mark up to limit due jobs as running and return their ids"""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(Job.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(status=JOB_STATUS_QUEUED, run_after__lte=now)
+                   .order_by('run_after', 'id')
+                   .values_list('id', flat=True)[:limit])
+        Job.objects.filter(id__in=ids).update(
+            status=JOB_STATUS_RUNNING,
+            locked_at=now,
+            attempts=F('attempts') + 1)
+    return ids
+
+
+def run(job_id):
+    """Run a claimed job and record the outcome, returning success"""
+    job = Job.objects.get(id=job_id)
+    func, on_failure = _handlers.get(job.kind, (None, None))
+    try:
+        if func is None:
+            raise LookupError(f'No handler for {job.kind} jobs')
+        func(**job.payload)
+    except Exception:
+        logger.exception('Job %s failed', job)
+        registry.inc('jobs_total', {'kind': job.kind, 'outcome': 'error'})
+        update = {'last_error': traceback.format_exc()}
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            update.update(status=JOB_STATUS_FAILED,
+                          finished_at=timezone.now())
+            if on_failure:
+                on_failure(**job.payload)
+        else:
+            delay = settings.JOB_RETRY_SECONDS * 2 ** (job.attempts - 1)
+            update.update(status=JOB_STATUS_QUEUED,
+                          run_after=timezone.now() + timedelta(seconds=delay))
+        Job.objects.filter(id=job_id).update(**update)
+        return False
+
+    registry.inc('jobs_total', {'kind': job.kind, 'outcome': 'done'})
+    Job.objects.filter(id=job_id).update(
+        status=JOB_STATUS_DONE, finished_at=timezone.now(), last_error='')
+    return True
+
+
+def requeue_stale():
+    """Put back jobs whose worker stopped without finishing them"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    return Job.objects \
+        .filter(status=JOB_STATUS_RUNNING, locked_at__lt=cutoff) \
+        .update(status=JOB_STATUS_QUEUED, run_after=timezone.now())
+
+
+def purge():
+    """Delete finished jobs older than JOB_RETENTION_DAYS"""
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    deleted, _ = Job.objects \
+        .filter(status=JOB_STATUS_DONE, finished_at__lt=cutoff) \
+        .delete()
+    return deleted
+
+
+def run_pending():
+    """Run every due job in this process, returning how many ran"""
+    count = 0
+    while True:
+        ids = claim(100)
+        if not ids:
+            return count
+        for job_id in ids:
+            run(job_id)
+        count += len(ids)
+
+
+def fork_context():
+    """Return the multiprocessing context to start worker processes with
+
+    This process's database connections are closed first, so each worker
+    opens its own instead of sharing a socket across the fork.
+    """
+    connections.close_all()
+    return multiprocessing.get_context('fork')
+
+
+def init_worker(niceness=0):
+    """Set up a worker process started from fork_context()"""
+    # Ctrl-C reaches the whole process group; let the parent decide
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if niceness:
+        os.nice(niceness)
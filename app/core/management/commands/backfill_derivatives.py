@@ -0,0 +1,130 @@
+"""
+Django command to render the missing derivatives of existing images
+"""
+
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+from django.utils import timezone
+
+from core import jobs
+from core.images import (
+    generate_derivatives,
+    has_current_derivatives,
+    known_variants,
+    )
+from core.models import (
+    Checkpoint,
+    IMAGE_STATUS_READY,
+    ListingImage,
+    UserImage,
+    )
+
+MODELS = {'listing': ListingImage, 'user': UserImage}
+
+
+def missing_derivatives(Model):
+    """Return the ready images whose derivatives are missing or stale"""
+    return Model.objects \
+        .filter(status=IMAGE_STATUS_READY) \
+        .exclude(image='') \
+        .exclude(image__isnull=True) \
+        .alias(source=KeyTextTransform('source', 'variants')) \
+        .filter(Q(source__isnull=True) | ~Q(source=F('image')))
+
+
+def render(task):
+    """Render one image's derivatives, returning (pk, error or None)"""
+    label, pk = task
+    Model = MODELS[label]
+    instance = Model.objects.filter(pk=pk).first()
+    if instance is None or not instance.image or \
+            has_current_derivatives(instance):
+        return pk, None
+    try:
+        # Files stored once for several rows only need rendering once
+        variants = known_variants(instance.image.name)
+        if variants:
+            Model.objects.filter(pk=pk).update(variants=variants)
+        else:
+            generate_derivatives(instance)
+    except Exception as e:
+        return pk, f'{type(e).__name__}: {e}'
+    return pk, None
+
+
+class Command(BaseCommand):
+    """Django command to render derivatives for images uploaded before
+    they existed, resuming where the last run stopped"""
+    help = 'Render missing derivatives of existing images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', choices=list(MODELS),
+                            help='Image model to backfill, may be repeated '
+                            '(defaults to all)')
+        parser.add_argument('--processes', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Worker processes to render with, 0 to '
+                            'render in this process (defaults to the CPU '
+                            'count)')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Images to fetch and checkpoint at a time')
+        parser.add_argument('--niceness', type=int, default=10,
+                            help='Added to the worker processes\' niceness, '
+                            'leaving the CPU to the web and job workers')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and start from the '
+                            'first image, retrying earlier failures')
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['processes'] > 0:
+            pool = jobs.fork_context().Pool(
+                options['processes'], initializer=jobs.init_worker,
+                initargs=(options['niceness'],))
+        try:
+            for label in options['model'] or MODELS:
+                self.backfill(label, pool, options)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def backfill(self, label, pool, options):
+        """Render one model's images chunk by chunk from its checkpoint"""
+        name = f'backfill_derivatives:{label}'
+        checkpoint, _ = Checkpoint.objects.get_or_create(name=name)
+        position = 0 if options['restart'] else checkpoint.position
+        queryset = missing_derivatives(MODELS[label]).order_by('id')
+        done = failed = 0
+        started = time.monotonic()
+
+        while True:
+            ids = list(queryset
+                       .filter(id__gt=position)
+                       .values_list('id', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            tasks = [(label, pk) for pk in ids]
+            results = pool.imap_unordered(render, tasks) if pool \
+                else map(render, tasks)
+            for pk, error in results:
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{label} image {pk}: {error}')
+
+            # Failed images stay behind the checkpoint until --restart
+            position = ids[-1]
+            Checkpoint.objects.filter(name=name).update(
+                position=position, updated_at=timezone.now())
+            done += len(ids)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{label}: {done} images up to id {position}, '
+                f'{done / elapsed:.1f}/s, {failed / done:.1%} failed')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: backfilled {done - failed} images, {failed} failed'))
@@ -0,0 +1,156 @@
+"""
+Django command to benchmark the category filter on a large listing table
+"""
+
+import random
+import statistics
+import time
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.category_tree import descendant_ids
+from core.models import Address, Category, Listing
+from listing.views import filter_by_categories
+
+BENCHMARK_EMAIL = 'benchmark@example.com'
+BATCH_SIZE = 10000
+# Seeded rows get descriptions about as long as real ones, since DISTINCT
+# compares whole rows
+WORDS = ('vintage', 'guitar', 'amp', 'tube', 'drum', 'kit', 'cymbal',
+         'pedal', 'bass', 'case', 'strap', 'mint', 'condition', 'rental',
+         'weekend', 'studio', 'gig', 'pickup', 'lightly', 'used')
+MAKES = ('Fender', 'Gibson', 'Ludwig', 'Marshall', 'Roland', 'Yamaha')
+
+
+class Command(BaseCommand):
+    """Compare the join + DISTINCT category filter with the EXISTS one,
+    and with an IN subquery"""
+    help = 'Benchmark DISTINCT vs EXISTS vs IN category filtering'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000,
+                            help='Listings to seed before benchmarking')
+        parser.add_argument('--categories', type=int, default=50,
+                            help='Categories to spread the listings over')
+        parser.add_argument('--filter', type=int, default=3,
+                            help='Number of categories to filter by')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--explain', action='store_true',
+                            help='Print the EXPLAIN ANALYZE plan of each '
+                            'first page query')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the seeded data and exit')
+
+    def _user(self):
+        User = get_user_model()
+        user = User.objects.filter(email=BENCHMARK_EMAIL).first()
+        if user is None:
+            user = User.objects.create_user(
+                email=BENCHMARK_EMAIL,
+                first_name='Bench',
+                last_name='Mark',
+                phone_number='+12025550100')
+        return user
+
+    def _seed(self, user, num_listings, num_categories):
+        """Top the benchmark user up to the requested number of listings"""
+        categories = list(Category.objects.filter(
+            name__startswith='benchmark-').values_list('id', flat=True))
+        for i in range(len(categories), num_categories):
+            categories.append(
+                Category.objects.create(name=f'benchmark-{i}').id)
+
+        existing = Listing.objects.filter(user=user).count()
+        if existing >= num_listings:
+            return categories
+        address, _ = Address.objects.get_or_create(
+            address_1='1 Benchmark Way', city='Los Angeles',
+            state='CA', zip_code='90007')
+        rng = random.Random(existing)
+        Through = Listing.category.through
+        for start in range(existing, num_listings, BATCH_SIZE):
+            size = min(BATCH_SIZE, num_listings - start)
+            with transaction.atomic():
+                listings = Listing.objects.bulk_create([
+                    Listing(user=user, address=address,
+                            title=f'Benchmark listing {start + i}',
+                            description=' '.join(
+                                rng.choices(WORDS, k=rng.randint(20, 200))),
+                            make=rng.choice(MAKES),
+                            model=f'Model {rng.randint(1, 500)}',
+                            year=rng.randint(1950, 2023),
+                            price_cents=rng.randint(500, 50000))
+                    for i in range(size)])
+                Through.objects.bulk_create([
+                    Through(listing_id=listing.id, category_id=category)
+                    for listing in listings
+                    for category in rng.sample(categories, rng.randint(1, 3))
+                ])
+            self.stdout.write(f'Seeded {start + size}/{num_listings}')
+        return categories
+
+    def _time(self, funcs, repeat):
+        """Return {name: median run time in milliseconds} of funcs
+
+        Runs are interleaved, so a busy moment or a warming cache slows
+        every function alike rather than whichever happened to run then.
+        """
+        for func in funcs.values():
+            func()
+        timings = {name: [] for name in funcs}
+        for _ in range(repeat):
+            for name, func in funcs.items():
+                start = time.perf_counter()
+                func()
+                timings[name].append((time.perf_counter() - start) * 1000)
+        return {name: statistics.median(runs)
+                for name, runs in timings.items()}
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            get_user_model().objects.filter(email=BENCHMARK_EMAIL).delete()
+            Category.objects.filter(name__startswith='benchmark-').delete()
+            self.stdout.write(self.style.SUCCESS('Benchmark data removed'))
+            return
+
+        user = self._user()
+        categories = self._seed(user, options['listings'],
+                                options['categories'])
+        cat_ids = categories[:options['filter']]
+        page = options['page_size']
+        # Built on every run, so each shape pays for resolving the subtrees
+        queries = {
+            'DISTINCT': lambda: Listing.objects
+            .filter(category__id__in=descendant_ids(cat_ids))
+            .order_by('-id')
+            .distinct(),
+            'EXISTS': lambda: filter_by_categories(
+                Listing.objects.all(), cat_ids).order_by('-id'),
+            'IN': lambda: Listing.objects
+            .filter(pk__in=Listing.category.through.objects
+                    .filter(category_id__in=descendant_ids(cat_ids))
+                    .values('listing_id'))
+            .order_by('-id'),
+        }
+        paths = {
+            'first page': lambda query: list(query()[:page]),
+            'page 100': lambda query: list(query()[page * 100:page * 101]),
+            'count': lambda query: query().count(),
+        }
+
+        repeat = options['repeat']
+        results = {
+            path: self._time({name: partial(run, query)
+                              for name, query in queries.items()}, repeat)
+            for path, run in paths.items()
+        }
+        for name in queries:
+            self.stdout.write(f'{name:<9}' + ''.join(
+                f' {path} {results[path][name]:8.1f}ms' for path in paths))
+            if options['explain']:
+                self.stdout.write(queries[name]()[:page]
+                                  .explain(analyze=True))
@@ -0,0 +1,106 @@
+"""
+Django command to EXPLAIN the list queryset of every registered viewset
+"""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.urls import get_resolver, URLPattern, URLResolver
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.viewsets import GenericViewSet
+
+from core.slow_queries import explain, plan_nodes
+
+
+def registered_viewsets(patterns=None):
+    """Yield (namespaced URL name, class) once for each routed viewset"""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    seen = set()
+    stack = [(pattern, '') for pattern in reversed(patterns)]
+    while stack:
+        pattern, namespace = stack.pop()
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace:
+                namespace = f'{namespace}{pattern.namespace}:'
+            stack.extend((child, namespace)
+                         for child in reversed(pattern.url_patterns))
+            continue
+        if not isinstance(pattern, URLPattern):
+            continue
+        cls = getattr(pattern.callback, 'cls', None)
+        actions = getattr(pattern.callback, 'actions', None) or {}
+        if (cls is None or cls in seen or
+                not issubclass(cls, GenericViewSet) or
+                actions.get('get') != 'list'):
+            continue
+        seen.add(cls)
+        name = f'{namespace}{pattern.name}' if pattern.name else None
+        yield name or cls.__name__, cls
+
+
+class Command(BaseCommand):
+    """Django command to flag viewset queries that scan whole tables"""
+    help = 'EXPLAIN each viewset list queryset and flag sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of the user to query as '
+                            '(defaults to the first superuser)')
+        parser.add_argument('--param', action='append', default=[],
+                            metavar='KEY=VALUE',
+                            help='Query parameter to pass to every viewset')
+        parser.add_argument('--force-index', action='store_true',
+                            help='Disable seq scans so only scans without '
+                            'a usable index are flagged')
+        parser.add_argument('--strict', action='store_true',
+                            help='Exit with an error if any scan is flagged')
+
+    def _user(self, email):
+        User = get_user_model()
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'No user with email {email}')
+        user = User.objects.filter(is_superuser=True).order_by('id').first()
+        return user or AnonymousUser()
+
+    def _queryset(self, cls, user, params):
+        request = Request(APIRequestFactory().get('/', params))
+        request.user = user
+        view = cls(request=request, args=(), kwargs={},
+                   format_kwarg=None, action='list')
+        return view.get_queryset()
+
+    def handle(self, *args, **options):
+        user = self._user(options['user'])
+        params = dict(param.split('=', 1) for param in options['param'])
+        flagged = 0
+
+        for name, cls in registered_viewsets():
+            try:
+                queryset = self._queryset(cls, user, params)
+                sql, sql_params = queryset.query \
+                    .get_compiler(using=queryset.db).as_sql()
+                with transaction.atomic(using=queryset.db):
+                    if options['force_index']:
+                        with connections[queryset.db].cursor() as cursor:
+                            cursor.execute('SET LOCAL enable_seqscan = off')
+                    plan = explain(sql, sql_params, using=queryset.db)
+            except Exception as e:
+                self.stdout.write(f'{name}: skipped ({e})')
+                continue
+
+            scans = [node for node in plan_nodes(plan)
+                     if node.startswith('Seq Scan')]
+            if scans:
+                flagged += 1
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: {", ".join(scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+
+        if flagged and options['strict']:
+            raise CommandError(f'{flagged} viewset(s) use sequential scans')
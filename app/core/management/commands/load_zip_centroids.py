@@ -0,0 +1,95 @@
+"""
+Django command to load US zip code centroids for proximity search
+"""
+
+import csv
+import io
+import os
+import zipfile
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.geo import backfill_addresses
+from core.models import ZipCentroid
+
+# Accepted header names, including the Census Gazetteer ZCTA file's
+COLUMNS = {
+    'zip_code': ('zip_code', 'zip', 'GEOID'),
+    'latitude': ('latitude', 'lat', 'INTPTLAT'),
+    'longitude': ('longitude', 'lon', 'lng', 'INTPTLONG'),
+}
+BATCH_SIZE = 5000
+# Shipped in the image, see core/data/README.md for its source and license
+BUNDLED_CENTROIDS = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'data', 'zip_centroids.csv')
+
+
+@contextmanager
+def open_centroids(source):
+    """Open a centroid file as text, unzipping it if it is an archive"""
+    try:
+        f = open(source, 'rb')
+    except OSError as e:
+        raise CommandError(f'Could not read {source}: {e}')
+    with f:
+        if not zipfile.is_zipfile(f):
+            f.seek(0)
+            yield io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+            return
+        with zipfile.ZipFile(f) as archive:
+            members = [name for name in archive.namelist()
+                       if name.endswith(('.txt', '.csv'))]
+            if len(members) != 1:
+                raise CommandError(f'{source} should hold one .txt or '
+                                   '.csv file')
+            with archive.open(members[0]) as member:
+                yield io.TextIOWrapper(member, encoding='utf-8-sig',
+                                       newline='')
+
+
+def read_centroids(f, source):
+    """Yield ZipCentroid rows from a CSV or tab separated text file"""
+    dialect = csv.Sniffer().sniff(f.readline(), delimiters=',\t')
+    f.seek(0)
+    reader = csv.reader(f, dialect)
+    header = [name.strip() for name in next(reader)]
+    try:
+        index = {field: next(header.index(name) for name in names
+                             if name in header)
+                 for field, names in COLUMNS.items()}
+    except StopIteration:
+        raise CommandError(f'{source} needs zip code, latitude and '
+                           'longitude columns')
+    for row in reader:
+        yield ZipCentroid(
+            zip_code=row[index['zip_code']].strip().zfill(5),
+            latitude=float(row[index['latitude']]),
+            longitude=float(row[index['longitude']]))
+
+
+class Command(BaseCommand):
+    """Django command to replace the zip centroid table from a file"""
+    help = 'Load zip code centroids and geocode existing addresses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=BUNDLED_CENTROIDS,
+                            help='Path of a CSV of zip_code,latitude,'
+                            'longitude or a Census Gazetteer ZCTA file, '
+                            'optionally zipped (defaults to the bundled '
+                            'core/data/zip_centroids.csv)')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        with open_centroids(source) as f, transaction.atomic():
+            ZipCentroid.objects.all().delete()
+            centroids = ZipCentroid.objects.bulk_create(
+                read_centroids(f, source), batch_size=BATCH_SIZE)
+            if not centroids:
+                # Keep what was loaded before
+                raise CommandError(f'{source} holds no zip centroids')
+            addresses = backfill_addresses()
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {len(centroids)} zip centroids, '
+            f'geocoded {addresses} addresses'))
@@ -0,0 +1,17 @@
+"""
+Django command to rebuild the category closure table
+"""
+
+from django.core.management.base import BaseCommand
+
+from core.category_tree import rebuild_closure
+
+
+class Command(BaseCommand):
+    """Django command to recompute CategoryClosure from Category rows"""
+    help = 'Rebuild the category closure table from the category tree'
+
+    def handle(self, *args, **options):
+        count = rebuild_closure()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt closure table for {count} categories'))
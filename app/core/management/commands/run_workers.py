@@ -0,0 +1,105 @@
+"""
+Django command to run background jobs from the job queue
+"""
+
+import multiprocessing
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+from core.images import collect_blobs
+from core.metrics import registry
+
+# Idle workers put back stale jobs, purge old ones and delete unused
+# images this often
+HOUSEKEEPING_SECONDS = 60
+
+
+def work(stop, poll_interval, once):
+    """Claim and run jobs one at a time until stop is set"""
+    housekeeping = 0
+    while not stop.is_set():
+        # Throttled by METRICS_FLUSH_INTERVAL, so idle workers flush too
+        registry.flush()
+        ids = jobs.claim()
+        if ids:
+            jobs.run(ids[0])
+            continue
+        if once:
+            break
+        if time.monotonic() - housekeeping > HOUSEKEEPING_SECONDS:
+            jobs.requeue_stale()
+            jobs.purge()
+            collect_blobs()
+            housekeeping = time.monotonic()
+        stop.wait(poll_interval)
+
+
+def _child(stop, poll_interval, once):
+    jobs.init_worker()
+    work(stop, poll_interval, once)
+    registry.flush(force=True)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    """Django command to run queued jobs in a pool of worker processes"""
+    help = 'Run background jobs from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Worker processes to run, 0 to run jobs '
+                            'in this process (defaults to the CPU count)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds an idle worker waits between '
+                            'polls of the queue')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        poll_interval, once = options['poll_interval'], options['once']
+        in_process = options['processes'] < 1
+        context = multiprocessing.get_context('fork') if in_process \
+            else jobs.fork_context()
+        stop = context.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping after the current jobs')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        if in_process:
+            work(stop, poll_interval, once)
+            return
+
+        workers = {}
+
+        def start(slot):
+            process = context.Process(target=_child,
+                                      args=(stop, poll_interval, once),
+                                      name=f'worker-{slot}')
+            process.start()
+            workers[slot] = process
+
+        for slot in range(options['processes']):
+            start(slot)
+        self.stdout.write(f'Started {len(workers)} workers')
+
+        while workers:
+            for slot, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                del workers[slot]
+                if process.exitcode and not stop.is_set():
+                    self.stderr.write(f'{process.name} exited with '
+                                      f'{process.exitcode}, restarting')
+                    start(slot)
+            stop.wait(1)
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
@@ -0,0 +1,52 @@
+"""
+Django command to dump the slow query log
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.models import SlowQuery
+from core.slow_queries import plan_nodes
+
+
+class Command(BaseCommand):
+    """Django command to dump the slowest recorded statements"""
+    help = 'Show the slowest statements recorded by the slow query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Number of statements to show')
+        parser.add_argument('--json', action='store_true',
+                            help='Output JSON including full plans')
+        parser.add_argument('--reset', action='store_true',
+                            help='Clear the log after dumping it')
+
+    def handle(self, *args, **options):
+        queries = SlowQuery.objects.order_by('-total_ms')[:options['limit']]
+
+        if options['json']:
+            self.stdout.write(json.dumps([{
+                'fingerprint': query.fingerprint,
+                'statement': query.statement,
+                'sample_sql': query.sample_sql,
+                'sample_params': query.sample_params,
+                'view': query.view,
+                'calls': query.calls,
+                'total_ms': query.total_ms,
+                'max_ms': query.max_ms,
+                'plan': query.plan,
+            } for query in queries], indent=2))
+        else:
+            for query in queries:
+                self.stdout.write(self.style.WARNING(
+                    f'{query.fingerprint}  calls={query.calls}  '
+                    f'total={query.total_ms:.1f}ms  '
+                    f'mean={query.total_ms / query.calls:.1f}ms  '
+                    f'max={query.max_ms:.1f}ms  view={query.view or "-"}'))
+                self.stdout.write(f'  {query.statement}')
+                for node in plan_nodes(query.plan):
+                    self.stdout.write(f'    -> {node}')
+
+        if options['reset']:
+            SlowQuery.objects.all().delete()
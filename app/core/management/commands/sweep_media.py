@@ -0,0 +1,155 @@
+"""
+Django command to find and delete stored media no row references
+"""
+
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from core.bloom import BloomFilter
+from core.images import DERIVATIVE_FORMATS
+from core.models import ImageBlob, ListingImage, UserImage
+
+# S3 takes at most this many keys per DeleteObjects call
+MAX_BATCH_SIZE = 1000
+DERIVATIVE_RE = re.compile(
+    r'^(?P<stem>.+)_w\d+\.(%s)$' % '|'.join(
+        re.escape(ext) for _, ext, _ in DERIVATIVE_FORMATS.values()))
+
+
+def referenced_names():
+    """Return a queryset of stored names for each model that holds them"""
+    return [
+        ListingImage.objects.exclude(image='').exclude(image__isnull=True)
+        .values_list('image', flat=True),
+        UserImage.objects.exclude(image='').exclude(image__isnull=True)
+        .values_list('image', flat=True),
+        # Released blobs are left for collect_blobs to delete
+        ImageBlob.objects.values_list('name', flat=True),
+        # Uploads waiting for their process_image job
+        ListingImage.objects.exclude(staged_file='')
+        .values_list('staged_file', flat=True),
+        UserImage.objects.exclude(staged_file='')
+        .values_list('staged_file', flat=True),
+    ]
+
+
+def stored_files(storage, prefix):
+    """Yield (name, size, modified time) for each file under prefix"""
+    if isinstance(storage, S3Boto3Storage):
+        # Listed a page of keys at a time, with sizes and times included
+        location = storage.location.strip('/')
+        key_prefix = f'{location}/{prefix}' if location else prefix
+        for summary in storage.bucket.objects.filter(Prefix=key_prefix):
+            name = summary.key[len(location) + 1:] if location \
+                else summary.key
+            yield name, summary.size, summary.last_modified
+        return
+
+    if not storage.exists(prefix):
+        return
+    directories, files = storage.listdir(prefix)
+    for filename in sorted(files):
+        name = os.path.join(prefix, filename)
+        yield name, storage.size(name), storage.get_modified_time(name)
+    for directory in sorted(directories):
+        yield from stored_files(storage, os.path.join(prefix, directory))
+
+
+def delete_files(storage, names):
+    """Delete names from storage, returning {name: error} for failures"""
+    if not isinstance(storage, S3Boto3Storage):
+        for name in names:
+            storage.delete(name)
+        return {}
+    location = storage.location.strip('/')
+    response = storage.bucket.delete_objects(Delete={
+        'Objects': [{'Key': storage._normalize_name(storage._clean_name(n))}
+                    for n in names],
+        'Quiet': True,
+    })
+    return {(error['Key'][len(location) + 1:] if location
+             else error['Key']): error.get('Message', error['Code'])
+            for error in response.get('Errors', [])}
+
+
+def is_referenced(name, references):
+    """Return whether a stored file or the original it was resized from
+    may be referenced"""
+    if os.path.splitext(name)[0] in references:
+        return True
+    derivative = DERIVATIVE_RE.match(name)
+    return bool(derivative and derivative['stem'] in references)
+
+
+class Command(BaseCommand):
+    """Django command to report or delete media files left behind by
+    deleted and replaced images"""
+    help = 'Report or delete stored media that no image row references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='uploads/',
+                            help='Only sweep files under this directory '
+                            '(defaults to uploads/)')
+        parser.add_argument('--grace', type=float,
+                            default=settings.BLOB_GRACE_SECONDS,
+                            help='Seconds a file must be unmodified before '
+                            'it is swept (defaults to BLOB_GRACE_SECONDS)')
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete the files found instead of only '
+                            'reporting them')
+        parser.add_argument('--batch-size', type=int,
+                            default=MAX_BATCH_SIZE,
+                            help='Files to delete per storage call')
+
+    def handle(self, *args, **options):
+        # Direct uploads are stored before their row exists
+        if options['grace'] < 2 * settings.UPLOAD_INTENT_SECONDS:
+            raise CommandError('--grace must be at least twice '
+                               'UPLOAD_INTENT_SECONDS')
+        if not 0 < options['batch_size'] <= MAX_BATCH_SIZE:
+            raise CommandError(
+                f'--batch-size must be between 1 and {MAX_BATCH_SIZE}')
+        # Only files older than the references read below can be orphans
+        cutoff = timezone.now() - timedelta(seconds=options['grace'])
+
+        querysets = referenced_names()
+        references = BloomFilter(sum(qs.count() for qs in querysets))
+        for queryset in querysets:
+            for name in queryset.iterator(chunk_size=2000):
+                references.add(os.path.splitext(name)[0])
+
+        found = size = failed = 0
+        batch = []
+        for name, file_size, modified in stored_files(default_storage,
+                                                      options['prefix']):
+            if modified >= cutoff or is_referenced(name, references):
+                continue
+            found += 1
+            size += file_size
+            self.stdout.write(name)
+            if options['delete']:
+                batch.append(name)
+                if len(batch) == options['batch_size']:
+                    failed += self.delete(batch)
+                    batch = []
+        if batch:
+            failed += self.delete(batch)
+
+        action = 'Deleted' if options['delete'] else 'Found'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {found - failed} unreferenced files, '
+            f'{size / 1024 ** 2:.1f} MiB'))
+
+    def delete(self, names):
+        """Delete one batch, reporting failures, and return their count"""
+        errors = delete_files(default_storage, names)
+        for name, error in errors.items():
+            self.stderr.write(f'{name}: {error}')
+        return len(errors)
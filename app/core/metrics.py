@@ -0,0 +1,215 @@
+"""
+In-process application metrics
+
+Each uwsgi worker keeps its own counters and histograms in memory and
+periodically dumps them to METRICS_DIR/<source>-<pid>.json. The /metrics view
+merges every worker's file so a scrape sees the whole task, not a single
+worker. The job workers write to the same directory under their own
+METRICS_SOURCE, so their metrics are served by the api container too.
+"""
+
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _label_key(labels):
+    """Return a hashable, order independent key for a label dict"""
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels, extra=None):
+    """Format labels the way the Prometheus text format expects"""
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ''
+    parts = []
+    for key, value in items:
+        value = str(value).replace('\\', '\\\\') \
+            .replace('"', '\\"') \
+            .replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """Counters and fixed-bucket histograms for a single process"""
+
+    def __init__(self, directory=None, flush_interval=None, source=None):
+        self._directory = directory
+        self._source = source
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return self._directory
+        return getattr(settings, 'METRICS_DIR', None)
+
+    @property
+    def source(self):
+        if self._source is not None:
+            return self._source
+        return getattr(settings, 'METRICS_SOURCE', 'api')
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+    def inc(self, name, labels=None, value=1):
+        """Increment a counter"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None, buckets=DEFAULT_BUCKETS):
+        """Record a value in a histogram"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = {
+                    'buckets': list(buckets),
+                    'counts': [0] * len(buckets),
+                    'sum': 0,
+                    'count': 0,
+                }
+                self._histograms[key] = hist
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+                    break
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def snapshot(self):
+        """Return a JSON serializable copy of this process's metrics"""
+        with self._lock:
+            return {
+                'counters': [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    [name, dict(labels), dict(hist,
+                                              counts=list(hist['counts']))]
+                    for (name, labels), hist in self._histograms.items()
+                ],
+            }
+
+    def flush(self, force=False):
+        """Write this process's metrics to the shared directory"""
+        directory = self.directory
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        # Containers have their own pid namespaces, so pids can clash
+        path = os.path.join(directory, f'{self.source}-{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _snapshots(self):
+        directory = self.directory
+        if not directory:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # A worker may be mid-write or gone; skip its file.
+                continue
+        return snapshots
+
+    def collect(self):
+        """Merge the metrics of every worker"""
+        counters = {}
+        histograms = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot['counters']:
+                key = (name, _label_key(labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, hist in snapshot['histograms']:
+                key = (name, _label_key(labels))
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = dict(hist, counts=list(hist['counts']))
+                    continue
+                merged['counts'] = [
+                    a + b for a, b in zip(merged['counts'], hist['counts'])]
+                merged['sum'] += hist['sum']
+                merged['count'] += hist['count']
+        return counters, histograms
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                lines.append(f'# TYPE {name} counter')
+                seen.add(name)
+            lines.append(
+                f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), hist in sorted(histograms.items()):
+            if name not in seen:
+                lines.append(f'# TYPE {name} histogram')
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                cumulative += count
+                le = _format_labels(labels, [('le', _format_value(bound))])
+                lines.append(f'{name}_bucket{le} {cumulative}')
+            le = _format_labels(labels, [('le', '+Inf')])
+            lines.append(f'{name}_bucket{le} {hist["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} '
+                         f'{_format_value(hist["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} '
+                         f'{hist["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Drop all metrics held by this process"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup so hit ratios can be derived per cache"""
+    registry.inc('cache_requests_total',
+                 {'cache': cache, 'result': 'hit' if hit else 'miss'})
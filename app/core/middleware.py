@@ -0,0 +1,202 @@
+"""
+Middleware for the app
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import uuid
+from contextlib import contextmanager, ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.db import routers
+from core.metrics import registry, QUERY_COUNT_BUCKETS
+from core.slow_queries import SlowQueryRecorder
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """Install an execute wrapper on the connection of every alias"""
+    # Reads on ReplicaReadMixin viewsets use the replica's connection
+    with ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(wrapper))
+        yield
+
+
+class QueryCounter:
+    """Database execute wrapper that counts queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryTimeline:
+    """Database execute wrapper that records when each query ran"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'start_ms': round((start - self.start) * 1000, 3),
+                'duration_ms': round(
+                    (time.perf_counter() - start) * 1000, 3),
+                'sql': sql,
+                'params': None if many else repr(params),
+            })
+
+
+class MetricsMiddleware:
+    """Record request counts, latency and query counts per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with execute_wrapper(counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        labels = {'method': request.method, 'view': view}
+        registry.inc('http_requests_total',
+                     dict(labels, status=response.status_code))
+        registry.observe('http_request_duration_seconds', elapsed, labels)
+        registry.inc('db_queries_total', {'view': view}, counter.count)
+        registry.observe('db_queries_per_request', counter.count,
+                         {'view': view}, buckets=QUERY_COUNT_BUCKETS)
+        registry.flush()
+        return response
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+PROFILE_MODES = ('1', 'attach', 'store')
+
+
+class ProfilerMiddleware:
+    """
+    Profile a single request on demand for staff users.
+
+    Send `X-Profile: attach` (or `?profile=1`) to get the cProfile stats and
+    SQL timeline back as a JSON attachment instead of the normal response.
+    Send `X-Profile: store` to keep the normal response and have the
+    profile written to PROFILER_DIR, named by the X-Profile-Id header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _mode(self, request):
+        mode = request.META.get(PROFILE_HEADER) \
+            or request.GET.get(PROFILE_PARAM)
+        if mode not in PROFILE_MODES:
+            return None
+        return 'store' if mode == 'store' else 'attach'
+
+    def _is_staff(self, request):
+        try:
+            auth = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return auth is not None and auth[0].is_staff
+
+    def __call__(self, request):
+        mode = self._mode(request)
+        if mode is None or not self._is_staff(request):
+            return self.get_response(request)
+
+        timeline = QueryTimeline()
+        profiler = cProfile.Profile()
+        with execute_wrapper(timeline):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        total = time.perf_counter() - timeline.start
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream) \
+            .sort_stats('cumulative') \
+            .print_stats(50)
+        report = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status_code': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'num_queries': len(timeline.queries),
+            'sql': timeline.queries,
+            'profile': stream.getvalue(),
+        }
+        profile_id = uuid.uuid4().hex
+
+        if mode == 'store':
+            directory = settings.PROFILER_DIR
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+            with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+                json.dump(report, f, indent=2)
+            response['X-Profile-Id'] = profile_id
+            return response
+
+        attachment = HttpResponse(json.dumps(report, indent=2),
+                                  content_type='application/json')
+        attachment['Content-Disposition'] = \
+            f'attachment; filename="profile-{profile_id}.json"'
+        return attachment
+
+
+class SlowQueryMiddleware:
+    """Log the statements of each request that exceed the threshold"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_THRESHOLD_MS < 0:
+            return self.get_response(request)
+        with execute_wrapper(SlowQueryRecorder(request)):
+            return self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """Keep users that just wrote on the primary for a few seconds"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start_request()
+        try:
+            with execute_wrapper(routers.record_writes):
+                response = self.get_response(request)
+            # DRF sets the token's user on the request it wraps
+            user = getattr(request, 'user', None)
+            if settings.REPLICA_DATABASE and routers.wrote_in_request() \
+                    and user is not None and user.is_authenticated:
+                routers.pin(user)
+        finally:
+            routers.end_request()
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.22 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_auto_20231031_2356'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=16, unique=True)),
+                ('statement', models.TextField()),
+                ('sample_sql', models.TextField()),
+                ('sample_params', models.TextField(blank=True)),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('plan', models.JSONField(null=True)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+    ]
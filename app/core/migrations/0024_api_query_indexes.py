@@ -0,0 +1,56 @@
+# Generated by Django 3.2.22 on 2026-10-19 11:03
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0023_slowquery'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='address',
+            index=models.Index(fields=['city'], name='address_city_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='listing',
+            index=models.Index(fields=['user', '-id'], name='listing_user_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='listing',
+            index=models.Index(fields=['created_at'], name='listing_created_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='saved',
+            index=models.Index(fields=['user', '-id'], name='saved_user_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='listingreview',
+            index=models.Index(fields=['listing', 'created_at'], name='review_listing_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(fields=['user', '-id'], name='orders_user_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(fields=['lender', '-id'], name='orders_lender_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(fields=['listing', 'status'], name='orders_listing_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(condition=models.Q(('status', 'Approved')), fields=['user', 'listing'], name='orders_approved_renter_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(condition=models.Q(('status', 'Approved')), fields=['lender', 'user'], name='orders_approved_lender_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.22 on 2026-10-19 11:41
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0024_api_query_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(fields=['user', 'status', '-id'], name='orders_user_status_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='orders',
+            index=models.Index(fields=['lender', 'status', '-id'], name='orders_lender_status_id_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.22 on 2026-10-19 12:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    CategoryClosure = apps.get_model('core', 'CategoryClosure')
+    parents = dict(Category.objects.values_list('id', 'parent_category_id'))
+    rows = []
+    for category_id in parents:
+        ancestor_id, depth = category_id, 0
+        seen = set()
+        while ancestor_id is not None:
+            if ancestor_id in seen:
+                raise ValueError(
+                    f'Category {category_id} is its own ancestor through '
+                    f'category {ancestor_id}; point one of them at a new '
+                    'parent_category before migrating')
+            seen.add(ancestor_id)
+            rows.append(CategoryClosure(
+                ancestor_id=ancestor_id,
+                descendant_id=category_id,
+                depth=depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    CategoryClosure.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_orders_status_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='core.category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='core.category')),
+            ],
+            options={
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='categoryclosure',
+            index=models.Index(fields=['descendant', 'depth'], name='closure_descendant_idx'),
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
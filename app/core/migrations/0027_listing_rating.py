@@ -0,0 +1,33 @@
+# Generated by Django 3.2.22 on 2026-10-19 13:10
+
+from django.db import migrations, models
+from django.db.models import Avg, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating(apps, schema_editor):
+    Listing = apps.get_model('core', 'Listing')
+    ListingReview = apps.get_model('core', 'ListingReview')
+    average = ListingReview.objects \
+        .filter(listing=OuterRef('pk')) \
+        .values('listing') \
+        .annotate(average=Avg('stars')) \
+        .values('average')
+    Listing.objects.update(rating=Coalesce(
+        Subquery(average, output_field=models.FloatField()), Value(0.0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_rating, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.22 on 2026-10-19 13:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0027_listing_rating'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='listing',
+            index=models.Index(fields=['price_cents', 'id'], name='listing_price_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='listing',
+            index=models.Index(fields=['rating', 'id'], name='listing_rating_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='listing',
+            index=models.Index(fields=['year', 'price_cents'], name='listing_year_price_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='listing',
+            index=models.Index(django.db.models.functions.text.Upper('make'), django.db.models.functions.text.Upper('model'), models.F('price_cents'), name='listing_make_model_idx'),
+        ),
+    ]
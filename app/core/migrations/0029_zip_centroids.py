@@ -0,0 +1,38 @@
+# Generated by Django 3.2.22 on 2026-10-19 13:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0028_listing_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZipCentroid',
+            fields=[
+                ('zip_code', models.CharField(max_length=5, primary_key=True, serialize=False)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='address',
+            index=models.Index(fields=['latitude', 'longitude'], name='address_lat_lon_idx'),
+        ),
+    ]
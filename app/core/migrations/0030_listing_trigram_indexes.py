@@ -0,0 +1,27 @@
+# Generated by Django 3.2.22 on 2026-10-19 14:05
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0029_zip_centroids'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS listing_make_trgm_idx '
+            'ON core_listing USING gin (UPPER(make) gin_trgm_ops)',
+            'DROP INDEX CONCURRENTLY IF EXISTS listing_make_trgm_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS listing_model_trgm_idx '
+            'ON core_listing USING gin (UPPER(model) gin_trgm_ops)',
+            'DROP INDEX CONCURRENTLY IF EXISTS listing_model_trgm_idx',
+        ),
+    ]
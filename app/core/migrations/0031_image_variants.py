@@ -0,0 +1,23 @@
+# Generated by Django 3.2.22 on 2026-10-19 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_listing_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
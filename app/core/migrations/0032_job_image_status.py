@@ -0,0 +1,57 @@
+# Generated by Django 3.2.22 on 2026-10-19 15:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('Queued', 'Queued'), ('Running', 'Running'), ('Done', 'Done'), ('Failed', 'Failed')], default='Queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status', 'Queued')), fields=['run_after', 'id'], name='job_queued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'finished_at'], name='job_status_finished_idx'),
+        ),
+        migrations.AddField(
+            model_name='listingimage',
+            name='staged_file',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='listingimage',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Ready', 'Ready'), ('Failed', 'Failed')], default='Ready', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='staged_file',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Ready', 'Ready'), ('Failed', 'Failed')], default='Ready', max_length=20),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.22 on 2026-10-19 16:45
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0033_imageblob'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='listingimage',
+            index=models.Index(condition=models.Q(('status', 'Ready')), fields=['listing', 'order', 'id'], name='listingimage_primary_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.22 on 2026-10-19 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplicaPin',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('until', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -2,13 +2,15 @@
 Database models
 """
 
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Upper
 from django.contrib.auth.models import (
                                         AbstractBaseUser,
                                         BaseUserManager,
                                         PermissionsMixin
                                         )
 from django.conf import settings
+from django.utils import timezone
 import uuid
 import os
 from django.core.exceptions import ValidationError
@@ -63,7 +65,7 @@ class UserManager(BaseUserManager):
                         **extra_fields
                         )
         user.set_password(password)
-        user.save(using=self.db)
+        user.save(using=self._db)
         return user
 
     def create_superuser(
@@ -108,6 +110,16 @@ class User(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = ['first_name', 'last_name', 'phone_number']
 
 
+IMAGE_STATUS_PENDING = 'Pending'
+IMAGE_STATUS_READY = 'Ready'
+IMAGE_STATUS_FAILED = 'Failed'
+IMAGE_STATUS_CHOICES = [
+    (IMAGE_STATUS_PENDING, 'Pending'),
+    (IMAGE_STATUS_READY, 'Ready'),
+    (IMAGE_STATUS_FAILED, 'Failed'),
+]
+
+
 class UserImage(models.Model):
     """User images"""
     user_id = models.ForeignKey(
@@ -115,6 +127,24 @@ class UserImage(models.Model):
                                 on_delete=models.CASCADE,
                                 related_name='image')
     image = models.ImageField(null=True, upload_to=user_image_file_path)
+    # See core.images
+    variants = models.JSONField(default=dict, blank=True)
+    # Uploads wait in staging storage until a worker processes them
+    staged_file = models.CharField(max_length=255, blank=True)
+    status = models.CharField(
+                                max_length=20,
+                                choices=IMAGE_STATUS_CHOICES,
+                                default=IMAGE_STATUS_READY)
+
+
+class ZipCentroid(models.Model):
+    """Center point of a US zip code, loaded by load_zip_centroids"""
+    zip_code = models.CharField(max_length=5, primary_key=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    def __str__(self):
+        return self.zip_code
 
 
 class Address(models.Model):
@@ -127,6 +157,23 @@ class Address(models.Model):
     city = models.CharField(_("city"), max_length=64, default="Los Angeles")
     state = USStateField(_("state"), default="CA")
     zip_code = models.CharField(_("zip code"), max_length=5, default="90007")
+    # Copied from ZipCentroid on save so proximity search needs no join
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city'], name='address_city_idx'),
+            models.Index(fields=['latitude', 'longitude'],
+                         name='address_lat_lon_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        centroid = ZipCentroid.objects.filter(zip_code=self.zip_code) \
+            .values_list('latitude', 'longitude') \
+            .first()
+        self.latitude, self.longitude = centroid or (None, None)
+        super().save(*args, **kwargs)
 
 
 class UnavailableDate(models.Model):
@@ -146,6 +193,10 @@ class UnavailableDate(models.Model):
         return str(self.date)
 
 
+# Advisory lock key taken while a category is moved
+CATEGORY_TREE_LOCK = 7201
+
+
 class Category(models.Model):
     """ Category for filtering instruments"""
     name = models.CharField(max_length=255)
@@ -160,6 +211,56 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def _creates_cycle(self, using=None):
+        return self.pk is not None and \
+            self.parent_category_id is not None and \
+            CategoryClosure.objects.using(using).filter(
+                ancestor_id=self.pk,
+                descendant_id=self.parent_category_id).exists()
+
+    def clean(self, using=None):
+        if self._creates_cycle(using):
+            raise ValidationError({'parent_category': _(
+                'A category cannot be moved under itself.')})
+
+    def save(self, *args, **kwargs):
+        # The closure table is updated by a post_save signal; a failure
+        # there must undo the save too
+        using = kwargs.get('using') or \
+            router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            if self.pk is not None and self.parent_category_id is not None:
+                # Moves are serialized so that two of them cannot close a
+                # loop that neither sees on its own
+                with connections[using].cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)',
+                                   [CATEGORY_TREE_LOCK])
+                self.clean(using)
+            super().save(*args, **kwargs)
+
+
+class CategoryClosure(models.Model):
+    """
+    Every (ancestor, descendant) pair of the category tree, including each
+    category paired with itself at depth 0. Kept in sync by core.signals.
+    """
+    ancestor = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        related_name='descendant_links')
+    descendant = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth'],
+                         name='closure_descendant_idx'),
+        ]
+
 
 class Listing(models.Model):
     """Listing object"""
@@ -178,6 +279,27 @@ class Listing(models.Model):
     unavailable_dates = models.ManyToManyField('UnavailableDate')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(null=True)
+    # Average review stars, kept up to date by core.signals for sorting
+    rating = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='listing_user_id_idx'),
+            models.Index(fields=['created_at'],
+                         name='listing_created_at_idx'),
+            models.Index(fields=['price_cents', 'id'],
+                         name='listing_price_id_idx'),
+            models.Index(fields=['rating', 'id'],
+                         name='listing_rating_id_idx'),
+            models.Index(fields=['year', 'price_cents'],
+                         name='listing_year_price_idx'),
+            models.Index(Upper('make'), Upper('model'),
+                         models.F('price_cents'),
+                         name='listing_make_model_idx'),
+        ]
+        # Trigram GIN indexes on UPPER(make) and UPPER(model) for
+        # autocomplete are created in 0030_listing_trigram_indexes, as
+        # Index can't put an operator class on an expression.
 
     @property
     def avg_stars(self) -> Union[float, int]:
@@ -208,6 +330,22 @@ class ListingImage(models.Model):
                                 related_name='image')
     image = models.ImageField(null=True, upload_to=listing_image_file_path)
     order = models.IntegerField(default=1)
+    # See core.images
+    variants = models.JSONField(default=dict, blank=True)
+    # Uploads wait in staging storage until a worker processes them
+    staged_file = models.CharField(max_length=255, blank=True)
+    status = models.CharField(
+                                max_length=20,
+                                choices=IMAGE_STATUS_CHOICES,
+                                default=IMAGE_STATUS_READY)
+
+    class Meta:
+        indexes = [
+            # First ready image of each listing, see ListingSerializer
+            models.Index(fields=['listing', 'order', 'id'],
+                         condition=models.Q(status=IMAGE_STATUS_READY),
+                         name='listingimage_primary_idx'),
+        ]
 
 
 class Saved(models.Model):
@@ -219,6 +357,9 @@ class Saved(models.Model):
 
     class Meta:
         unique_together = ('user', 'listing')
+        indexes = [
+            models.Index(fields=['user', '-id'], name='saved_user_id_idx'),
+        ]
 
 
 class ListingReview(models.Model):
@@ -233,6 +374,10 @@ class ListingReview(models.Model):
 
     class Meta:
         unique_together = ('user', 'listing')
+        indexes = [
+            models.Index(fields=['listing', 'created_at'],
+                         name='review_listing_created_idx'),
+        ]
 
 
 ORDER_STATUS_PENDING = 'Pending'
@@ -283,6 +428,26 @@ class Orders(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='orders_user_id_idx'),
+            models.Index(fields=['lender', '-id'],
+                         name='orders_lender_id_idx'),
+            models.Index(fields=['listing', 'status'],
+                         name='orders_listing_status_idx'),
+            models.Index(fields=['user', 'status', '-id'],
+                         name='orders_user_status_id_idx'),
+            models.Index(fields=['lender', 'status', '-id'],
+                         name='orders_lender_status_id_idx'),
+            # Review eligibility checks only look at approved orders
+            models.Index(fields=['user', 'listing'],
+                         name='orders_approved_renter_idx',
+                         condition=models.Q(status=ORDER_STATUS_APPROVED)),
+            models.Index(fields=['lender', 'user'],
+                         name='orders_approved_lender_idx',
+                         condition=models.Q(status=ORDER_STATUS_APPROVED)),
+        ]
+
 
 class UserReview(models.Model):
     """Write or see a review for a renter"""
@@ -299,3 +464,109 @@ class UserReview(models.Model):
 
     class Meta:
         unique_together = ('lender', 'renter')
+
+
+class SlowQuery(models.Model):
+    """A statement that ran over SLOW_QUERY_THRESHOLD_MS"""
+    fingerprint = models.CharField(max_length=16, unique=True)
+    statement = models.TextField()
+    sample_sql = models.TextField()
+    sample_params = models.TextField(blank=True)
+    view = models.CharField(max_length=255, blank=True)
+    calls = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    plan = models.JSONField(null=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField()
+
+    def __str__(self):
+        return self.statement[:80]
+
+
+JOB_STATUS_QUEUED = 'Queued'
+JOB_STATUS_RUNNING = 'Running'
+JOB_STATUS_DONE = 'Done'
+JOB_STATUS_FAILED = 'Failed'
+JOB_STATUS_CHOICES = [
+    (JOB_STATUS_QUEUED, 'Queued'),
+    (JOB_STATUS_RUNNING, 'Running'),
+    (JOB_STATUS_DONE, 'Done'),
+    (JOB_STATUS_FAILED, 'Failed'),
+]
+
+
+class Job(models.Model):
+    """A unit of background work, run by the run_workers command"""
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+                                max_length=20,
+                                choices=JOB_STATUS_CHOICES,
+                                default=JOB_STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after', 'id'],
+                         condition=models.Q(status=JOB_STATUS_QUEUED),
+                         name='job_queued_idx'),
+            models.Index(fields=['status', 'finished_at'],
+                         name='job_status_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.id}'
+
+
+class ImageBlob(models.Model):
+    """An image file stored once however many image rows use it
+
+    See core.blobs. refcount counts the ListingImage and UserImage rows
+    whose image is this file.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the last reference goes, so collection can wait a while
+    released_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['released_at'],
+                         condition=models.Q(refcount__lte=0),
+                         name='imageblob_released_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class Checkpoint(models.Model):
+    """How far a resumable management command has got"""
+    name = models.CharField(max_length=100, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} at {self.position}'
+
+
+class ReplicaPin(models.Model):
+    """Until when a user who wrote reads from the primary
+
+    See core.db.routers.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE, primary_key=True)
+    until = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user} until {self.until}'
@@ -0,0 +1,71 @@
+"""
+Signal handlers for the core models
+"""
+
+from django.db import models, transaction
+from django.db.models import Avg, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core import blobs
+from core.category_tree import invalidate_tree, link_category
+from core.images import has_current_derivatives, queue_processing
+from core.models import (
+    Category,
+    Listing,
+    ListingImage,
+    ListingReview,
+    UserImage,
+    )
+
+
+@receiver(post_save, sender=Category)
+def update_category_closure(sender, instance, raw=False, **kwargs):
+    """Keep CategoryClosure in step with parent_category changes"""
+    # Deleting a category cascades to its closure rows and its children
+    if raw:
+        return
+    link_category(instance)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+@receiver(m2m_changed, sender=Listing.category.through)
+def invalidate_category_tree(sender, **kwargs):
+    """Rebuild the cached category tree once the change is committed"""
+    transaction.on_commit(invalidate_tree)
+
+
+@receiver(post_save, sender=ListingReview)
+@receiver(post_delete, sender=ListingReview)
+def update_listing_rating(sender, instance, raw=False, **kwargs):
+    """Recompute the denormalized average rating used for sorting"""
+    if raw:
+        return
+    average = ListingReview.objects \
+        .filter(listing=OuterRef('pk')) \
+        .values('listing') \
+        .annotate(average=Avg('stars')) \
+        .values('average')
+    Listing.objects.filter(pk=instance.listing_id).update(rating=Coalesce(
+        Subquery(average, output_field=models.FloatField()), Value(0.0)))
+
+
+@receiver(post_save, sender=ListingImage)
+@receiver(post_save, sender=UserImage)
+def queue_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize images whose file was set without going through staging"""
+    if raw or instance.staged_file or not instance.image or \
+            has_current_derivatives(instance):
+        return
+    queue_processing(instance)
+
+
+@receiver(post_delete, sender=ListingImage)
+@receiver(post_delete, sender=UserImage)
+def release_image_blob(sender, instance, **kwargs):
+    """Drop the deleted row's reference to its stored file"""
+    blobs.release(instance.image.name)
@@ -0,0 +1,205 @@
+"""
+Slow query log
+
+SlowQueryMiddleware times every statement a request runs. Statements slower
+than SLOW_QUERY_THRESHOLD_MS are grouped by a normalized fingerprint and
+recorded in the SlowQuery table together with the view that issued them.
+The EXPLAIN plan is captured off the request path by a background thread.
+See core.middleware.SlowQueryMiddleware.
+"""
+
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'with')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """Strip literals and placeholders so equivalent statements match"""
+    sql = sql.replace('%s', '?')
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    """Return a short stable hash of the normalized statement"""
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:16]
+
+
+def explain(sql, params, using='default'):
+    """Return the JSON plan of a statement without executing it"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (ANALYZE off, FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan
+
+
+def plan_nodes(plan):
+    """Return a flat list of 'Node Type on relation' for a JSON plan"""
+    nodes = []
+    stack = [entry['Plan'] for entry in plan or []]
+    while stack:
+        node = stack.pop()
+        label = node.get('Node Type', '?')
+        if node.get('Relation Name'):
+            label = f"{label} on {node['Relation Name']}"
+        if node.get('Index Name'):
+            label = f"{label} using {node['Index Name']}"
+        nodes.append(label)
+        stack.extend(reversed(node.get('Plans', [])))
+    return nodes
+
+
+def _add_call(key, duration_ms, using):
+    """Add an execution to an existing entry, return False if there is none"""
+    from core.models import SlowQuery
+
+    return bool(SlowQuery.objects.using(using).filter(fingerprint=key).update(
+        calls=F('calls') + 1,
+        total_ms=F('total_ms') + duration_ms,
+        max_ms=Greatest(F('max_ms'), duration_ms),
+        last_seen=timezone.now(),
+    ))
+
+
+def record(sql, params, duration_ms, view, using='default',
+           ran_on=None):
+    """Store one slow execution and capture its plan if it is new
+
+    The plan is taken on ran_on, the alias the statement ran on, which
+    defaults to using.
+    """
+    from core.models import SlowQuery
+
+    key = fingerprint(sql)
+    if _add_call(key, duration_ms, using):
+        return
+
+    plan = None
+    if sql.lstrip().lower().startswith(EXPLAINABLE):
+        try:
+            ran_on = ran_on or using
+            with transaction.atomic(using=ran_on):
+                plan = explain(sql, params, using=ran_on)
+        except Exception:
+            logger.exception('Could not explain slow query %s', key)
+
+    try:
+        with transaction.atomic(using=using):
+            SlowQuery.objects.using(using).create(
+                fingerprint=key,
+                statement=normalize(sql),
+                sample_sql=sql,
+                sample_params=repr(params),
+                view=view,
+                calls=1,
+                total_ms=duration_ms,
+                max_ms=duration_ms,
+                plan=plan,
+                last_seen=timezone.now(),
+            )
+    except IntegrityError:
+        # Another worker recorded the same statement first
+        _add_call(key, duration_ms, using)
+        return
+    _trim(using)
+
+
+def _trim(using):
+    """Keep only the SLOW_QUERY_LOG_SIZE most expensive fingerprints"""
+    from core.models import SlowQuery
+
+    size = settings.SLOW_QUERY_LOG_SIZE
+    keep = SlowQuery.objects.using(using) \
+        .order_by('-total_ms') \
+        .values_list('id', flat=True)[:size]
+    SlowQuery.objects.using(using).exclude(id__in=list(keep)).delete()
+
+
+class _Worker(threading.Thread):
+    """Daemon thread that records slow queries off the request path"""
+
+    def __init__(self):
+        super().__init__(name='slow-query-log', daemon=True)
+        self.queue = queue.Queue(maxsize=1000)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                record(*item)
+            except Exception:
+                logger.exception('Could not record slow query')
+            finally:
+                for conn in connections.all():
+                    conn.close_if_unusable_or_obsolete()
+                self.queue.task_done()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+_local = threading.local()
+
+
+def submit(sql, params, duration_ms, view, ran_on='default'):
+    """Record a slow query, in the background unless disabled"""
+    global _worker
+    if not settings.SLOW_QUERY_ASYNC:
+        _local.recording = True
+        try:
+            record(sql, params, duration_ms, view, ran_on=ran_on)
+        finally:
+            _local.recording = False
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = _Worker()
+            _worker.start()
+    try:
+        _worker.queue.put_nowait(
+            (sql, params, duration_ms, view, 'default', ran_on))
+    except queue.Full:
+        logger.warning('Slow query log is backed up, dropping a query')
+
+
+class SlowQueryRecorder:
+    """Database execute wrapper that submits statements over the threshold"""
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        if many or getattr(_local, 'recording', False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+            match = getattr(self.request, 'resolver_match', None)
+            view = match.view_name if match else ''
+            submit(sql, params, duration_ms, view,
+                   ran_on=context['connection'].alias)
+        return result
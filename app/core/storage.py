@@ -0,0 +1,71 @@
+"""
+S3 media storage with cheap public URLs
+
+S3Boto3Storage.url has boto3 presign every URL and then strips the
+signature again when AWS_QUERYSTRING_AUTH is off, which costs more than
+the rest of serializing an image row. MediaStorage joins the quoted key
+onto a URL prefix worked out once per process instead: the bucket's own
+endpoint, or AWS_S3_CUSTOM_DOMAIN when media is served through a CDN.
+
+default_storage is created once per process, so its boto3 connection
+serves every request the process handles, through a connection pool of
+AWS_S3_MAX_POOL_CONNECTIONS. It is made again after a fork.
+"""
+
+import os
+import threading
+from urllib.parse import quote, urlsplit
+
+from botocore.config import Config
+from django.conf import settings
+from django.utils.functional import cached_property
+from storages.backends.s3boto3 import S3Boto3Storage
+
+# Stands in for the key when asking boto3 for the bucket's URL
+URL_PLACEHOLDER = 'key'
+
+
+class MediaStorage(S3Boto3Storage):
+    """S3Boto3Storage building unsigned URLs from a cached prefix"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config = self.config.merge(Config(
+            max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS))
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # uwsgi and the job workers fork, never share the parent's sockets
+        if self._pid != os.getpid():
+            self._connections = threading.local()
+            self._bucket = None
+            self._pid = os.getpid()
+
+    @property
+    def connection(self):
+        self._check_fork()
+        return super().connection
+
+    @property
+    def bucket(self):
+        self._check_fork()
+        return super().bucket
+
+    @cached_property
+    def url_prefix(self):
+        """Return what every unsigned URL starts with, up to the key"""
+        if self.custom_domain:
+            return f'{self.url_protocol}//{self.custom_domain}/'
+        # Let boto3 resolve the endpoint and addressing style, once
+        url = self.bucket.meta.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': URL_PLACEHOLDER})
+        url = urlsplit(url)._replace(query='').geturl()
+        return url[:-len(URL_PLACEHOLDER)]
+
+    def url(self, name, parameters=None, expire=None):
+        if parameters or self.querystring_auth:
+            return super().url(name, parameters, expire)
+        name = self._normalize_name(self._clean_name(name))
+        # Quoted the way botocore quotes keys
+        return self.url_prefix + quote(self._encode_name(name), safe='/~')
@@ -4,7 +4,8 @@ Tests for Django admin modifications
 
 """
 
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import Client
@@ -52,3 +53,12 @@ class AdminSiteTests(TestCase):
         url = reverse('admin:core_user_add')
         res = self.client.get(url)
         self.assertEqual(res.status_code, 200)
+
+    @override_settings(UPLOAD_MAX_FILE_BYTES=100)
+    def test_upload_too_large(self):
+        """Test an oversized upload is a bad request, not a server error"""
+        url = reverse("admin:core_user_change", args=[self.user.id])
+        res = self.client.post(url, {
+            'image': SimpleUploadedFile('photo.jpg', b'x' * 1000)})
+
+        self.assertEqual(res.status_code, 400)
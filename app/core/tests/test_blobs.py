@@ -0,0 +1,82 @@
+"""
+Tests for content-addressed image storage
+"""
+
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from django.utils import timezone
+
+from core import blobs
+from core.images import collect_blobs, derivative_name
+from core.models import ImageBlob
+
+SHA256 = 'ab' * 32
+
+
+class BlobTests(TestCase):
+    """Test references to stored files and their collection"""
+
+    def setUp(self):
+        self.name = default_storage.save(blobs.blob_file_path(SHA256, '.JPG'),
+                                         ContentFile(b'image'))
+        self.derivative = default_storage.save(
+            derivative_name(self.name, 160, 'webp'), ContentFile(b'small'))
+
+    def tearDown(self):
+        default_storage.delete(self.name)
+        default_storage.delete(self.derivative)
+
+    def test_blob_file_path(self):
+        """Test files are fanned out by the start of their digest"""
+        self.assertEqual(self.name, f'uploads/blobs/ab/{SHA256}.jpg')
+
+    def test_references(self):
+        """Test references are counted and the last release is recorded"""
+        self.assertIsNone(blobs.add_reference(SHA256))
+        self.assertEqual(blobs.register(SHA256, self.name, 5), self.name)
+        self.assertEqual(blobs.add_reference(SHA256), self.name)
+
+        blobs.release(self.name)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.refcount, 1)
+        self.assertIsNone(blob.released_at)
+        blobs.release(self.name)
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 0)
+        self.assertIsNotNone(blob.released_at)
+
+    def test_register_twice_returns_first(self):
+        """Test a second copy of a stored file gets the first's name"""
+        blobs.register(SHA256, self.name, 5)
+
+        self.assertEqual(blobs.register(SHA256, 'other.jpg', 5), self.name)
+        self.assertEqual(ImageBlob.objects.get().refcount, 2)
+
+    def test_collect_after_grace_period(self):
+        """Test unreferenced files are deleted once the grace period ends"""
+        blobs.register(SHA256, self.name, 5)
+        blobs.release(self.name)
+
+        self.assertEqual(collect_blobs(), 0)
+        self.assertTrue(default_storage.exists(self.name))
+
+        ImageBlob.objects.update(
+            released_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(collect_blobs(), 1)
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(self.name))
+        self.assertFalse(default_storage.exists(self.derivative))
+
+    def test_collect_keeps_referenced(self):
+        """Test files taken again during the grace period are kept"""
+        blobs.register(SHA256, self.name, 5)
+        blobs.release(self.name)
+        blobs.add_reference(SHA256)
+        ImageBlob.objects.update(
+            released_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(collect_blobs(), 0)
+        self.assertTrue(default_storage.exists(self.name))
@@ -0,0 +1,29 @@
+"""
+Tests for the Bloom filter
+"""
+
+from django.test import SimpleTestCase
+
+from core.bloom import BloomFilter
+
+
+class BloomFilterTests(SimpleTestCase):
+    """Test membership answers of the Bloom filter"""
+
+    def test_no_false_negatives(self):
+        """Test every name added is found"""
+        names = [f'uploads/listing/{n}' for n in range(5000)]
+        bloom = BloomFilter(len(names))
+        for name in names:
+            bloom.add(name)
+
+        self.assertTrue(all(name in bloom for name in names))
+
+    def test_false_positive_rate(self):
+        """Test names never added are rarely reported as present"""
+        bloom = BloomFilter(5000, error_rate=0.01)
+        for n in range(5000):
+            bloom.add(f'uploads/listing/{n}')
+
+        hits = sum(f'uploads/user/{n}' in bloom for n in range(10000))
+        self.assertLess(hits, 300)
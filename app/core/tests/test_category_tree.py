@@ -0,0 +1,102 @@
+"""
+Tests for the category closure table
+"""
+
+from importlib import import_module
+from io import StringIO
+from unittest.mock import patch
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase
+
+from core.models import Category, CategoryClosure
+
+
+def closure(category):
+    """Return {ancestor name: depth} for a category"""
+    return {
+        link.ancestor.name: link.depth
+        for link in CategoryClosure.objects
+        .filter(descendant=category)
+        .select_related('ancestor')
+    }
+
+
+class CategoryClosureTests(TestCase):
+    """Test the closure table follows the category tree"""
+
+    def setUp(self):
+        self.instruments = Category.objects.create(name='Instruments')
+        self.guitars = Category.objects.create(
+            name='Guitars', parent_category=self.instruments)
+        self.electric = Category.objects.create(
+            name='Electric Guitars', parent_category=self.guitars)
+
+    def test_created_categories_are_linked(self):
+        """Test each category is linked to itself and its ancestors"""
+        self.assertEqual(closure(self.electric), {
+            'Electric Guitars': 0, 'Guitars': 1, 'Instruments': 2})
+
+    def test_moving_a_category_moves_its_subtree(self):
+        """Test re-parenting updates the links of the whole subtree"""
+        gear = Category.objects.create(name='Gear')
+        self.guitars.parent_category = gear
+        self.guitars.save()
+
+        self.assertEqual(closure(self.electric), {
+            'Electric Guitars': 0, 'Guitars': 1, 'Gear': 2})
+
+    def test_cycle_is_refused_before_saving(self):
+        """Test a move under a descendant leaves the tree untouched"""
+        expected = closure(self.instruments)
+        self.instruments.parent_category = self.electric
+
+        with self.assertRaises(ValidationError):
+            self.instruments.save()
+
+        self.instruments.refresh_from_db()
+        self.assertIsNone(self.instruments.parent_category)
+        self.assertEqual(closure(self.instruments), expected)
+
+    def test_failed_link_undoes_the_save(self):
+        """Test the save and the closure update commit together"""
+        gear = Category.objects.create(name='Gear')
+        self.guitars.parent_category = gear
+
+        with patch('core.signals.link_category', side_effect=ValueError), \
+                self.assertRaises(ValueError):
+            self.guitars.save()
+
+        self.guitars.refresh_from_db()
+        self.assertEqual(self.guitars.parent_category, self.instruments)
+
+    def test_deleting_a_category_removes_links(self):
+        """Test deleting a category drops its subtree's links"""
+        self.guitars.delete()
+
+        self.assertEqual(
+            set(CategoryClosure.objects.values_list('descendant__name',
+                                                    flat=True)),
+            {'Instruments'})
+
+    def test_rebuild_command(self):
+        """Test the closure table can be rebuilt from scratch"""
+        expected = closure(self.electric)
+        CategoryClosure.objects.all().delete()
+
+        call_command('rebuild_category_closure', stdout=StringIO())
+
+        self.assertEqual(closure(self.electric), expected)
+        self.assertEqual(CategoryClosure.objects.count(), 6)
+
+    def test_migration_refuses_existing_cycle(self):
+        """Test building the table fails on a loop saved before it
+        existed instead of walking it forever"""
+        migration = import_module('core.migrations.0026_categoryclosure')
+        Category.objects.filter(pk=self.instruments.pk) \
+            .update(parent_category=self.electric)
+
+        with self.assertRaisesMessage(ValueError, 'is its own ancestor'):
+            migration.build_closure(apps, None)
@@ -3,12 +3,38 @@ Test custom Django management commands
 
 """
 
-from unittest.mock import patch
+import os
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import PropertyMock, patch
 from psycopg2 import OperationalError as Psycopg2Error
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from core.management.commands.explain_viewsets import registered_viewsets
+from core.management.commands.sweep_media import delete_files
+from core.images import derivative_name
+from core.models import (
+    Address,
+    Checkpoint,
+    ImageBlob,
+    Listing,
+    ListingImage,
+    ZipCentroid,
+    )
+from listing import views
 
 
 @patch('core.management.commands.wait_for_db.Command.check')  # path to check
@@ -30,3 +56,266 @@ class CommandTests(SimpleTestCase):
         call_command('wait_for_db')
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class ExplainViewsetsCommandTests(TestCase):
+    """Test the explain_viewsets command"""
+
+    def test_viewsets_are_discovered_once(self):
+        """Test every routed viewset is found without duplicates"""
+        classes = [cls for name, cls in registered_viewsets()]
+
+        self.assertIn(views.OrdersViewSet, classes)
+        self.assertIn(views.ListingReadOnlyViewSet, classes)
+        self.assertEqual(classes.count(views.ListingImageViewSet), 1)
+
+    def test_explain_reports_each_viewset(self):
+        """Test each viewset gets a line in the report"""
+        out = StringIO()
+
+        call_command('explain_viewsets', '--param', 'category=1',
+                     stdout=out)
+
+        self.assertIn('listing:listingreadonly-list', out.getvalue())
+        self.assertIn('listing:categoryreadonly-list', out.getvalue())
+
+    def test_strict_fails_on_seq_scan(self):
+        """Test --strict errors when a table has to be scanned"""
+        with self.assertRaises(CommandError):
+            call_command('explain_viewsets', '--strict', stdout=StringIO())
+
+
+class BenchmarkCategoryFilterCommandTests(TestCase):
+    """Test the benchmark_category_filter command"""
+
+    def test_benchmark_seeds_and_reports(self):
+        """Test each query shape is timed on the seeded listings"""
+        out = StringIO()
+
+        call_command('benchmark_category_filter', '--listings', '20',
+                     '--categories', '4', '--repeat', '1', stdout=out)
+
+        self.assertEqual(Listing.objects.count(), 20)
+        self.assertIn('DISTINCT', out.getvalue())
+        self.assertIn('EXISTS', out.getvalue())
+        self.assertIn('IN ', out.getvalue())
+
+        call_command('benchmark_category_filter', '--cleanup', stdout=out)
+
+        self.assertFalse(Listing.objects.exists())
+
+
+SAMPLE_CENTROIDS = os.path.join(os.path.dirname(__file__), 'data',
+                                'zip_centroids.csv')
+GAZETTEER = ('GEOID\tALAND\tINTPTLAT\tINTPTLONG       \n'
+             '00601\t166847909\t18.180555\t-66.749961\n')
+
+
+class LoadZipCentroidsCommandTests(TestCase):
+    """Test the load_zip_centroids command"""
+
+    def test_load_centroids(self):
+        """Test a CSV file loads and existing addresses are geocoded"""
+        address = Address.objects.create(address_1='1197 W 36th St',
+                                         zip_code='90007')
+        self.assertIsNone(address.latitude)
+
+        call_command('load_zip_centroids', SAMPLE_CENTROIDS,
+                     stdout=StringIO())
+
+        self.assertTrue(ZipCentroid.objects.filter(zip_code='90007')
+                        .exists())
+        address.refresh_from_db()
+        self.assertAlmostEqual(address.latitude, 34.03, places=1)
+
+    def test_load_gazetteer_file(self):
+        """Test the Census Gazetteer ZCTA layout is understood"""
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write(GAZETTEER)
+            f.flush()
+
+            call_command('load_zip_centroids', f.name, stdout=StringIO())
+
+        centroid = ZipCentroid.objects.get()
+        self.assertEqual(centroid.zip_code, '00601')
+        self.assertEqual(centroid.longitude, -66.749961)
+
+    def test_load_zipped_gazetteer(self):
+        """Test the Census archive is unzipped"""
+        with tempfile.NamedTemporaryFile(suffix='.zip') as f:
+            with zipfile.ZipFile(f, 'w') as z:
+                z.writestr('2023_Gaz_zcta_national.txt', GAZETTEER)
+            f.flush()
+
+            call_command('load_zip_centroids', f.name, stdout=StringIO())
+
+        self.assertEqual(ZipCentroid.objects.get().zip_code, '00601')
+
+    def test_load_bundled_centroids(self):
+        """Test the dataset shipped with the app loads by default"""
+        call_command('load_zip_centroids', stdout=StringIO())
+
+        self.assertGreater(ZipCentroid.objects.count(), 40000)
+        centroid = ZipCentroid.objects.get(zip_code='02134')
+        self.assertAlmostEqual(centroid.latitude, 42.35, places=1)
+        self.assertAlmostEqual(centroid.longitude, -71.13, places=1)
+
+    def test_missing_file(self):
+        """Test an unreadable source fails without touching the table"""
+        ZipCentroid.objects.create(zip_code='90007', latitude=34.0,
+                                   longitude=-118.3)
+
+        with self.assertRaises(CommandError):
+            call_command('load_zip_centroids', '/nonexistent.csv',
+                         stdout=StringIO())
+
+        self.assertEqual(ZipCentroid.objects.get().zip_code, '90007')
+
+    def test_empty_file_keeps_loaded_centroids(self):
+        """Test a file without rows does not wipe the table"""
+        ZipCentroid.objects.create(zip_code='90007', latitude=34.0,
+                                   longitude=-118.3)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('zip_code,latitude,longitude\n')
+            f.flush()
+
+            with self.assertRaises(CommandError):
+                call_command('load_zip_centroids', f.name, stdout=StringIO())
+
+        self.assertTrue(ZipCentroid.objects.exists())
+
+
+class BackfillDerivativesCommandTests(TestCase):
+    """Test the backfill_derivatives command"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='test@example.com', password='testpass123',
+            first_name='Joey', last_name='Smith',
+            phone_number='8053394923')
+        address = Address.objects.create(address_1='1197 W 36th St',
+                                         zip_code='90007')
+        self.listing = Listing.objects.create(user=user, address=address,
+                                              title='Title', price_cents=100)
+        out = BytesIO()
+        Image.new('RGB', (600, 300)).save(out, format='JPEG')
+        self.name = default_storage.save('uploads/listing/backfill.jpg',
+                                         ContentFile(out.getvalue()))
+
+    def tearDown(self):
+        for width in (160, 480):
+            for fmt in ('jpeg', 'webp'):
+                default_storage.delete(
+                    derivative_name(self.name, width, fmt))
+        default_storage.delete(self.name)
+
+    def test_backfill_resumes_from_checkpoint(self):
+        """Test images without derivatives are rendered exactly once"""
+        images = [ListingImage.objects.create(listing=self.listing,
+                                              image=self.name, order=n)
+                  for n in range(3)]
+        done = ListingImage.objects.create(
+            listing=self.listing, image='uploads/listing/done.jpg', order=3,
+            variants={'source': 'uploads/listing/done.jpg', 'widths': [160]})
+        started = timezone.now()
+        Checkpoint.objects.create(name='backfill_derivatives:listing',
+                                  updated_at=started - timedelta(days=1))
+        out = StringIO()
+
+        call_command('backfill_derivatives', '--model', 'listing',
+                     '--processes', '0', '--chunk-size', '2', stdout=out)
+
+        for image in images:
+            image.refresh_from_db()
+            self.assertEqual(image.variants['widths'], [160, 480])
+        done.refresh_from_db()
+        self.assertEqual(done.variants['widths'], [160])
+        self.assertIn(f'3 images up to id {images[-1].id}', out.getvalue())
+        checkpoint = Checkpoint.objects.get(
+            name='backfill_derivatives:listing')
+        self.assertEqual(checkpoint.position, images[-1].id)
+        self.assertGreaterEqual(checkpoint.updated_at, started)
+
+        out = StringIO()
+        call_command('backfill_derivatives', '--model', 'listing',
+                     '--processes', '0', stdout=out)
+        self.assertIn('backfilled 0 images', out.getvalue())
+
+
+class SweepMediaCommandTests(TestCase):
+    """Test the sweep_media command"""
+
+    prefix = 'uploads/sweep/'
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='test@example.com', password='testpass123',
+            first_name='Joey', last_name='Smith',
+            phone_number='8053394923')
+        address = Address.objects.create(address_1='1197 W 36th St',
+                                         zip_code='90007')
+        self.listing = Listing.objects.create(user=user, address=address,
+                                              title='Title', price_cents=100)
+        self.names = []
+
+    def tearDown(self):
+        for name in self.names:
+            default_storage.delete(name)
+
+    def _store(self, name, age=2 * 86400):
+        name = default_storage.save(self.prefix + name, ContentFile(b'x'))
+        modified = time.time() - age
+        os.utime(default_storage.path(name), (modified, modified))
+        self.names.append(name)
+        return name
+
+    def test_sweep_unreferenced(self):
+        """Test old files no row or blob references are found and deleted"""
+        kept = [self._store('listing/kept.jpg'),
+                self._store('listing/kept_w160.webp'),
+                self._store('blobs/released.jpg'),
+                self._store('listing/young.jpg', age=60)]
+        ListingImage.objects.create(listing=self.listing, image=kept[0],
+                                    variants={'source': kept[0],
+                                              'widths': [160]})
+        ImageBlob.objects.create(sha256='ab' * 32, name=kept[2], size=1,
+                                 refcount=0)
+        orphans = [self._store('listing/gone.jpg'),
+                   self._store('listing/gone_w160.jpg'),
+                   self._store('user/replaced.png')]
+        out = StringIO()
+
+        call_command('sweep_media', '--prefix', self.prefix, stdout=out)
+
+        self.assertEqual(sorted(out.getvalue().splitlines()[:-1]),
+                         sorted(orphans))
+        self.assertIn('Found 3 unreferenced files', out.getvalue())
+        self.assertTrue(default_storage.exists(orphans[0]))
+
+        call_command('sweep_media', '--prefix', self.prefix, '--delete',
+                     '--batch-size', '2', stdout=StringIO())
+
+        for name in orphans:
+            self.assertFalse(default_storage.exists(name))
+        for name in kept:
+            self.assertTrue(default_storage.exists(name))
+
+    def test_grace_covers_direct_uploads(self):
+        """Test the grace period must outlast an upload intent"""
+        with self.assertRaises(CommandError):
+            call_command('sweep_media', '--grace', '60', stdout=StringIO())
+
+    @patch.object(S3Boto3Storage, 'bucket', new_callable=PropertyMock)
+    def test_s3_batch_delete(self, bucket):
+        """Test S3 deletes send one request per batch and map errors back"""
+        bucket.return_value.delete_objects.return_value = {'Errors': [
+            {'Key': 'app/uploads/b.jpg', 'Code': 'AccessDenied'}]}
+        storage = S3Boto3Storage(bucket_name='media', location='app')
+
+        errors = delete_files(storage, ['uploads/a.jpg', 'uploads/b.jpg'])
+
+        self.assertEqual(errors, {'uploads/b.jpg': 'AccessDenied'})
+        bucket.return_value.delete_objects.assert_called_once_with(Delete={
+            'Objects': [{'Key': 'app/uploads/a.jpg'},
+                        {'Key': 'app/uploads/b.jpg'}],
+            'Quiet': True})
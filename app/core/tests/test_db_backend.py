@@ -0,0 +1,70 @@
+"""
+Tests for the PostgreSQL backend with health checks and pooling
+"""
+
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase
+
+from core.db.backends.postgresql.base import DatabaseWrapper, _pools
+
+
+class HealthCheckTests(TestCase):
+    """Test reused connections are checked once per request"""
+
+    def setUp(self):
+        self.wrapper = DatabaseWrapper(
+            dict(connection.settings_dict, CONN_HEALTH_CHECKS=True),
+            alias='healthcheck')
+
+    def tearDown(self):
+        self.wrapper.close()
+
+    def test_dead_connection_is_replaced(self):
+        """Test a connection failing the check is reopened"""
+        self.wrapper.ensure_connection()
+        first = self.wrapper.connection
+        self.wrapper.close_if_unusable_or_obsolete()
+
+        with patch.object(self.wrapper, 'is_usable', return_value=False):
+            self.wrapper.cursor().close()
+
+        self.assertIsNot(self.wrapper.connection, first)
+
+    def test_check_runs_once_per_request(self):
+        """Test the check does not run on every cursor"""
+        self.wrapper.ensure_connection()
+        self.wrapper.close_if_unusable_or_obsolete()
+
+        with patch.object(self.wrapper, 'is_usable',
+                          return_value=True) as is_usable:
+            self.wrapper.cursor().close()
+            self.wrapper.cursor().close()
+
+        is_usable.assert_called_once()
+
+
+class PoolTests(TestCase):
+    """Test connections are taken from and returned to the pool"""
+
+    def setUp(self):
+        self.wrapper = DatabaseWrapper(
+            dict(connection.settings_dict, POOL_MAX_SIZE=2, POOL_MIN_SIZE=1),
+            alias='pooltest')
+
+    def tearDown(self):
+        self.wrapper.close()
+        _pools.pop('pooltest')[1].closeall()
+
+    def test_connection_is_reused(self):
+        """Test closing hands the connection back for the next request"""
+        self.wrapper.ensure_connection()
+        first = self.wrapper.connection
+        self.wrapper.close()
+        self.wrapper.ensure_connection()
+
+        self.assertIs(self.wrapper.connection, first)
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
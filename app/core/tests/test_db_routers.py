@@ -0,0 +1,159 @@
+"""
+Tests for the primary/replica database router
+"""
+
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.db import routers
+from core.middleware import execute_wrapper, QueryCounter
+from core.models import Category, ReplicaPin
+
+METRICS_URL = reverse('metrics')
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class RouterTests(SimpleTestCase):
+    """Test routing decisions"""
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        routers.start_request()
+
+    def tearDown(self):
+        routers.end_request()
+
+    def test_reads_use_primary_by_default(self):
+        """Test reads stay on the primary unless the view opts in"""
+        self.assertEqual(self.router.db_for_read(Category), 'default')
+
+    def test_opted_in_reads_use_replica(self):
+        """Test safe reads go to the replica"""
+        routers.allow_replica_reads()
+
+        self.assertEqual(self.router.db_for_read(Category), 'replica')
+
+    def test_write_pins_request_to_primary(self):
+        """Test reads after a write stay on the primary"""
+        routers.allow_replica_reads()
+
+        self.assertEqual(self.router.db_for_write(Category), 'default')
+        self.assertEqual(self.router.db_for_read(Category), 'default')
+
+    def test_only_changes_count_as_writes(self):
+        """Test statements are told apart by whether they change data"""
+        def execute(sql, params, many, context):
+            return None
+
+        routers.record_writes(execute, 'SELECT 1 FOR UPDATE', [], False, {})
+        self.assertFalse(routers.wrote_in_request())
+        routers.record_writes(execute, 'UPDATE "core_category" SET ...',
+                              [], False, {})
+        self.assertTrue(routers.wrote_in_request())
+
+    def test_pinned_session_uses_primary(self):
+        """Test a recently writing client reads from the primary"""
+        routers.start_request(pinned=True)
+        routers.allow_replica_reads()
+
+        self.assertEqual(self.router.db_for_read(Category), 'default')
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_no_replica_configured(self):
+        """Test everything uses the primary without a replica"""
+        routers.allow_replica_reads()
+
+        self.assertEqual(self.router.db_for_read(Category), 'default')
+
+
+@override_settings(REPLICA_DATABASE='replica', REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingMiddlewareTests(TestCase):
+    """Test users are pinned to the primary after writing"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123',
+            first_name='Test', last_name='User', phone_number='8054394923')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_read_does_not_pin(self):
+        """Test a request that does not write pins nobody"""
+        self.client.get(reverse('user:me'))
+
+        self.assertFalse(ReplicaPin.objects.exists())
+
+    def test_write_pins_user(self):
+        """Test a write by a token user pins them for a few seconds"""
+        res = self.client.patch(reverse('user:me'), {'bio': 'Hello'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(routers.is_pinned(self.user))
+
+    def test_anonymous_write_does_not_pin(self):
+        """Test writes without a user have nobody to pin"""
+        APIClient().post(reverse('user:create'), {
+            'email': 'other@example.com',
+            'first_name': 'Test',
+            'last_name': 'User',
+            'phone_number': '8054394924',
+            'password': 'testpass123',
+        })
+
+        self.assertFalse(ReplicaPin.objects.exists())
+
+    def test_get_or_create_writes_only_when_creating(self):
+        """Test a lookup routed for writing only counts as a write if it
+        inserts"""
+        Category.objects.create(name='Drums')
+        routers.start_request()
+        try:
+            with execute_wrapper(routers.record_writes):
+                Category.objects.get_or_create(name='Drums')
+                self.assertFalse(routers.wrote_in_request())
+
+                Category.objects.get_or_create(name='Guitars')
+                self.assertTrue(routers.wrote_in_request())
+        finally:
+            routers.end_request()
+
+    @patch('core.db.routers.allow_replica_reads')
+    def test_pinned_token_user_reads_primary(self, allow_replica_reads):
+        """Test replica viewsets keep a pinned user sending their token
+        on the primary"""
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        for name in ('listing:listingreadonly-list',
+                     'listing:categoryreadonly-list',
+                     'listing:listingreviewreadonly-list'):
+            url = reverse(name)
+            client.get(url)
+            allow_replica_reads.assert_called_once()
+            allow_replica_reads.reset_mock()
+
+            routers.pin(self.user)
+            client.get(url)
+            allow_replica_reads.assert_not_called()
+            ReplicaPin.objects.all().delete()
+
+
+class ExecuteWrapperTests(SimpleTestCase):
+    """Test request instrumentation sees every database alias"""
+
+    def test_wraps_every_alias(self):
+        """Test the wrapper is installed on each connection"""
+        counter = QueryCounter()
+
+        with execute_wrapper(counter):
+            for conn in connections.all():
+                self.assertIn(counter, conn.execute_wrappers)
+        for conn in connections.all():
+            self.assertNotIn(counter, conn.execute_wrappers)
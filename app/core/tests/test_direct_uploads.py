@@ -0,0 +1,62 @@
+"""
+Tests for uploads straight to the file storage
+"""
+
+import base64
+import json
+
+from django.core import signing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from core import direct_uploads
+
+
+@override_settings(UPLOAD_MAX_FILE_BYTES=1000)
+class PresignedPostTests(SimpleTestCase):
+    """Test the forms handed out for direct uploads"""
+
+    def test_s3_presigned_post(self):
+        """Test S3 forms are limited to the key, type and size"""
+        storage = S3Boto3Storage(bucket_name='media', location='app',
+                                 access_key='AKIDEXAMPLE',
+                                 secret_key='secret', region_name='us-east-1')
+
+        url, fields = direct_uploads.presigned_post(
+            storage, 'uploads/listing/abc.jpg', 'image/jpeg')
+
+        self.assertIn('media', url)
+        self.assertEqual(fields['key'], 'app/uploads/listing/abc.jpg')
+        self.assertEqual(fields['acl'], 'public-read')
+        policy = json.loads(base64.b64decode(fields['policy']))
+        self.assertIn(['content-length-range', 1, 1000],
+                      policy['conditions'])
+        self.assertIn({'Content-Type': 'image/jpeg'}, policy['conditions'])
+
+    def test_local_form_policy(self):
+        """Test local forms carry a signed policy for the stand-in view"""
+        url, fields = direct_uploads.presigned_post(
+            object(), 'uploads/user/abc.png', 'image/png')
+
+        self.assertEqual(url, reverse('direct-upload'))
+        policy = signing.loads(fields['policy'],
+                               salt=direct_uploads.POLICY_SALT)
+        self.assertEqual(policy, {'key': 'uploads/user/abc.png',
+                                  'content_type': 'image/png',
+                                  'max_bytes': 1000})
+
+    def test_local_form_must_match_policy(self):
+        """Test the stand-in view refuses a key the policy is not for"""
+        _, fields = direct_uploads.presigned_post(
+            object(), 'uploads/user/abc.png', 'image/png')
+        fields['key'] = 'uploads/user/other.png'
+        fields['file'] = SimpleUploadedFile('abc.png', b'data')
+
+        res = APIClient().post(reverse('direct-upload'), fields,
+                               format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,83 @@
+"""
+Tests for image derivatives
+"""
+
+import io
+
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from core import images
+from core.uploads import InvalidImage
+
+
+def jpeg(width, height, **save_options):
+    """Return an in-memory JPEG of the given size"""
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(out, 'JPEG',
+                                                  **save_options)
+    out.seek(0)
+    return out
+
+
+class DerivativeTests(SimpleTestCase):
+    """Test resizing uploaded images"""
+
+    def test_derivative_name(self):
+        """Test derivatives are stored next to the original"""
+        self.assertEqual(
+            images.derivative_name('uploads/listing/abc.jpeg', 480, 'webp'),
+            'uploads/listing/abc_w480.webp')
+
+    def test_widths_and_formats(self):
+        """Test a JPEG and a WebP per width up to the original's"""
+        rendered = [(width, fmt, Image.open(io.BytesIO(data)))
+                    for width, fmt, data in
+                    images.render_derivatives(jpeg(800, 400))]
+
+        self.assertEqual([(width, fmt) for width, fmt, _ in rendered], [
+            (160, 'jpeg'), (160, 'webp'), (480, 'jpeg'), (480, 'webp')])
+        self.assertEqual(rendered[2][2].size, (480, 240))
+        self.assertEqual(rendered[3][2].format, 'WEBP')
+
+    def test_image_at_a_width_gets_that_width(self):
+        """Test an original exactly as wide as a width gets a copy at it"""
+        rendered = list(images.render_derivatives(jpeg(1200, 600)))
+
+        self.assertEqual([width for width, _, _ in rendered],
+                         [160, 160, 480, 480, 1200, 1200])
+        self.assertEqual(Image.open(io.BytesIO(rendered[4][2])).size,
+                         (1200, 600))
+
+    def test_small_image_gets_own_width(self):
+        """Test images narrower than every width are not upscaled and are
+        named for the width they have"""
+        rendered = list(images.render_derivatives(jpeg(50, 50)))
+
+        self.assertEqual([width for width, _, _ in rendered], [50, 50])
+        self.assertEqual(Image.open(io.BytesIO(rendered[0][2])).size,
+                         (50, 50))
+
+    def test_exif_stripped_after_rotation(self):
+        """Test the orientation tag is applied and then dropped"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees
+        exif[0x010f] = 'Phone maker'
+
+        width, fmt, data = next(images.render_derivatives(
+            jpeg(1000, 500, exif=exif.tobytes())))
+
+        derivative = Image.open(io.BytesIO(data))
+        self.assertEqual(derivative.size, (160, 320))
+        self.assertEqual(dict(derivative.getexif()), {})
+
+    @override_settings(UPLOAD_MAX_PIXELS=10000)
+    def test_too_many_pixels_not_decoded(self):
+        """Test an original over UPLOAD_MAX_PIXELS is refused from its
+        header, without lowering Pillow's limit for the whole process"""
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+
+        with self.assertRaisesMessage(InvalidImage, 'too_many_pixels'):
+            next(images.render_derivatives(jpeg(200, 100)))
+
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, max_image_pixels)
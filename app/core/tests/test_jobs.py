@@ -0,0 +1,115 @@
+"""
+Tests for the background job queue
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import (
+    Job,
+    JOB_STATUS_DONE,
+    JOB_STATUS_FAILED,
+    JOB_STATUS_QUEUED,
+    JOB_STATUS_RUNNING,
+    )
+
+calls = []
+failures = []
+
+
+@jobs.handler('test_record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.handler('test_fail', on_failure=lambda **payload: failures.append(
+    payload))
+def fail(value):
+    raise RuntimeError(value)
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_SECONDS=30)
+class JobQueueTests(TestCase):
+    """Test enqueueing, claiming and running jobs"""
+
+    def setUp(self):
+        calls.clear()
+        failures.clear()
+
+    def test_run_pending(self):
+        """Test queued jobs run once with their payload"""
+        job = jobs.enqueue('test_record', value=1)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(jobs.run_pending(), 0)
+
+        self.assertEqual(calls, [1])
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_DONE)
+        self.assertEqual(job.attempts, 1)
+
+    def test_unknown_kind(self):
+        """Test jobs can only be queued for registered handlers"""
+        with self.assertRaises(ValueError):
+            jobs.enqueue('no_such_job')
+
+    def test_claim_skips_jobs_not_due(self):
+        """Test jobs scheduled for later are left in the queue"""
+        Job.objects.create(kind='test_record', payload={'value': 1},
+                           run_after=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(jobs.claim(), [])
+
+    def test_failed_job_retried_then_failed(self):
+        """Test failures back off, then give up after the last attempt"""
+        job = jobs.enqueue('test_fail', value='boom')
+
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+        self.assertGreater(job.run_after,
+                           timezone.now() + timedelta(seconds=20))
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.update(run_after=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_FAILED)
+        self.assertEqual(failures, [{'value': 'boom'}])
+
+    def test_requeue_stale(self):
+        """Test jobs abandoned by a dead worker go back in the queue"""
+        job = jobs.enqueue('test_record', value=1)
+        Job.objects.update(status=JOB_STATUS_RUNNING,
+                           locked_at=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+
+    def test_purge(self):
+        """Test old finished jobs are deleted"""
+        jobs.enqueue('test_record', value=1)
+        Job.objects.update(status=JOB_STATUS_DONE,
+                           finished_at=timezone.now() - timedelta(days=30))
+        jobs.enqueue('test_record', value=2)
+
+        self.assertEqual(jobs.purge(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+    @patch('core.management.commands.run_workers.signal.signal')
+    def test_run_workers_command(self, patched_signal):
+        """Test the command drains the queue in-process"""
+        jobs.enqueue('test_record', value=1)
+        jobs.enqueue('test_record', value=2)
+
+        call_command('run_workers', '--processes', '0', '--once',
+                     stdout=StringIO())
+
+        self.assertEqual(calls, [1, 2])
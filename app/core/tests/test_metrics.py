@@ -0,0 +1,94 @@
+"""
+Tests for the metrics registry and endpoint
+"""
+
+import tempfile
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.metrics import Registry, registry
+
+METRICS_URL = reverse('metrics')
+
+
+class RegistryTests(SimpleTestCase):
+    """Test the metrics registry"""
+
+    def test_counter_render(self):
+        """Test counters are rendered with their labels"""
+        reg = Registry(directory='')
+        reg.inc('requests_total', {'view': 'a', 'status': 200})
+        reg.inc('requests_total', {'status': 200, 'view': 'a'})
+
+        text = reg.render()
+
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{status="200",view="a"} 2', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram buckets count every smaller observation"""
+        reg = Registry(directory='')
+        reg.observe('latency', 0.2, buckets=(0.1, 0.5, 1))
+        reg.observe('latency', 0.7, buckets=(0.1, 0.5, 1))
+        reg.observe('latency', 3, buckets=(0.1, 0.5, 1))
+
+        text = reg.render()
+
+        self.assertIn('latency_bucket{le="0.1"} 0', text)
+        self.assertIn('latency_bucket{le="0.5"} 1', text)
+        self.assertIn('latency_bucket{le="1"} 2', text)
+        self.assertIn('latency_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_count 3', text)
+
+    def test_workers_are_merged(self):
+        """Test metrics written by several workers are summed"""
+        with tempfile.TemporaryDirectory() as directory:
+            worker1 = Registry(directory=directory)
+            worker1.inc('requests_total')
+            # Workers are told apart by pid, so fake a second one.
+            with open(f'{directory}/other.json', 'w') as f:
+                f.write('{"counters": [["requests_total", {}, 2]],'
+                        ' "histograms": []}')
+
+            text = worker1.render()
+
+        self.assertIn('requests_total 3', text)
+
+    def test_sources_share_directory(self):
+        """Test containers writing one directory keep separate files"""
+        with tempfile.TemporaryDirectory() as directory:
+            api = Registry(directory=directory, source='api')
+            worker = Registry(directory=directory, source='worker')
+            api.inc('jobs_total')
+            worker.inc('jobs_total', value=2)
+            # Same pid here, as in two containers of one task
+            worker.flush(force=True)
+
+            text = api.render()
+
+        self.assertIn('jobs_total 3', text)
+
+
+class MetricsEndpointTests(TestCase):
+    """Test the metrics middleware and endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        registry.reset()
+
+    def test_requests_are_recorded(self):
+        """Test a request is counted per view and status"""
+        self.client.get(reverse('listing:categoryreadonly-list'))
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        body = res.content.decode()
+        self.assertIn('http_requests_total{method="GET",status="200",'
+                      'view="listing:categoryreadonly-list"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket', body)
+        self.assertIn('db_queries_total{view="listing:categoryreadonly-list"}',
+                      body)
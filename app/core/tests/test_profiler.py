@@ -0,0 +1,79 @@
+"""
+Tests for the on-demand request profiler
+"""
+
+import json
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+ORDERS_URL = reverse('listing:orders-list')
+
+
+def create_user(**params):
+    """Create and return a new user"""
+    defaults = {
+        'email': 'user@example.com',
+        'first_name': 'Test',
+        'last_name': 'User',
+        'phone_number': '1234567891',
+        'password': 'testpass123',
+    }
+    defaults.update(params)
+    return get_user_model().objects.create_user(**defaults)
+
+
+class ProfilerMiddlewareTests(TestCase):
+    """Test profiling requests with the X-Profile header"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_non_staff_gets_normal_response(self):
+        """Test the profile flag is ignored for regular users"""
+        res = self.client.get(ORDERS_URL, HTTP_X_PROFILE='attach')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Disposition', res)
+        self.assertEqual(res.json(), [])
+
+    def test_staff_gets_profile_attachment(self):
+        """Test staff receive the profile and SQL timeline"""
+        self.user.is_staff = True
+        self.user.save()
+
+        res = self.client.get(ORDERS_URL, {'profile': '1'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('attachment', res['Content-Disposition'])
+        report = json.loads(res.content)
+        self.assertEqual(report['status_code'], 200)
+        self.assertGreater(report['num_queries'], 0)
+        self.assertIn('core_orders', ' '.join(
+            query['sql'] for query in report['sql']))
+        self.assertIn('cumulative', report['profile'])
+
+    def test_staff_can_store_profile(self):
+        """Test store mode writes the profile and keeps the response"""
+        self.user.is_staff = True
+        self.user.save()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROFILER_DIR=directory):
+                res = self.client.get(ORDERS_URL, HTTP_X_PROFILE='store')
+
+            profile_id = res['X-Profile-Id']
+            self.assertTrue(
+                os.path.exists(os.path.join(directory, f'{profile_id}.prof')))
+            self.assertTrue(
+                os.path.exists(os.path.join(directory, f'{profile_id}.json')))
+        self.assertEqual(res.json(), [])
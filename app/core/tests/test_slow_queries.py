@@ -0,0 +1,87 @@
+"""
+Tests for the slow query log
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import slow_queries
+from core.models import Category, SlowQuery
+
+READ_LISTINGS_URL = reverse('listing:listingreadonly-list')
+
+
+class FingerprintTests(SimpleTestCase):
+    """Test statement normalization"""
+
+    def test_literals_and_in_lists_are_normalized(self):
+        """Test statements differing only in values share a fingerprint"""
+        sql1 = 'SELECT * FROM core_listing WHERE id IN (%s, %s) LIMIT 21'
+        sql2 = "SELECT *  FROM core_listing WHERE id IN (%s) LIMIT 5"
+
+        self.assertEqual(slow_queries.normalize(sql1),
+                         'SELECT * FROM core_listing WHERE id IN (...) '
+                         'LIMIT ?')
+        self.assertEqual(slow_queries.fingerprint(sql1),
+                         slow_queries.fingerprint(sql2))
+
+    def test_plan_nodes(self):
+        """Test plans are flattened into readable nodes"""
+        plan = [{'Plan': {
+            'Node Type': 'Hash Join',
+            'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'core_listing'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'core_user',
+                 'Index Name': 'core_user_pkey'},
+            ]}}]
+
+        self.assertEqual(slow_queries.plan_nodes(plan), [
+            'Hash Join',
+            'Seq Scan on core_listing',
+            'Index Scan on core_user using core_user_pkey',
+        ])
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_ASYNC=False)
+class SlowQueryLogTests(TestCase):
+    """Test slow statements are recorded per fingerprint"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_slow_queries_are_recorded_with_plan(self):
+        """Test statements over the threshold are logged and explained"""
+        drums, guitars, amps = [Category.objects.create(name=name).id
+                                for name in ('Drums', 'Guitars', 'Amps')]
+        self.client.get(READ_LISTINGS_URL,
+                        {'category': f'{drums},{guitars}'})
+        self.client.get(READ_LISTINGS_URL, {'category': amps})
+
+        query = SlowQuery.objects.get(statement__contains='core_listing')
+        self.assertEqual(query.calls, 2)
+        self.assertEqual(query.view, 'listing:listingreadonly-list')
+        self.assertIn('Plan', query.plan[0])
+
+    @override_settings(SLOW_QUERY_LOG_SIZE=1)
+    def test_log_is_trimmed(self):
+        """Test only the most expensive fingerprints are kept"""
+        slow_queries.record('SELECT 1', [], 5, '')
+        slow_queries.record('SELECT 1, 2', [], 50, '')
+
+        self.assertEqual(SlowQuery.objects.get().statement, 'SELECT ?, ?')
+
+    def test_command_dumps_report(self):
+        """Test the slow_queries command lists recorded statements"""
+        slow_queries.record('SELECT 1', [], 5, 'listing:orders-list')
+        out = StringIO()
+
+        call_command('slow_queries', '--reset', stdout=out)
+
+        self.assertIn('listing:orders-list', out.getvalue())
+        self.assertIn('Result', out.getvalue())
+        self.assertFalse(SlowQuery.objects.exists())
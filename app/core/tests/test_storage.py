@@ -0,0 +1,55 @@
+"""
+Tests for the S3 media storage
+"""
+
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from core.storage import MediaStorage
+
+
+def media_storage(**kwargs):
+    """Return a MediaStorage with made-up credentials"""
+    return MediaStorage(bucket_name='media', location='app',
+                        access_key='AKIDEXAMPLE', secret_key='secret',
+                        region_name='us-east-1', **kwargs)
+
+
+class MediaStorageTests(SimpleTestCase):
+    """Test URLs and connections of the S3 media storage"""
+
+    def test_url_matches_s3_storage(self):
+        """Test URLs from the cached prefix are the ones boto3 builds"""
+        storage = media_storage(querystring_auth=False)
+
+        for name in ('uploads/listing/abc.jpg', 'uploads/a b+c.jpg'):
+            self.assertEqual(storage.url(name),
+                             S3Boto3Storage.url(storage, name))
+
+    def test_url_custom_domain(self):
+        """Test URLs are rewritten to the CDN host when one is set"""
+        storage = media_storage(querystring_auth=False,
+                                custom_domain='cdn.example.com')
+
+        self.assertEqual(storage.url('uploads/a b.jpg'),
+                         'https://cdn.example.com/app/uploads/a%20b.jpg')
+
+    def test_signed_url(self):
+        """Test signed URLs are still presigned by boto3"""
+        storage = media_storage(querystring_auth=True)
+
+        self.assertIn('Signature=', storage.url('uploads/abc.jpg'))
+
+    @override_settings(AWS_S3_MAX_POOL_CONNECTIONS=25)
+    def test_connection_pool(self):
+        """Test one pooled connection is kept until the process forks"""
+        storage = media_storage()
+        connection = storage.connection
+
+        self.assertEqual(connection.meta.client.meta.config
+                         .max_pool_connections, 25)
+        self.assertIs(storage.connection, connection)
+        with patch('core.storage.os.getpid', return_value=-1):
+            self.assertIsNot(storage.connection, connection)
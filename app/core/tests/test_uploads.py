@@ -0,0 +1,94 @@
+"""
+Tests for bounded upload handling
+"""
+
+import hashlib
+import io
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+from rest_framework import serializers
+
+from core.uploads import HashingUploadHandler, ImageUploadField, \
+    LimitedUploadHandler, UploadSizeExceeded
+
+
+def upload(width=10, height=10, image_format='JPEG'):
+    """Return an uploaded image file"""
+    out = io.BytesIO()
+    Image.new('RGB', (width, height)).save(out, image_format)
+    return SimpleUploadedFile(f'photo.{image_format.lower()}',
+                              out.getvalue())
+
+
+@override_settings(UPLOAD_MAX_PIXELS=10000,
+                   UPLOAD_IMAGE_FORMATS=['JPEG', 'PNG'])
+class ImageUploadFieldTests(SimpleTestCase):
+    """Test images are checked from their header"""
+
+    def setUp(self):
+        self.field = ImageUploadField()
+
+    def test_valid_image(self):
+        """Test an allowed image passes with its content type set"""
+        value = self.field.to_internal_value(upload(image_format='PNG'))
+
+        self.assertEqual(value.content_type, 'image/png')
+        self.assertEqual(value.tell(), 0)
+
+    def test_not_an_image(self):
+        """Test arbitrary bytes are refused"""
+        with self.assertRaises(serializers.ValidationError):
+            self.field.to_internal_value(
+                SimpleUploadedFile('photo.jpg', b'not an image'))
+
+    def test_format_not_allowed(self):
+        """Test formats outside UPLOAD_IMAGE_FORMATS are refused"""
+        with self.assertRaises(serializers.ValidationError):
+            self.field.to_internal_value(upload(image_format='GIF'))
+
+    def test_too_many_pixels(self):
+        """Test large dimensions are refused before decoding"""
+        with self.assertRaises(serializers.ValidationError):
+            self.field.to_internal_value(upload(200, 100))
+
+
+@override_settings(UPLOAD_MAX_REQUEST_BYTES=1000, UPLOAD_MAX_FILE_BYTES=100)
+class LimitedUploadHandlerTests(SimpleTestCase):
+    """Test size caps are enforced while the body streams in"""
+
+    def setUp(self):
+        self.handler = LimitedUploadHandler()
+
+    def test_request_over_limit(self):
+        """Test a large body is refused from its Content-Length"""
+        with self.assertRaises(UploadSizeExceeded):
+            self.handler.handle_raw_input(None, {}, 1001, b'boundary')
+
+    def test_file_over_limit(self):
+        """Test a file is refused as soon as it passes the cap"""
+        self.handler.handle_raw_input(None, {}, 500, b'boundary')
+        self.handler.new_file('image', 'photo.jpg', 'image/jpeg', None)
+
+        self.assertEqual(self.handler.receive_data_chunk(b'x' * 60, 0),
+                         b'x' * 60)
+        with self.assertRaises(UploadSizeExceeded):
+            self.handler.receive_data_chunk(b'x' * 60, 60)
+
+
+class HashingUploadHandlerTests(SimpleTestCase):
+    """Test uploads are hashed as they are spooled"""
+
+    def test_digest_set_on_file(self):
+        """Test the finished file carries the SHA-256 of its bytes"""
+        handler = HashingUploadHandler()
+        handler.new_file('image', 'photo.jpg', 'image/jpeg', None)
+        handler.receive_data_chunk(b'abc', 0)
+        handler.receive_data_chunk(b'def', 3)
+
+        upload = handler.file_complete(6)
+
+        self.assertEqual(upload.sha256, hashlib.sha256(b'abcdef').hexdigest())
+        self.assertEqual(upload.read(), b'abcdef')
+        upload.close()
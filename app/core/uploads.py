@@ -0,0 +1,137 @@
+"""
+Bounded handling of uploaded files
+
+LimitedUploadHandler enforces UPLOAD_MAX_REQUEST_BYTES before the body is
+read and UPLOAD_MAX_FILE_BYTES while each file streams in, so an oversized
+upload is refused without being buffered. It raises UploadSizeExceeded,
+which Django answers with a 400 in any view; exception_handler turns it
+into UploadTooLarge's 413 for the API. Files are then spooled to disk
+by HashingUploadHandler rather than held in memory, which records the
+SHA-256 of each as it streams past, see core.blobs.
+
+ImageUploadField validates an image from its header alone: Pillow reads
+the format and dimensions without decoding any pixels, and anything over
+UPLOAD_MAX_PIXELS is refused before it can be decompressed. Workers run the
+same check, inspect_image, on files uploaded straight to the file storage.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    TemporaryFileUploadHandler,
+    )
+from PIL import Image
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework.views import exception_handler as drf_exception_handler
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload is too large.'
+    default_code = 'upload_too_large'
+
+
+class UploadSizeExceeded(RequestDataTooBig):
+    """A body or file over the limits of LimitedUploadHandler"""
+
+
+def exception_handler(exc, context):
+    """DRF exception handler answering oversized uploads with a 413"""
+    if isinstance(exc, UploadSizeExceeded):
+        exc = UploadTooLarge(str(exc))
+    return drf_exception_handler(exc, context)
+
+
+class InvalidImage(ValueError):
+    """An image refused by inspect_image, with the reason as its code"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def inspect_image(file):
+    """Return the Pillow format of an acceptable image from its header"""
+    try:
+        with Image.open(file) as image:
+            image_format = image.format
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise InvalidImage('too_many_pixels')
+    except (OSError, SyntaxError, ValueError):
+        raise InvalidImage('invalid_image')
+    if image_format not in settings.UPLOAD_IMAGE_FORMATS:
+        raise InvalidImage('format')
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        raise InvalidImage('too_many_pixels')
+    return image_format
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Refuse request bodies and files over the configured sizes"""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        limit = settings.UPLOAD_MAX_REQUEST_BYTES
+        if content_length > limit:
+            raise UploadSizeExceeded(
+                f'Request body is over {limit} bytes.')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        limit = settings.UPLOAD_MAX_FILE_BYTES
+        if self.received > limit:
+            raise UploadSizeExceeded(
+                f'{self.file_name} is over {limit} bytes.')
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Spool files to disk, setting sha256 on each to its hex digest"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.sha256.hexdigest()
+        return upload
+
+
+class ImageUploadField(serializers.ImageField):
+    """Image field checked from the file header, without decoding it"""
+    default_error_messages = {
+        'invalid_image': 'Upload a valid image. The file you uploaded was '
+                         'either not an image or a corrupted image.',
+        'format': 'Images must be one of {formats}.',
+        'too_many_pixels': 'Images must be at most {max_pixels} pixels.',
+    }
+
+    def to_internal_value(self, data):
+        upload = serializers.FileField.to_internal_value(self, data)
+        try:
+            image_format = inspect_image(upload)
+        except InvalidImage as error:
+            self.fail(error.code,
+                      formats=', '.join(settings.UPLOAD_IMAGE_FORMATS),
+                      max_pixels=settings.UPLOAD_MAX_PIXELS)
+        finally:
+            upload.seek(0)
+        upload.content_type = Image.MIME.get(image_format)
+        return upload
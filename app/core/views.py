@@ -0,0 +1,51 @@
+"""
+Views for the core app
+"""
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    permission_classes,
+    )
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from core.direct_uploads import POLICY_SALT
+from core.metrics import registry
+
+
+def metrics(request):
+    """Expose the metrics of all workers in Prometheus text format"""
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([])
+def direct_upload(request):
+    """Stand in for a presigned S3 POST when files are stored locally
+
+    Accepts the form returned by core.direct_uploads.presigned_post and
+    enforces its signed policy the way S3 would.
+    """
+    try:
+        policy = signing.loads(request.data.get('policy', ''),
+                               salt=POLICY_SALT,
+                               max_age=settings.UPLOAD_INTENT_SECONDS)
+    except signing.BadSignature:
+        raise PermissionDenied('Invalid or expired policy.')
+    if request.data.get('key') != policy['key'] or \
+            request.data.get('Content-Type') != policy['content_type']:
+        raise PermissionDenied('Form does not match the policy.')
+
+    upload = request.FILES.get('file')
+    if upload is None or not 0 < upload.size <= policy['max_bytes']:
+        raise ValidationError({'file': 'Missing or too large.'})
+    if default_storage.exists(policy['key']):
+        raise ValidationError({'key': 'Already uploaded.'})
+    default_storage.save(policy['key'], upload)
+    return HttpResponse(status=204)
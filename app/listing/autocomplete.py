@@ -0,0 +1,85 @@
+"""
+Make and model autocomplete
+
+Matching uses UPPER(make|model) LIKE '%TERM%', which the trigram GIN
+indexes from migration 0030 serve without scanning the listing table.
+Terms need a whole trigram, so shorter ones are refused. Values starting
+with the term are suggested first, then values containing it; each group
+is ranked by how many listings use them. Suggestions are cached per term.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import (
+    Aggregate,
+    Case,
+    CharField,
+    Count,
+    Min,
+    Value,
+    When,
+)
+from django.db.models.functions import Upper
+from rest_framework.exceptions import ValidationError
+
+from core.metrics import record_cache
+from core.models import Listing
+
+AUTOCOMPLETE_FIELDS = ('make', 'model')
+MIN_TERM_LENGTH = 3
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+
+
+class Mode(Aggregate):
+    """The most common value in the group"""
+    function = 'MODE'
+    template = '%(function)s() WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = CharField()
+
+
+def suggestions(field, term, make=None, limit=DEFAULT_LIMIT):
+    """Return the most used values of a field containing term, those
+    starting with it first"""
+    queryset = Listing.objects.filter(**{f'{field}__icontains': term})
+    if make:
+        queryset = queryset.filter(make__iexact=make)
+    # Spellings differing only in case are counted together and shown in
+    # their most common form.
+    rows = queryset \
+        .values(key=Upper(field)) \
+        .annotate(value=Mode(field), count=Count('id'),
+                  contains=Min(Case(
+                      When(**{f'{field}__istartswith': term}, then=Value(0)),
+                      default=Value(1)))) \
+        .order_by('contains', '-count', 'key')[:limit]
+    return [{'value': row['value'], 'count': row['count']} for row in rows]
+
+
+def get_suggestions(query_params):
+    """Validate the query parameters and return cached suggestions"""
+    field = query_params.get('field', 'make')
+    if field not in AUTOCOMPLETE_FIELDS:
+        raise ValidationError({'field': 'Must be make or model.'})
+    term = query_params.get('q', '').strip()
+    if len(term) < MIN_TERM_LENGTH:
+        raise ValidationError(
+            {'q': f'Must be at least {MIN_TERM_LENGTH} characters.'})
+    make = query_params.get('make', '').strip() if field == 'model' else ''
+    try:
+        limit = min(int(query_params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    limit = max(limit, 1)
+
+    digest = hashlib.sha1(
+        repr((field, term.upper(), make.upper(), limit)).encode()).hexdigest()
+    key = f'autocomplete:{digest}'
+    values = cache.get(key)
+    record_cache('autocomplete', values is not None)
+    if values is None:
+        values = suggestions(field, term, make, limit)
+        cache.set(key, values, settings.AUTOCOMPLETE_CACHE_SECONDS)
+    return values
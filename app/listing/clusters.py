@@ -0,0 +1,116 @@
+"""
+Map marker clustering for listing searches
+
+The map is cut into a grid of square degree tiles per zoom level, each
+split into CELLS_PER_TILE x CELLS_PER_TILE cells. Listings are grouped into
+cells in SQL with floor(lat / cell) and floor(lon / cell), and the cells of
+each tile are cached per filter signature so panning only computes the
+tiles that newly came into view.
+"""
+
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Max
+from django.db.models.functions import Floor
+from rest_framework.exceptions import ValidationError
+
+from core.metrics import record_cache
+from listing.facets import filter_signature
+
+CELLS_PER_TILE = 8
+MAX_ZOOM = 20
+MAX_TILES = 64
+
+
+def parse_bbox(value):
+    """Return (min lon, min lat, max lon, max lat) from a bbox parameter"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = map(float, value.split(','))
+    except (AttributeError, ValueError):
+        raise ValidationError(
+            {'bbox': 'Must be min_lon,min_lat,max_lon,max_lat.'})
+    if not (-180 <= min_lon < max_lon <= 180 and
+            -90 <= min_lat < max_lat <= 90):
+        raise ValidationError({'bbox': 'Invalid bounding box.'})
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_zoom(value):
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({'zoom': 'Must be an integer.'})
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValidationError({'zoom': f'Must be between 0 and {MAX_ZOOM}.'})
+    return zoom
+
+
+def tiles_for(bbox, tile_size):
+    """Return the (x, y) tiles covering a bounding box"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    xs = range(math.floor(min_lon / tile_size),
+               math.floor(max_lon / tile_size) + 1)
+    ys = range(math.floor(min_lat / tile_size),
+               math.floor(max_lat / tile_size) + 1)
+    if len(xs) * len(ys) > MAX_TILES:
+        raise ValidationError(
+            {'bbox': 'Bounding box is too large for this zoom level.'})
+    return [(x, y) for x in xs for y in ys]
+
+
+def cluster_tiles(queryset, tiles, tile_size):
+    """Return {tile: [cluster, ...]} for the given tiles in one query"""
+    cell = tile_size / CELLS_PER_TILE
+    xs = [x for x, _ in tiles]
+    ys = [y for _, y in tiles]
+    rows = queryset \
+        .order_by() \
+        .filter(address__longitude__gte=min(xs) * tile_size,
+                address__longitude__lt=(max(xs) + 1) * tile_size,
+                address__latitude__gte=min(ys) * tile_size,
+                address__latitude__lt=(max(ys) + 1) * tile_size) \
+        .annotate(cell_x=Floor(F('address__longitude') / cell),
+                  cell_y=Floor(F('address__latitude') / cell)) \
+        .values('cell_x', 'cell_y') \
+        .annotate(count=Count('id'),
+                  latitude=Avg('address__latitude'),
+                  longitude=Avg('address__longitude'),
+                  listing_id=Max('id'))
+
+    clusters = {tile: [] for tile in tiles}
+    for row in rows:
+        tile = (int(row['cell_x']) // CELLS_PER_TILE,
+                int(row['cell_y']) // CELLS_PER_TILE)
+        if tile in clusters:
+            clusters[tile].append({
+                'latitude': row['latitude'],
+                'longitude': row['longitude'],
+                'count': row['count'],
+                'listing_id': row['listing_id'],
+            })
+    return clusters
+
+
+def get_clusters(queryset, query_params):
+    """Return clusters for the bbox and zoom in the query parameters"""
+    bbox = parse_bbox(query_params.get('bbox'))
+    zoom = parse_zoom(query_params.get('zoom'))
+    tile_size = 360 / 2 ** zoom
+    tiles = tiles_for(bbox, tile_size)
+
+    signature = filter_signature(query_params)
+    keys = {tile: f'map_clusters:{signature}:{zoom}:{tile[0]}:{tile[1]}'
+            for tile in tiles}
+    cached = cache.get_many(keys.values())
+    missing = [tile for tile in tiles if keys[tile] not in cached]
+    for tile in tiles:
+        record_cache('map_clusters', tile not in missing)
+    clusters = {tile: cached.get(key) for tile, key in keys.items()}
+    if missing:
+        fresh = cluster_tiles(queryset, missing, tile_size)
+        cache.set_many({keys[tile]: fresh[tile] for tile in missing},
+                       settings.MAP_CLUSTERS_CACHE_SECONDS)
+        clusters.update(fresh)
+    return [cluster for tile in tiles for cluster in clusters[tile]]
@@ -0,0 +1,115 @@
+"""
+Facet counts for listing searches
+
+All facets are computed by a single GROUPING SETS query over the listings
+matching the current filters, then cached per filter signature.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+
+from core.metrics import record_cache
+from core.models import Address, Category, Listing
+
+# Lower bounds of the price buckets, in cents
+PRICE_BUCKETS_CENTS = [0, 2500, 5000, 10000, 25000, 50000]
+# Query parameters that do not change which listings match
+NON_FILTER_PARAMS = {'facets', 'limit', 'cursor', 'sort', 'format', 'bbox',
+                     'zoom'}
+
+# Bit set by GROUPING() for each key column that is aggregated away
+GROUPING_CATEGORY = 0b0111
+GROUPING_CITY = 0b1011
+GROUPING_PRICE = 0b1101
+GROUPING_YEAR = 0b1110
+
+
+def _price_bucket_sql():
+    cases = ' '.join(
+        f'WHEN l.price_cents >= {bound} THEN {bound}'
+        for bound in reversed(PRICE_BUCKETS_CENTS))
+    return f'CASE {cases} END'
+
+
+def facet_counts(queryset):
+    """Count listings of a queryset per category, city, price and decade"""
+    facets = {'category': [], 'city': [], 'price': [], 'year': []}
+    try:
+        listings, params = queryset.order_by().values('id').query \
+            .get_compiler(using=queryset.db).as_sql()
+    except EmptyResultSet:
+        # Filters that can match nothing, such as an unknown category
+        return facets
+    sql = f'''
+        SELECT category_id, category_name, city, price_bucket, year_bucket,
+               COUNT(DISTINCT listing_id),
+               GROUPING(category_id, city, price_bucket, year_bucket)
+        FROM (
+            SELECT l.id AS listing_id,
+                   lc.category_id,
+                   c.name AS category_name,
+                   a.city,
+                   {_price_bucket_sql()} AS price_bucket,
+                   (l.year / 10) * 10 AS year_bucket
+            FROM {Listing._meta.db_table} l
+            JOIN {Address._meta.db_table} a ON a.id = l.address_id
+            LEFT JOIN {Listing.category.through._meta.db_table} lc
+                ON lc.listing_id = l.id
+            LEFT JOIN {Category._meta.db_table} c ON c.id = lc.category_id
+            WHERE l.id IN ({listings})
+        ) matching
+        GROUP BY GROUPING SETS (
+            (category_id, category_name), (city), (price_bucket),
+            (year_bucket)
+        )
+    '''
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    upper = dict(zip(PRICE_BUCKETS_CENTS, PRICE_BUCKETS_CENTS[1:]))
+    for category_id, name, city, price, year, count, grouping in rows:
+        if grouping == GROUPING_CATEGORY and category_id is not None:
+            facets['category'].append(
+                {'id': category_id, 'name': name, 'count': count})
+        elif grouping == GROUPING_CITY:
+            facets['city'].append({'value': city, 'count': count})
+        elif grouping == GROUPING_PRICE:
+            facets['price'].append(
+                {'min': price, 'max': upper.get(price), 'count': count})
+        elif grouping == GROUPING_YEAR:
+            facets['year'].append({
+                'min': year,
+                'max': year + 9 if year is not None else None,
+                'count': count})
+
+    facets['category'].sort(key=lambda value: -value['count'])
+    facets['city'].sort(key=lambda value: -value['count'])
+    for name in ('price', 'year'):
+        facets[name].sort(key=lambda value: (value['min'] is None,
+                                             value['min'] or 0))
+    return facets
+
+
+def filter_signature(query_params):
+    """Return a stable key for the filters in a request's query string"""
+    items = sorted(
+        (key, ','.join(sorted(query_params.getlist(key))))
+        for key in query_params
+        if key not in NON_FILTER_PARAMS)
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+
+def get_facets(queryset, query_params):
+    """Return facet counts for the filtered queryset, cached briefly"""
+    key = f'listing_facets:{filter_signature(query_params)}'
+    facets = cache.get(key)
+    record_cache('listing_facets', facets is not None)
+    if facets is None:
+        facets = facet_counts(queryset)
+        cache.set(key, facets, settings.LISTING_FACETS_CACHE_SECONDS)
+    return facets
@@ -0,0 +1,157 @@
+"""
+Filtering, sorting and keyset pagination for listing searches
+
+Each sort order ends in id so it is total, and every page after the first
+starts from an opaque cursor holding the sort key of the last row seen.
+Listing.Meta.indexes has an index to serve each supported combination:
+
+    newest               primary key, scanned backwards
+    price / -price       (price_cents, id)
+    rating               (rating, id), scanned backwards
+    year_min / year_max  (year, price_cents)
+    make / model         (UPPER(make), UPPER(model), price_cents)
+    near_zip / radius_mi address (latitude, longitude)
+"""
+
+import base64
+import json
+import logging
+
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from core.geo import bounding_box, centroid, centroids_loaded, haversine_mi
+
+logger = logging.getLogger(__name__)
+
+LISTING_PAGE_SIZE = 50
+LISTING_MAX_PAGE_SIZE = 200
+LISTING_SORTS = {
+    'newest': ('-id',),
+    'price': ('price_cents', 'id'),
+    '-price': ('-price_cents', '-id'),
+    'rating': ('-rating', '-id'),
+}
+RANGE_FILTERS = {
+    'price_min': 'price_cents__gte',
+    'price_max': 'price_cents__lte',
+    'year_min': 'year__gte',
+    'year_max': 'year__lte',
+}
+TEXT_FILTERS = {
+    'make': 'make__iexact',
+    'model': 'model__iexact',
+}
+DEFAULT_RADIUS_MI = 25
+MAX_RADIUS_MI = 500
+
+
+class ZipSearchUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Searching by zip code is not available.'
+    default_code = 'zip_search_unavailable'
+
+
+def search_listings(queryset, params):
+    """Apply the range, make/model, proximity and sort parameters"""
+    for param, lookup in RANGE_FILTERS.items():
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: int(params[param])})
+            except ValueError:
+                raise ValidationError({param: 'Must be an integer.'})
+    for param, lookup in TEXT_FILTERS.items():
+        if params.get(param):
+            queryset = queryset.filter(**{lookup: params[param]})
+
+    if params.get('near_zip'):
+        queryset = filter_near(queryset, params)
+
+    sort = params.get('sort', 'newest')
+    if sort not in LISTING_SORTS:
+        raise ValidationError(
+            {'sort': f'Must be one of {", ".join(LISTING_SORTS)}.'})
+    return queryset.order_by(*LISTING_SORTS[sort])
+
+
+def filter_near(queryset, params):
+    """Keep listings within radius_mi miles of the near_zip centroid"""
+    try:
+        radius = float(params.get('radius_mi', DEFAULT_RADIUS_MI))
+    except ValueError:
+        raise ValidationError({'radius_mi': 'Must be a number.'})
+    if not 0 < radius <= MAX_RADIUS_MI:
+        raise ValidationError(
+            {'radius_mi': f'Must be between 0 and {MAX_RADIUS_MI}.'})
+    point = centroid(params['near_zip'])
+    if point is None:
+        if not centroids_loaded():
+            # The deploy's fault, not the client's
+            logger.error('No zip centroids loaded, run load_zip_centroids')
+            raise ZipSearchUnavailable()
+        raise ValidationError({'near_zip': 'Unknown zip code.'})
+
+    # The box narrows the search with the lat/lon index, then the exact
+    # distance drops its corners.
+    min_lat, max_lat, min_lon, max_lon = bounding_box(*point, radius)
+    return queryset \
+        .filter(address__latitude__range=(min_lat, max_lat),
+                address__longitude__range=(min_lon, max_lon)) \
+        .alias(distance_mi=haversine_mi(*point, 'address__latitude',
+                                        'address__longitude')) \
+        .filter(distance_mi__lte=radius)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, ordering):
+    """Return the sort key values held by a cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != len(ordering) or \
+            not all(isinstance(value, (int, float)) for value in values):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    return values
+
+
+def after(queryset, ordering, values):
+    """Keep the rows that sort strictly after the given key values"""
+    # (a, b) > (x, y) is spelled a > x OR (a = x AND b > y); the extra
+    # bound on the leading column lets the index range scan start there.
+    first = ordering[0]
+    op = 'lt' if first.startswith('-') else 'gt'
+    queryset = queryset.filter(**{f'{first.lstrip("-")}__{op}e': values[0]})
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        op = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{op}': value})
+        equal[name] = value
+    return queryset.filter(condition)
+
+
+def keyset_page(queryset, params):
+    """Return (rows, next cursor or None) for an ordered queryset"""
+    try:
+        limit = min(int(params.get('limit', LISTING_PAGE_SIZE)),
+                    LISTING_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    limit = max(limit, 1)
+    ordering = queryset.query.order_by
+    if params.get('cursor'):
+        queryset = after(queryset, ordering,
+                         decode_cursor(params['cursor'], ordering))
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(
+        [getattr(last, field.lstrip('-')) for field in ordering])
@@ -1,8 +1,21 @@
 from rest_framework import serializers, status
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Max, Prefetch
 from django.utils import timezone
+from core.images import (
+    queue_processing_many,
+    srcset,
+    stage_uploads,
+    StagedUploadMixin,
+    thumbnail_url,
+    )
+from core.uploads import ImageUploadField
 from core.models import (
     Listing,
     Category,
+    CategoryClosure,
     Address,
     Saved,
     ListingReview,
@@ -10,9 +23,14 @@ from core.models import (
     Orders,
     ListingImage,
     UnavailableDate,
+    IMAGE_STATUS_PENDING,
+    IMAGE_STATUS_READY,
     )
 from datetime import timedelta
 
+# Listing cards get the narrowest image derivative at least this wide
+CARD_IMAGE_WIDTH = 480
+
 
 class CategorySerializer(serializers.ModelSerializer):
     """ Serializer for categories """
@@ -21,6 +39,23 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'parent_category']
         read_only_fields = ['id']
 
+    def validate_parent_category(self, parent):
+        """Reject parents that would turn the tree into a cycle"""
+        if parent is not None and self.instance is not None and \
+                CategoryClosure.objects.filter(
+                    ancestor=self.instance, descendant=parent).exists():
+            raise serializers.ValidationError(
+                'A category cannot be moved under itself.')
+        return parent
+
+    def save(self, **kwargs):
+        # Category.save checks again under a lock, for concurrent moves
+        try:
+            return super().save(**kwargs)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(
+                serializers.as_serializer_error(e))
+
 
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
@@ -108,12 +143,40 @@ class ListingDetailSerializer(serializers.ModelSerializer):
 class ListingSerializer(ListingDetailSerializer):
     """Serializer for listings"""
     studio = serializers.CharField(source='user.studio', read_only=True)
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta(ListingDetailSerializer.Meta):
         fields = [
-            'id', 'title', 'studio', 'price_cents', 'address', 'image'
+            'id', 'title', 'studio', 'price_cents', 'address', 'image',
+            'thumbnail'
             ]
 
+    @staticmethod
+    def prefetch(queryset):
+        """Load everything a page of listings needs in three queries"""
+        # DISTINCT ON keeps only the first ready image of each listing
+        primary = ListingImage.objects \
+            .filter(status=IMAGE_STATUS_READY) \
+            .order_by('listing_id', 'order', 'id') \
+            .distinct('listing_id')
+        return queryset \
+            .select_related('user', 'address') \
+            .prefetch_related(
+                Prefetch('image',
+                         queryset=ListingImage.objects.only('listing_id')),
+                Prefetch('image', queryset=primary,
+                         to_attr='primary_image'))
+
+    def get_thumbnail(self, obj) -> str:
+        """Card-sized copy of the listing's first image"""
+        primary = getattr(obj, 'primary_image', None)
+        if primary is None:
+            primary = obj.image \
+                .filter(status=IMAGE_STATUS_READY) \
+                .order_by('order', 'id')[:1]
+        return thumbnail_url(primary[0], CARD_IMAGE_WIDTH) \
+            if primary else None
+
 
 class SavedSerializer(serializers.ModelSerializer):
     """Serializer for Saved model"""
@@ -209,9 +272,45 @@ class OrdersSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ListingImageSerializer(serializers.ModelSerializer):
+class ListingImageSerializer(StagedUploadMixin,
+                             serializers.ModelSerializer):
+    image = ImageUploadField(required=True)
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ListingImage
-        fields = ['id', 'listing', 'order', 'image']
-        read_only_fields = ['id']
-        extra_kwargs = {'image': {'required': True}}
+        fields = ['id', 'listing', 'order', 'image', 'status', 'srcset']
+        read_only_fields = ['id', 'status', 'srcset']
+
+    def get_srcset(self, obj) -> dict:
+        """Resized copies of the image per format, as srcset strings"""
+        return srcset(obj)
+
+
+class ListingImageBatchSerializer(serializers.Serializer):
+    """Several images added to a listing in one request"""
+    images = serializers.ListField(
+        child=ImageUploadField(),
+        allow_empty=False,
+        max_length=settings.UPLOAD_BATCH_MAX_FILES)
+
+    def create(self, validated_data):
+        """Stage the images and add them after the listing's others"""
+        listing = validated_data['listing']
+        staged = stage_uploads(validated_data['images'])
+        with transaction.atomic():
+            last = listing.image.aggregate(last=Max('order'))['last'] or 0
+            images = ListingImage.objects.bulk_create([
+                ListingImage(listing=listing,
+                             order=last + position,
+                             staged_file=staged_file,
+                             status=IMAGE_STATUS_PENDING)
+                for position, staged_file in enumerate(staged, 1)])
+            queue_processing_many(images)
+        return images
+
+
+class ListingImageOrderSerializer(serializers.Serializer):
+    """The ids of all of a listing's images, in their new order"""
+    order = serializers.ListField(child=serializers.IntegerField(),
+                                  allow_empty=False)
@@ -1,6 +1,9 @@
 """Tests for listing api"""
 
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 
@@ -8,6 +11,7 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import (
+    Address,
     Listing,
     Category
     )
@@ -17,6 +21,7 @@ LISTINGS_URL = reverse('listing:listing-list')
 READ_LISTINGS_URL = reverse('listing:listingreadonly-list')
 CATEGORY_URL = reverse('listing:category-list')
 READ_CATEGORY_URL = reverse('listing:categoryreadonly-list')
+TREE_URL = reverse('listing:categoryreadonly-tree')
 
 
 def detail_url(id):
@@ -52,6 +57,71 @@ class PublicCategoryAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
 
+class CategoryTreeAPITests(TestCase):
+    """Test the cached category tree endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.user = create_user(
+                                email='test@example.com',
+                                first_name='Joe',
+                                last_name='Smith',
+                                phone_number='8054394923',
+                                password='testpass123')
+        self.address = Address.objects.create(address_1='1197 W 36th St')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guitars = Category.objects.create(name='Guitars')
+            self.electric = Category.objects.create(
+                name='Electric Guitars', parent_category=self.guitars)
+
+    def _add_listing(self, category):
+        with self.captureOnCommitCallbacks(execute=True):
+            listing = create_listing(self.user, address=self.address)
+            listing.category.add(category)
+
+    def test_tree_is_nested_with_counts(self):
+        """Test the tree nests children and counts subtree listings"""
+        self._add_listing(self.electric)
+
+        res = self.client.get(TREE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        root = res.data[0]
+        self.assertEqual(root['name'], 'Guitars')
+        self.assertEqual(root['listing_count'], 1)
+        self.assertEqual(root['children'][0]['name'], 'Electric Guitars')
+        self.assertEqual(root['children'][0]['listing_count'], 1)
+
+    def test_tree_served_without_queries(self):
+        """Test a warm tree is served from memory"""
+        self.client.get(TREE_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(TREE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_tree_not_modified(self):
+        """Test clients holding the current version get a 304"""
+        res = self.client.get(TREE_URL)
+
+        res = self.client.get(TREE_URL, HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_listing_change_invalidates_tree(self):
+        """Test saving a listing refreshes the counts"""
+        etag = self.client.get(TREE_URL)['ETag']
+
+        self._add_listing(self.guitars)
+        res = self.client.get(TREE_URL)
+
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.data[0]['listing_count'], 1)
+
+
 class PrivateListingAPITests(TestCase):
     """Test authenticated API Requests"""
     def setUp(self):
@@ -117,3 +187,26 @@ class AdminPrivateCategoryAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
         categories = Category.objects.filter(name='Category')
         self.assertFalse(categories.exists())
+
+    def test_move_category_under_itself_error(self):
+        """Test a category cannot become its own descendant"""
+        parent = Category.objects.create(name='Parent')
+        child = Category.objects.create(name='Child', parent_category=parent)
+        url = reverse('listing:category-detail', args=[parent.id])
+        res = self.client.patch(url, {'parent_category': child.id})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('listing.serializers.CategorySerializer.validate_parent_category',
+           lambda self, parent: parent)
+    def test_move_category_under_itself_checked_on_save(self):
+        """Test a cycle missed by validation is still a 400, not a 500"""
+        parent = Category.objects.create(name='Parent')
+        child = Category.objects.create(name='Child', parent_category=parent)
+        url = reverse('listing:category-detail', args=[parent.id])
+
+        res = self.client.patch(url, {'parent_category': child.id})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent_category', res.data)
+        parent.refresh_from_db()
+        self.assertIsNone(parent.parent_category)
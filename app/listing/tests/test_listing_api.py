@@ -1,11 +1,18 @@
 """Tests for listing api"""
 
+import io
 import tempfile
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
@@ -15,16 +22,34 @@ from core.models import (
     Listing,
     Category,
     Address,
-    ListingImage
+    ImageBlob,
+    Job,
+    ListingImage,
+    ListingReview,
+    ZipCentroid,
+    IMAGE_STATUS_FAILED,
+    IMAGE_STATUS_PENDING,
+    IMAGE_STATUS_READY,
+    JOB_STATUS_DONE,
     )
+from core import jobs
+from core.direct_uploads import INTENT_SALT, complete
+from core.images import derivative_name, queue_processing
 from listing.serializers import (
     ListingSerializer,
     ListingDetailSerializer,
+    ListingImageSerializer,
     )
 
 LISTINGS_URL = reverse('listing:listing-list')
 READ_LISTINGS_URL = reverse('listing:listingreadonly-list')
 IMAGE_URL = reverse('listing:uploadimage-list')
+UPLOAD_IMAGES_URL = reverse('listing:uploadimage-upload-images')
+REORDER_IMAGES_URL = reverse('listing:uploadimage-reorder-images')
+UPLOAD_INTENT_URL = reverse('listing:uploadimage-upload-intent')
+UPLOAD_COMPLETE_URL = reverse('listing:uploadimage-upload-complete')
+MAP_CLUSTERS_URL = reverse('listing:listingreadonly-map-clusters')
+AUTOCOMPLETE_URL = reverse('listing:listingreadonly-autocomplete')
 
 
 def detail_url(id):
@@ -84,6 +109,33 @@ class PublicListingAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.data), 1)
 
+    def test_list_inlines_primary_thumbnail(self):
+        """Test cards carry their first ready image in constant queries"""
+        user = create_user(email='test1@example.com',
+                           first_name='Joey',
+                           last_name='Smith',
+                           phone_number='8053394923',
+                           password='testpass123')
+        for n in range(3):
+            listing = create_listing(user=user)
+            for order, name in ((2, 'second'), (1, 'first')):
+                image = f'uploads/listing/{n}-{name}.jpg'
+                ListingImage.objects.create(
+                    listing=listing, order=order, image=image,
+                    variants={'source': image, 'widths': [160, 480]})
+            ListingImage.objects.create(listing=listing, order=0,
+                                        status=IMAGE_STATUS_PENDING)
+        create_listing(user=user)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(READ_LISTINGS_URL)
+
+        thumbnails = [card['thumbnail'] for card in res.data]
+        self.assertIsNone(thumbnails[0])
+        for n, thumbnail in zip((2, 1, 0), thumbnails[1:]):
+            self.assertTrue(thumbnail.endswith(f'/{n}-first_w480.jpg'))
+        self.assertEqual(len(res.data[1]['image']), 3)
+
     def test_update_delete_in_view_only_error(self):
         """Test that you cannot post/patch/delete
         anything from read only view"""
@@ -114,6 +166,293 @@ class PublicListingAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class ListingFacetsAPITests(TestCase):
+    """Test facet counts on the read only listing endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.user = create_user(email='test@example.com',
+                                first_name='Joe',
+                                last_name='Smith',
+                                phone_number='8054394923',
+                                password='testpass123')
+        self.drums = Category.objects.create(name='Drums')
+        self.guitars = Category.objects.create(name='Guitars')
+        drum = create_listing(user=self.user, price_cents=3000, year=1975)
+        drum.category.add(self.drums)
+        guitar = create_listing(user=self.user, price_cents=3500, year=1979,
+                                address={'address_1': '1 Main St',
+                                         'city': 'San Diego',
+                                         'state': 'CA',
+                                         'zip_code': '92101'})
+        guitar.category.add(self.drums, self.guitars)
+
+    def test_facets_are_opt_in(self):
+        """Test the plain list response is unchanged"""
+        res = self.client.get(READ_LISTINGS_URL)
+
+        self.assertIsInstance(res.data, list)
+
+    def test_facet_counts(self):
+        """Test counts per category, city, price bucket and decade"""
+        res = self.client.get(READ_LISTINGS_URL, {'facets': 'true'})
+
+        self.assertEqual(len(res.data['results']), 2)
+        facets = res.data['facets']
+        self.assertEqual(facets['category'], [
+            {'id': self.drums.id, 'name': 'Drums', 'count': 2},
+            {'id': self.guitars.id, 'name': 'Guitars', 'count': 1},
+        ])
+        self.assertEqual(
+            {city['value']: city['count'] for city in facets['city']},
+            {'Los Angeles': 1, 'San Diego': 1})
+        self.assertEqual(facets['price'],
+                         [{'min': 2500, 'max': 5000, 'count': 2}])
+        self.assertEqual(facets['year'],
+                         [{'min': 1970, 'max': 1979, 'count': 2}])
+
+    def test_facets_follow_filters(self):
+        """Test facets only count listings matching the filters"""
+        res = self.client.get(READ_LISTINGS_URL,
+                              {'facets': '1', 'category': self.guitars.id})
+
+        self.assertEqual(res.data['facets']['city'],
+                         [{'value': 'San Diego', 'count': 1}])
+
+    def test_facets_for_unknown_category(self):
+        """Test a category filter matching nothing gives empty facets"""
+        missing = Category.objects.order_by('-id').first().id + 1
+
+        res = self.client.get(READ_LISTINGS_URL,
+                              {'facets': 'true', 'category': missing})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [])
+        self.assertEqual(res.data['facets'], {
+            'category': [], 'city': [], 'price': [], 'year': []})
+
+
+class ListingSearchAPITests(TestCase):
+    """Test filtering, sorting and paging the read only listings"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='test@example.com',
+                                first_name='Joe',
+                                last_name='Smith',
+                                phone_number='8054394923',
+                                password='testpass123')
+        self.cheap = create_listing(user=self.user, price_cents=1000,
+                                    year=1965, make='Fender',
+                                    model='Twin Reverb')
+        self.mid = create_listing(user=self.user, price_cents=5000,
+                                  year=1978, make='Gibson', model='SG')
+        self.dear = create_listing(user=self.user, price_cents=9000,
+                                   year=1990, make='Fender',
+                                   model='Stratocaster')
+
+    def ids(self, res):
+        return [listing['id'] for listing in res.data]
+
+    def test_range_filters(self):
+        """Test price and year bounds are inclusive"""
+        res = self.client.get(READ_LISTINGS_URL, {'price_min': 5000,
+                                                  'year_max': 1990})
+
+        self.assertEqual(self.ids(res), [self.dear.id, self.mid.id])
+
+    def test_make_and_model_filters(self):
+        """Test make and model match case insensitively"""
+        res = self.client.get(READ_LISTINGS_URL, {'make': 'fender',
+                                                  'model': 'STRATOCASTER'})
+
+        self.assertEqual(self.ids(res), [self.dear.id])
+
+    def test_invalid_parameters(self):
+        """Test bad filter, sort or cursor values are rejected"""
+        for params in ({'price_min': 'cheap'}, {'sort': 'title'},
+                       {'cursor': 'nonsense'}):
+            res = self.client.get(READ_LISTINGS_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sort_by_price(self):
+        """Test sorting by price in both directions"""
+        res = self.client.get(READ_LISTINGS_URL, {'sort': 'price'})
+        self.assertEqual(self.ids(res),
+                         [self.cheap.id, self.mid.id, self.dear.id])
+
+        res = self.client.get(READ_LISTINGS_URL, {'sort': '-price'})
+        self.assertEqual(self.ids(res),
+                         [self.dear.id, self.mid.id, self.cheap.id])
+
+    def test_sort_by_rating(self):
+        """Test sorting by the average review rating"""
+        reviewer = create_user(email='other@example.com',
+                               first_name='Jane',
+                               last_name='Doe',
+                               phone_number='8054394924',
+                               password='testpass123')
+        ListingReview.objects.create(user=reviewer, listing=self.mid,
+                                     stars=5)
+        ListingReview.objects.create(user=reviewer, listing=self.cheap,
+                                     stars=3)
+
+        res = self.client.get(READ_LISTINGS_URL, {'sort': 'rating'})
+
+        self.assertEqual(self.ids(res),
+                         [self.mid.id, self.cheap.id, self.dear.id])
+        self.mid.refresh_from_db()
+        self.assertEqual(self.mid.rating, 5)
+
+    def test_keyset_pagination(self):
+        """Test following the next link walks every listing once"""
+        res = self.client.get(READ_LISTINGS_URL, {'sort': 'price',
+                                                  'limit': 2})
+        self.assertEqual(self.ids(res), [self.cheap.id, self.mid.id])
+
+        next_url = res['Link'].split(';')[0].strip('<>')
+        res = self.client.get(next_url)
+
+        self.assertEqual(self.ids(res), [self.dear.id])
+        self.assertNotIn('Link', res)
+
+
+class ListingProximityAPITests(TestCase):
+    """Test searching listings near a zip code"""
+
+    def setUp(self):
+        self.client = APIClient()
+        ZipCentroid.objects.bulk_create([
+            ZipCentroid(zip_code='90007', latitude=34.0283,
+                        longitude=-118.2848),
+            ZipCentroid(zip_code='90401', latitude=34.0165,
+                        longitude=-118.4929),
+            ZipCentroid(zip_code='92101', latitude=32.7194,
+                        longitude=-117.1628),
+        ])
+        user = create_user(email='test@example.com',
+                           first_name='Joe',
+                           last_name='Smith',
+                           phone_number='8054394923',
+                           password='testpass123')
+        self.listings = {
+            zip_code: create_listing(user=user, address={
+                'address_1': '1 Main St',
+                'city': 'Somewhere',
+                'state': 'CA',
+                'zip_code': zip_code})
+            for zip_code in ('90007', '90401', '92101')
+        }
+
+    def test_address_coordinates_cached_on_save(self):
+        """Test addresses pick up their zip centroid"""
+        address = self.listings['92101'].address
+
+        self.assertEqual((address.latitude, address.longitude),
+                         (32.7194, -117.1628))
+
+    def test_near_zip_within_radius(self):
+        """Test only listings inside the radius are returned"""
+        res = self.client.get(READ_LISTINGS_URL,
+                              {'near_zip': '90007', 'radius_mi': 20})
+
+        self.assertEqual(
+            sorted(listing['id'] for listing in res.data),
+            sorted([self.listings['90007'].id, self.listings['90401'].id]))
+
+    def test_near_unknown_zip(self):
+        """Test an unknown zip code is a bad request"""
+        res = self.client.get(READ_LISTINGS_URL, {'near_zip': '00000'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_near_zip_without_centroids(self):
+        """Test an unloaded centroid table is not blamed on the client"""
+        ZipCentroid.objects.all().delete()
+
+        with self.assertLogs('listing.search', 'ERROR'):
+            res = self.client.get(READ_LISTINGS_URL, {'near_zip': '90007'})
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_map_clusters(self):
+        """Test nearby listings share a cell at low zoom levels"""
+        cache.clear()
+        params = {'bbox': '-119,32,-117,35', 'zoom': 4}
+
+        res = self.client.get(MAP_CLUSTERS_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        counts = sorted(c['count'] for c in res.data['clusters'])
+        self.assertEqual(counts, [1, 2])
+
+        res = self.client.get(MAP_CLUSTERS_URL, dict(params, zoom=8))
+
+        self.assertEqual(len(res.data['clusters']), 3)
+
+    def test_map_clusters_bad_bbox(self):
+        """Test a malformed or oversized bounding box is rejected"""
+        for params in ({'bbox': 'nowhere', 'zoom': 4},
+                       {'bbox': '-180,-90,180,90', 'zoom': 12}):
+            res = self.client.get(MAP_CLUSTERS_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ListingAutocompleteAPITests(TestCase):
+    """Test make and model suggestions"""
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        user = create_user(email='test@example.com',
+                           first_name='Joe',
+                           last_name='Smith',
+                           phone_number='8054394923',
+                           password='testpass123')
+        for make, model in [('Fender', 'Stratocaster'),
+                            ('Fender', 'Telecaster'),
+                            ('fender', 'Stratocaster'),
+                            ('Gibson', 'Les Paul'),
+                            ('Coffee', 'Deluxe')] + \
+                [('Offender', 'Amp')] * 4:
+            create_listing(user=user, make=make, model=model)
+
+    def test_make_suggestions_ranked_by_use(self):
+        """Test matches anywhere in the make, most used first"""
+        res = self.client.get(AUTOCOMPLETE_URL, {'q': 'nde'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{'value': 'Offender', 'count': 4},
+                                    {'value': 'Fender', 'count': 3}])
+
+    def test_prefix_suggestions_ranked_first(self):
+        """Test makes starting with the term come before more used makes
+        only containing it"""
+        res = self.client.get(AUTOCOMPLETE_URL, {'q': 'fen'})
+
+        self.assertEqual(res.data, [{'value': 'Fender', 'count': 3},
+                                    {'value': 'Offender', 'count': 4}])
+
+    def test_model_suggestions_scoped_by_make(self):
+        """Test model suggestions can be limited to one make"""
+        res = self.client.get(AUTOCOMPLETE_URL, {'field': 'model',
+                                                 'q': 'caster',
+                                                 'make': 'FENDER',
+                                                 'limit': 1})
+
+        self.assertEqual(res.data, [{'value': 'Stratocaster', 'count': 2}])
+
+    def test_short_term_rejected(self):
+        """Test terms shorter than a trigram are rejected"""
+        res = self.client.get(AUTOCOMPLETE_URL, {'q': 'fe'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class PrivateListingAPITests(TestCase):
     """Test authenticated API Requests"""
     def setUp(self):
@@ -343,6 +682,31 @@ class PrivateListingAPITests(TestCase):
         self.assertNotIn(s1.data, res.data)
         self.assertIn(s2.data, res.data)
 
+    def test_filtering_listing_with_parent_category(self):
+        """Test filtering by a category includes its subcategories"""
+        guitars = Category.objects.create(name='Guitars')
+        electric = Category.objects.create(name='Electric Guitars',
+                                           parent_category=guitars)
+        listing = create_listing(user=self.user)
+        listing.category.add(electric)
+        create_listing(user=self.user, title='Uncategorized')
+
+        res = self.client.get(READ_LISTINGS_URL, {'category': guitars.id})
+
+        self.assertEqual([item['id'] for item in res.data], [listing.id])
+
+    def test_filtering_listing_with_several_categories_no_duplicates(self):
+        """Test a listing in several filtered categories is listed once"""
+        drums = Category.objects.create(name='Drums')
+        cymbals = Category.objects.create(name='Cymbals')
+        listing = create_listing(user=self.user)
+        listing.category.add(drums, cymbals)
+        params = {'category': f'{drums.id},{cymbals.id}'}
+
+        res = self.client.get(READ_LISTINGS_URL, params)
+
+        self.assertEqual([item['id'] for item in res.data], [listing.id])
+
 
 class AdminPrivateTestCase(TestCase):
     """Tests that admin can access and edit all listings"""
@@ -456,6 +820,95 @@ class ImageUploadTests(TestCase):
         self.assertIn('image', res.data)
         ListingImage.objects.get(id=res.data['id']).delete()
 
+    def test_same_image_stored_once(self):
+        """Test a photo uploaded to two listings is stored once"""
+        other_listing = create_listing(user=self.user)
+        out = io.BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(out, format='JPEG')
+        for listing in (self.listing, other_listing):
+            upload = SimpleUploadedFile('car.jpg', out.getvalue())
+            self.client.post(IMAGE_URL, {'listing': listing.id,
+                                         'image': upload},
+                             format='multipart')
+        jobs.run_pending()
+
+        first, second = ListingImage.objects.order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(second.variants, first.variants)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.name, first.image.name)
+        self.assertEqual(blob.refcount, 2)
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertIsNone(blob.released_at)
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 0)
+        self.assertIsNotNone(blob.released_at)
+
+    def test_upload_image_processed_in_background(self):
+        """Test uploads are staged, then stored and resized by a job"""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = Image.new('RGB', (600, 300))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            payload = {'listing': self.listing.id, 'image': image_file}
+            res = self.client.post(IMAGE_URL, payload, format='multipart')
+
+        self.assertEqual(res.data['status'], IMAGE_STATUS_PENDING)
+        self.assertIsNone(res.data['image'])
+        self.assertEqual(res.data['srcset'], {})
+        # Staged in the file storage, where any task's worker finds it
+        staged_file = ListingImage.objects.get(id=res.data['id']).staged_file
+        self.assertTrue(staged_file.startswith('staging/'))
+        self.assertTrue(default_storage.exists(staged_file))
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        image = ListingImage.objects.get(id=res.data['id'])
+        self.assertEqual(image.status, IMAGE_STATUS_READY)
+        self.assertEqual(image.staged_file, '')
+        self.assertFalse(default_storage.exists(staged_file))
+        self.assertEqual(image.variants['widths'], [160, 480])
+        name = derivative_name(image.image.name, 480, 'webp')
+        self.assertTrue(default_storage.exists(name))
+        srcset = ListingImageSerializer(image).data['srcset']
+        self.assertIn('_w480.webp 480w', srcset['webp'])
+        self.assertIn('_w160.jpg 160w', srcset['jpeg'])
+        image.delete()
+
+    def test_missing_staged_file(self):
+        """Test an upload whose staged file is gone fails without retries"""
+        image = ListingImage.objects.create(listing=self.listing,
+                                            status=IMAGE_STATUS_PENDING,
+                                            staged_file='staging/gone.jpg')
+        queue_processing(image)
+
+        with self.assertLogs('core.images', 'ERROR'):
+            self.assertEqual(jobs.run_pending(), 1)
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, IMAGE_STATUS_FAILED)
+        job = Job.objects.get()
+        self.assertEqual(job.status, JOB_STATUS_DONE)
+        self.assertEqual(job.attempts, 1)
+
+    @override_settings(UPLOAD_MAX_FILE_BYTES=1000)
+    def test_upload_image_too_large(self):
+        """Test files over the size cap are refused with a 413"""
+        with tempfile.NamedTemporaryFile(suffix='.png') as image_file:
+            img = Image.effect_noise((200, 200), 64)
+            img.save(image_file, format='PNG')
+            image_file.seek(0)
+            payload = {'listing': self.listing.id, 'image': image_file}
+            res = self.client.post(IMAGE_URL, payload, format='multipart')
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(ListingImage.objects.exists())
+
     def test_upload_image_bad_request(self):
         """Test uploading invalid image to listing"""
         image_upload_url(self.listing.id)
@@ -463,3 +916,184 @@ class ImageUploadTests(TestCase):
         res = self.client.post(IMAGE_URL, payload, format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_images(self):
+        """Test several images are added after the listing's others"""
+        ListingImage.objects.create(listing=self.listing, order=4)
+        uploads = []
+        for color in ('red', 'green', 'blue'):
+            out = io.BytesIO()
+            Image.new('RGB', (20, 20), color).save(out, format='PNG')
+            uploads.append(SimpleUploadedFile(f'{color}.png',
+                                              out.getvalue()))
+
+        res = self.client.post(UPLOAD_IMAGES_URL,
+                               {'listing': self.listing.id,
+                                'images': uploads},
+                               format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([image['order'] for image in res.data], [5, 6, 7])
+        self.assertEqual(jobs.run_pending(), 3)
+        images = ListingImage.objects.filter(id__in=[image['id']
+                                                     for image in res.data])
+        self.assertEqual(
+            {image.status for image in images}, {IMAGE_STATUS_READY})
+        for image in images:
+            image.delete()
+
+    def test_upload_images_other_users_listing(self):
+        """Test batches can only be added to the user's own listings"""
+        other = create_user(email='other@example.com',
+                            first_name='Jane',
+                            last_name='Doe',
+                            phone_number='8054394924',
+                            password='testpass123')
+        listing = create_listing(user=other)
+        upload = SimpleUploadedFile('car.png', b'data')
+
+        res = self.client.post(UPLOAD_IMAGES_URL,
+                               {'listing': listing.id, 'images': [upload]},
+                               format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reorder_images(self):
+        """Test the order of every image is set in one update"""
+        images = [ListingImage.objects.create(listing=self.listing,
+                                              order=position)
+                  for position in range(1, 4)]
+        new_order = [images[2].id, images[0].id, images[1].id]
+
+        # Listing, ids, one UPDATE for every image and the response
+        with self.assertNumQueries(4):
+            res = self.client.post(REORDER_IMAGES_URL,
+                                   {'listing': self.listing.id,
+                                    'order': new_order})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([image['id'] for image in res.data], new_order)
+        images[1].refresh_from_db()
+        self.assertEqual(images[1].order, 3)
+
+    def test_reorder_images_must_list_all(self):
+        """Test an order missing one of the listing's images is refused"""
+        images = [ListingImage.objects.create(listing=self.listing,
+                                              order=position)
+                  for position in range(1, 3)]
+
+        res = self.client.post(REORDER_IMAGES_URL,
+                               {'listing': self.listing.id,
+                                'order': [images[0].id]})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _direct_upload(self, data, filename='car.jpg'):
+        """Upload bytes with an upload intent, returning the token"""
+        res = self.client.post(UPLOAD_INTENT_URL, {
+            'listing': self.listing.id,
+            'filename': filename,
+            'content_type': 'image/jpeg',
+            'size': len(data)})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        form = dict(res.data['fields'],
+                    file=SimpleUploadedFile(filename, data))
+        upload = APIClient().post(res.data['url'], form, format='multipart')
+        self.assertEqual(upload.status_code, status.HTTP_204_NO_CONTENT)
+        return res.data['token']
+
+    def test_direct_upload(self):
+        """Test an image uploaded with an intent is registered and resized"""
+        out = io.BytesIO()
+        Image.new('RGB', (600, 300)).save(out, format='JPEG')
+        token = self._direct_upload(out.getvalue())
+
+        res = self.client.post(UPLOAD_COMPLETE_URL,
+                               {'token': token, 'order': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['status'], IMAGE_STATUS_PENDING)
+        self.assertEqual(jobs.run_pending(), 1)
+        image = ListingImage.objects.get(id=res.data['id'])
+        self.assertEqual(image.listing, self.listing)
+        self.assertEqual(image.order, 2)
+        self.assertEqual(image.status, IMAGE_STATUS_READY)
+        self.assertEqual(image.variants['widths'], [160, 480])
+
+        again = self.client.post(UPLOAD_COMPLETE_URL, {'token': token})
+        self.assertEqual(again.status_code, status.HTTP_400_BAD_REQUEST)
+        image.delete()
+
+    def test_direct_upload_completed_once(self):
+        """Test a completion checks for an earlier one only once it holds
+        the listing's row lock"""
+        out = io.BytesIO()
+        Image.new('RGB', (200, 100)).save(out, format='JPEG')
+        token = self._direct_upload(out.getvalue())
+
+        with CaptureQueriesContext(connection) as queries:
+            complete('listing', self.user, token)
+        sql = [query['sql'] for query in queries.captured_queries]
+        again = self.client.post(UPLOAD_COMPLETE_URL, {'token': token})
+
+        lock = next(i for i, s in enumerate(sql) if 'FOR UPDATE' in s)
+        check = next(i for i, s in enumerate(sql)
+                     if s.startswith('SELECT (1) AS "a" FROM '
+                                     '"core_listingimage"'))
+        self.assertIn('"core_listing"', sql[lock])
+        self.assertLess(lock, check)
+        self.assertEqual(again.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ListingImage.objects.count(), 1)
+        ListingImage.objects.get().image.delete()
+
+    def test_direct_upload_duplicate(self):
+        """Test a direct upload of a stored photo is replaced by it"""
+        out = io.BytesIO()
+        Image.new('RGB', (300, 200), 'green').save(out, format='JPEG')
+        ids = []
+        for _ in range(2):
+            token = self._direct_upload(out.getvalue())
+            res = self.client.post(UPLOAD_COMPLETE_URL, {'token': token})
+            ids.append(res.data['id'])
+            jobs.run_pending()
+        upload = signing.loads(token, salt=INTENT_SALT)['key']
+
+        first, second = ListingImage.objects.filter(id__in=ids).order_by('id')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertFalse(default_storage.exists(upload))
+        self.assertEqual(ImageBlob.objects.get().refcount, 2)
+        first.delete()
+        second.delete()
+
+    def test_direct_upload_not_an_image(self):
+        """Test files that are not images are marked failed and deleted
+        by the job"""
+        token = self._direct_upload(b'not an image')
+        upload = signing.loads(token, salt=INTENT_SALT)['key']
+
+        res = self.client.post(UPLOAD_COMPLETE_URL, {'token': token})
+        self.assertTrue(default_storage.exists(upload))
+        jobs.run_pending()
+
+        image = ListingImage.objects.get(id=res.data['id'])
+        self.assertEqual(image.status, IMAGE_STATUS_FAILED)
+        self.assertEqual(image.variants, {})
+        self.assertFalse(image.image)
+        self.assertFalse(default_storage.exists(upload))
+
+    def test_upload_intent_other_users_listing(self):
+        """Test intents are only given for the user's own listings"""
+        other = create_user(email='other@example.com',
+                            first_name='Jane',
+                            last_name='Doe',
+                            phone_number='8054394924',
+                            password='testpass123')
+        listing = create_listing(user=other)
+
+        res = self.client.post(UPLOAD_INTENT_URL, {
+            'listing': listing.id,
+            'filename': 'car.jpg',
+            'content_type': 'image/jpeg',
+            'size': 100})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -243,3 +243,84 @@ class PrivateCategoryAPITests(TestCase):
         url = reverse('listing:orders-detail', args=[res.data['id']])
         res = self.client.delete(url)
         self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OrdersInboxAPITests(TestCase):
+    """Test filtering and paging the orders inbox"""
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='test@example.com',
+                                first_name='Joe',
+                                last_name='Smith',
+                                phone_number='8054394923',
+                                password='testpass123')
+        self.other = create_user(email='test1@example.com',
+                                 first_name='Joe',
+                                 last_name='Smith',
+                                 phone_number='8054194923',
+                                 password='testpass123')
+        self.client.force_authenticate(self.user)
+        other_listing = create_listing(self.other)
+        own_listing = create_listing(self.user)
+        self.rented = [
+            self._order(self.user, other_listing, 'Pending'),
+            self._order(self.user, other_listing, 'Approved'),
+        ]
+        self.lent = [
+            self._order(self.other, own_listing, 'Pending'),
+            self._order(self.other, own_listing, 'Denied'),
+        ]
+
+    def _order(self, user, listing, order_status):
+        return Orders.objects.create(
+                                user=user,
+                                lender=listing.user,
+                                listing=listing,
+                                status=order_status,
+                                requested_date='2023-10-26',
+                                start_date='2023-10-27',
+                                end_date='2023-10-29')
+
+    def test_inbox_is_newest_first(self):
+        """Test renter and lender orders are merged newest first"""
+        res = self.client.get(ORDERS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = sorted([o.id for o in self.rented + self.lent], reverse=True)
+        self.assertEqual([order['id'] for order in res.data], ids)
+
+    def test_filter_by_role(self):
+        """Test role limits the inbox to one side"""
+        res = self.client.get(ORDERS_URL, {'role': 'lender'})
+
+        self.assertEqual({order['id'] for order in res.data},
+                         {order.id for order in self.lent})
+
+    def test_filter_by_status(self):
+        """Test status filters both sides of the inbox"""
+        res = self.client.get(ORDERS_URL, {'status': 'Pending'})
+
+        self.assertEqual({order['id'] for order in res.data},
+                         {self.rented[0].id, self.lent[0].id})
+
+    def test_invalid_filters_rejected(self):
+        """Test unknown roles and statuses return 400"""
+        res = self.client.get(ORDERS_URL, {'role': 'owner'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(ORDERS_URL, {'status': 'Lost'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_keyset_pagination(self):
+        """Test pages follow the Link header without overlap"""
+        res = self.client.get(ORDERS_URL, {'limit': 3})
+
+        self.assertEqual(len(res.data), 3)
+        self.assertIn('rel="next"', res['Link'])
+        before = res.data[-1]['id']
+
+        res = self.client.get(ORDERS_URL, {'limit': 3, 'before': before})
+
+        self.assertEqual(len(res.data), 1)
+        self.assertLess(res.data[0]['id'], before)
+        self.assertNotIn('Link', res)
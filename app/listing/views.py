@@ -7,8 +7,19 @@ from rest_framework import (viewsets, status)
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from django.db.models import Q
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Value,
+    When,
+    )
 from django.core.exceptions import PermissionDenied
 from core.models import (
     User,
@@ -18,8 +29,24 @@ from core.models import (
     ListingReview,
     Orders,
     UserReview,
-    ListingImage)
+    ListingImage,
+    ORDER_STATUS_CHOICES)
+from core import direct_uploads
+from core.category_tree import descendant_ids, get_tree
+from core.db.routers import ReplicaReadMixin
 from listing import serializers
+from listing.autocomplete import get_suggestions
+from listing.clusters import get_clusters
+from listing.facets import get_facets
+from listing.search import keyset_page, search_listings
+
+
+def filter_by_categories(queryset, cat_ids):
+    """Filter listings in any of the categories or their subcategories"""
+    in_category = Listing.category.through.objects.filter(
+        listing_id=OuterRef('pk'),
+        category_id__in=descendant_ids(cat_ids))
+    return queryset.filter(Exists(in_category))
 
 
 class ListingViewSet(viewsets.ModelViewSet):
@@ -39,13 +66,14 @@ class ListingViewSet(viewsets.ModelViewSet):
         queryset = self.queryset
         if categories:
             cat_ids = self._params_to_ints(categories)
-            queryset = queryset.filter(category__id__in=cat_ids)
+            queryset = filter_by_categories(queryset, cat_ids)
+        if self.action == 'list':
+            queryset = serializers.ListingSerializer.prefetch(queryset)
         if self.request.user.is_staff:
-            return queryset.order_by('-id').distinct()
+            return queryset.order_by('-id')
         return queryset \
             .filter(user=self.request.user) \
-            .order_by('-id') \
-            .distinct()
+            .order_by('-id')
 
     def get_serializer_class(self):
         """Return the serializer class for request"""
@@ -171,6 +199,72 @@ class ListingImageViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def _owned_listing(self):
+        """Return the user's listing named in the request, or raise 404"""
+        try:
+            return Listing.objects.get(id=self.request.data.get('listing'),
+                                       user=self.request.user)
+        except (Listing.DoesNotExist, TypeError, ValueError):
+            raise NotFound('Listing not found.')
+
+    @action(methods=['POST'], detail=False, url_path='upload-images')
+    def upload_images(self, request):
+        """Upload several images to a listing at once"""
+        listing = self._owned_listing()
+        serializer = serializers.ListingImageBatchSerializer(
+            data=request.data)
+        serializer.is_valid(raise_exception=True)
+        images = serializer.save(listing=listing)
+        return Response(
+            serializers.ListingImageSerializer(images, many=True).data,
+            status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='reorder-images')
+    def reorder_images(self, request):
+        """Set the order of all of a listing's images in one update"""
+        listing = self._owned_listing()
+        serializer = serializers.ListingImageOrderSerializer(
+            data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['order']
+        images = ListingImage.objects.filter(listing=listing)
+        if len(set(ids)) != len(ids) or \
+                set(ids) != set(images.values_list('id', flat=True)):
+            raise ValidationError(
+                {'order': "Must list each of the listing's images once."})
+
+        images.filter(id__in=ids).update(order=Case(
+            *[When(id=image_id, then=Value(position))
+              for position, image_id in enumerate(ids, 1)],
+            default=F('order'),
+            output_field=IntegerField()))
+        return Response(
+            serializers.ListingImageSerializer(images.order_by('order'),
+                                               many=True).data,
+            status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=False, url_path='upload-intent')
+    def upload_intent(self, request):
+        """Return a form for uploading an image straight to storage"""
+        listing = self._owned_listing()
+        intent = direct_uploads.create_intent('listing', request.user,
+                                              request.data, listing)
+        return Response(intent, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='upload-complete')
+    def upload_complete(self, request):
+        """Add an image uploaded with an upload intent to its listing"""
+        fields = {}
+        if 'order' in request.data:
+            try:
+                fields['order'] = int(request.data['order'])
+            except (TypeError, ValueError):
+                raise ValidationError({'order': 'Must be an integer.'})
+        image = direct_uploads.complete('listing', request.user,
+                                        request.data.get('token'), **fields)
+        serializer = self.get_serializer(image)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(methods=['PUT'], detail=True, url_path='update-image')
     def update_image(self, request, pk=None):
         """Update an image for a listing"""
@@ -193,10 +287,13 @@ class ListingImageViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_204_NO_CONTENT)
 
 
-class ListingReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+class ListingReadOnlyViewSet(ReplicaReadMixin,
+                             viewsets.ReadOnlyModelViewSet):
     """
     A simple ViewSet for viewing all listings.
     """
+    # Optional, so ReplicaReadMixin can tell who is pinned
+    authentication_classes = [TokenAuthentication]
     queryset = Listing.objects.all()
     serializer_class = serializers.ListingDetailSerializer
 
@@ -205,13 +302,13 @@ class ListingReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
         return [int(str_id) for str_id in qs.split(',')]
 
     def get_queryset(self):
-        """Retrive listings for authenticated user"""
+        """Retrive listings matching the search parameters"""
         categories = self.request.query_params.get('category')
         queryset = self.queryset
         if categories:
             cat_ids = self._params_to_ints(categories)
-            queryset = queryset.filter(category__id__in=cat_ids)
-        return queryset.order_by('-id').distinct()
+            queryset = filter_by_categories(queryset, cat_ids)
+        return search_listings(queryset, self.request.query_params)
 
     def get_serializer_class(self):
         """Return the serializer class for request"""
@@ -219,13 +316,47 @@ class ListingReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
             return serializers.ListingSerializer
         return self.serializer_class
 
-
-class RecentListingViewSet(viewsets.ReadOnlyModelViewSet):
+    def list(self, request, *args, **kwargs):
+        """List listings a keyset page at a time, facets if ?facets=true"""
+        queryset = self.filter_queryset(self.get_queryset())
+        listings, cursor = keyset_page(
+            serializers.ListingSerializer.prefetch(queryset),
+            request.query_params)
+        data = self.get_serializer(listings, many=True).data
+        headers = {}
+        if cursor:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', cursor)
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        if request.query_params.get('facets') in ('1', 'true'):
+            data = {
+                'results': data,
+                'facets': get_facets(queryset, request.query_params),
+            }
+        return Response(data, headers=headers)
+
+    @action(detail=False, methods=['GET'], url_path='map-clusters')
+    def map_clusters(self, request):
+        """Listing counts per map grid cell for ?bbox=&zoom="""
+        clusters = get_clusters(self.get_queryset(), request.query_params)
+        return Response({'clusters': clusters})
+
+    @action(detail=False, methods=['GET'], url_path='autocomplete')
+    def autocomplete(self, request):
+        """Most used makes or models containing ?q="""
+        return Response(get_suggestions(request.query_params))
+
+
+class RecentListingViewSet(ReplicaReadMixin,
+                           viewsets.ReadOnlyModelViewSet):
     """
     A simple ViewSet for viewing 8 most recent listings.
     """
-    queryset = Listing.objects.filter(address__city='Los Angeles') \
-        .order_by('-created_at')[:8]
+    # Optional, so ReplicaReadMixin can tell who is pinned
+    authentication_classes = [TokenAuthentication]
+    queryset = serializers.ListingSerializer.prefetch(
+        Listing.objects.filter(address__city='Los Angeles')
+        .order_by('-created_at'))[:8]
     serializer_class = serializers.ListingSerializer
 
 
@@ -237,13 +368,24 @@ class CategoryViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser]
 
 
-class CategoryReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryReadOnlyViewSet(ReplicaReadMixin,
+                              viewsets.ReadOnlyModelViewSet):
     """
     A simple ViewSet for only viewing categories.
     """
+    # Optional, so ReplicaReadMixin can tell who is pinned
+    authentication_classes = [TokenAuthentication]
     queryset = Category.objects.all()
     serializer_class = serializers.CategorySerializer
 
+    @action(detail=False, methods=['GET'], url_path='tree')
+    def tree(self, request):
+        """Nested category tree with listing counts, served from memory"""
+        version, tree = get_tree()
+        if request.headers.get('If-None-Match') == f'"{version}"':
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return Response(tree, headers={'ETag': f'"{version}"'})
+
 
 class SavedViewSet(viewsets.ModelViewSet):
     """A viewset for saving listings"""
@@ -255,8 +397,7 @@ class SavedViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Retrive listings for authenticated user"""
         return self.queryset.filter(user=self.request.user) \
-                            .order_by('-id') \
-                            .distinct()
+                            .order_by('-id')
 
 
 class ListingReviewViewSet(viewsets.ModelViewSet):
@@ -269,8 +410,7 @@ class ListingReviewViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Retrive reviews for authenticated user"""
         return self.queryset.filter(user=self.request.user) \
-                            .order_by('-id') \
-                            .distinct()
+                            .order_by('-id')
 
     def create(self, request, *args, **kwargs):
         listing_id = request.data.get('listing')
@@ -305,8 +445,11 @@ class ListingReviewViewSet(viewsets.ModelViewSet):
                         headers=headers)
 
 
-class ListingReviewReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+class ListingReviewReadOnlyViewSet(ReplicaReadMixin,
+                                   viewsets.ReadOnlyModelViewSet):
     """A viewset for listing reviews without authentication"""
+    # Optional, so ReplicaReadMixin can tell who is pinned
+    authentication_classes = [TokenAuthentication]
     serializer_class = serializers.ListingReviewSerializer
     queryset = ListingReview.objects.all()
 
@@ -321,8 +464,7 @@ class UserReviewViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Retrive reviews for authenticated user"""
         return self.queryset.filter(lender=self.request.user) \
-                            .order_by('-id') \
-                            .distinct()
+                            .order_by('-id')
 
     def create(self, request, *args, **kwargs):
         renter_id = request.data.get('renter')
@@ -355,12 +497,24 @@ class UserReviewViewSet(viewsets.ModelViewSet):
                         headers=headers)
 
 
-class UserReviewReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+class UserReviewReadOnlyViewSet(ReplicaReadMixin,
+                                viewsets.ReadOnlyModelViewSet):
     """A viewset for user reviews without authentication"""
+    # Optional, so ReplicaReadMixin can tell who is pinned
+    authentication_classes = [TokenAuthentication]
     serializer_class = serializers.UserReviewSerializer
     queryset = UserReview.objects.all()
 
 
+INBOX_PAGE_SIZE = 50
+INBOX_MAX_PAGE_SIZE = 200
+INBOX_ROLE_FIELDS = {
+    'renter': ['user'],
+    'lender': ['lender'],
+    None: ['user', 'lender'],
+}
+
+
 class OrdersViewSet(viewsets.ModelViewSet):
     """A viewset for listing orders"""
     serializer_class = serializers.OrdersSerializer
@@ -368,11 +522,60 @@ class OrdersViewSet(viewsets.ModelViewSet):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
+    def _inbox_params(self):
+        """Validate the role, status and keyset pagination parameters"""
+        params = self.request.query_params
+        role = params.get('role')
+        if role not in (None, 'renter', 'lender'):
+            raise ValidationError({'role': 'Must be renter or lender.'})
+        order_status = params.get('status')
+        if order_status is not None and \
+                order_status not in dict(ORDER_STATUS_CHOICES):
+            raise ValidationError({'status': 'Unknown order status.'})
+        try:
+            before = int(params['before']) if 'before' in params else None
+            limit = min(int(params.get('limit', INBOX_PAGE_SIZE)),
+                        INBOX_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError(
+                {'detail': 'before and limit must be integers.'})
+        return role, order_status, before, max(limit, 1)
+
     def get_queryset(self):
         """Retrive orders for authenticated user"""
-        return self.queryset.filter(
-            Q(user=self.request.user) | Q(lender=self.request.user)).order_by(
-            '-id').distinct()
+        user = self.request.user
+        if self.action != 'list':
+            return self.queryset.filter(
+                Q(user=user) | Q(lender=user)).order_by('-id')
+
+        # Each side of the inbox is served by its own (user|lender, -id)
+        # index and cut to one page before the sides are merged.
+        role, order_status, before, limit = self._inbox_params()
+        sides = []
+        for field in INBOX_ROLE_FIELDS[role]:
+            side = self.queryset.filter(**{field: user})
+            if order_status:
+                side = side.filter(status=order_status)
+            if before is not None:
+                side = side.filter(id__lt=before)
+            sides.append(side.order_by('-id')[:limit + 1])
+        if len(sides) == 1:
+            return sides[0]
+        # A user can't order their own listing so the sides never overlap
+        return sides[0].union(*sides[1:], all=True) \
+            .order_by('-id')[:limit + 1]
+
+    def list(self, request, *args, **kwargs):
+        """List orders newest first, one keyset page at a time"""
+        limit = self._inbox_params()[3]
+        orders = list(self.get_queryset())
+        serializer = self.get_serializer(orders[:limit], many=True)
+        headers = {}
+        if len(orders) > limit:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'before', orders[limit - 1].id)
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        return Response(serializer.data, headers=headers)
 
     def destroy(self, request, *args, **kwargs):
         if not request.user.is_staff:
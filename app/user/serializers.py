@@ -6,6 +6,8 @@ from django.contrib.auth import (
 from django.utils.translation import gettext as _
 from rest_framework import serializers
 from core import models
+from core.images import srcset, StagedUploadMixin
+from core.uploads import ImageUploadField
 from django.utils import timezone
 
 
@@ -62,12 +64,19 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
-class UserImageSerializer(serializers.ModelSerializer):
+class UserImageSerializer(StagedUploadMixin,
+                          serializers.ModelSerializer):
+    image = ImageUploadField(required=True)
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = models.UserImage
-        fields = ['id', 'user_id', 'image']
-        read_only_fields = ['id']
+        fields = ['id', 'user_id', 'image', 'status', 'srcset']
+        read_only_fields = ['id', 'status', 'srcset']
         extra_kwargs = {
-            'image': {'required': True},
             'user_id': {'required': True}
             }
+
+    def get_srcset(self, obj) -> dict:
+        """Resized copies of the image per format, as srcset strings"""
+        return srcset(obj)
@@ -7,14 +7,20 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 
+import io
 import tempfile
 from PIL import Image
-from core.models import UserImage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from core import images, jobs
+from core.models import UserImage, IMAGE_STATUS_PENDING, IMAGE_STATUS_READY
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
 IMAGE_URL = reverse('user:upload-list')
+INTENT_URL = reverse('user:upload-intent')
+COMPLETE_URL = reverse('user:upload-complete')
 
 
 def image_upload_url(user_id):
@@ -216,13 +222,57 @@ class ImageUploadTests(TestCase):
             img.save(image_file1, format='JPEG')
             image_file1.seek(0)
             payload = {'user_id': self.user.id, 'image': image_file1}
-            res1 = self.client.post(IMAGE_URL, payload, format='multipart')
+            self.client.post(IMAGE_URL, payload, format='multipart')
+        jobs.run_pending()
+        image1 = UserImage.objects.get(user_id=self.user).image.name
         with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file2:
-            img = Image.new('RGB', (10, 10))
+            img = Image.new('RGB', (10, 10), 'white')
             img.save(image_file2, format='JPEG')
             image_file2.seek(0)
             payload = {'user_id': self.user.id, 'image': image_file2}
             res2 = self.client.post(IMAGE_URL, payload, format='multipart')
         self.assertEqual(res2.status_code, status.HTTP_201_CREATED)
         self.assertIn('image', res2.data)
-        self.assertNotEqual(res1.data, res2.data)
+        jobs.run_pending()
+        image2 = UserImage.objects.get(user_id=self.user).image.name
+        self.assertNotEqual(image1, image2)
+
+    def test_upload_image_processed_in_background(self):
+        """Test the profile image is pending until a worker stores it"""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = Image.new('RGB', (10, 10))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            payload = {'user_id': self.user.id, 'image': image_file}
+            res = self.client.post(IMAGE_URL, payload, format='multipart')
+
+        self.assertEqual(res.data['status'], IMAGE_STATUS_PENDING)
+
+        jobs.run_pending()
+
+        image = UserImage.objects.get(user_id=self.user)
+        self.assertEqual(image.status, IMAGE_STATUS_READY)
+        self.assertTrue(image.image)
+        self.assertEqual(image.variants['widths'], [10])
+        self.assertTrue(default_storage.exists(
+            images.derivative_name(image.image.name, 10, 'jpeg')))
+
+    def test_direct_upload(self):
+        """Test a profile image uploaded straight to storage"""
+        out = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(out, format='PNG')
+        res = self.client.post(INTENT_URL, {'filename': 'me.png',
+                                            'content_type': 'image/png',
+                                            'size': out.tell()})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        form = dict(res.data['fields'],
+                    file=SimpleUploadedFile('me.png', out.getvalue()))
+        APIClient().post(res.data['url'], form, format='multipart')
+
+        res = self.client.post(COMPLETE_URL, {'token': res.data['token']})
+        jobs.run_pending()
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        image = UserImage.objects.get(user_id=self.user)
+        self.assertEqual(image.status, IMAGE_STATUS_READY)
+        self.assertTrue(image.image.name.endswith('.png'))
@@ -9,7 +9,9 @@ from user.serializers import (
     UserImageSerializer
     )
 from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from core import direct_uploads
 from core.models import UserImage
 
 
@@ -56,3 +58,18 @@ class UserImageUploadViewSet(viewsets.ModelViewSet):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['POST'], detail=False, url_path='intent')
+    def intent(self, request):
+        """Return a form for uploading a profile image straight to storage"""
+        intent = direct_uploads.create_intent('user', request.user,
+                                              request.data)
+        return Response(intent, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='complete')
+    def complete(self, request):
+        """Replace the profile image with one uploaded with an intent"""
+        image = direct_uploads.complete('user', request.user,
+                                        request.data.get('token'))
+        serializer = self.get_serializer(image)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -50,6 +50,7 @@ data "template_file" "api_container_definitions" {
     allowed_hosts            = aws_route53_record.app.fqdn
     s3_storage_bucket_name   = aws_s3_bucket.app_public_files.bucket
     s3_storage_bucket_region = data.aws_region.current.name
+    media_cdn_host           = var.media_cdn_host
   }
 }
 
@@ -58,13 +59,17 @@ resource "aws_ecs_task_definition" "api" {
   container_definitions    = data.template_file.api_container_definitions.rendered
   requires_compatibilities = ["FARGATE"]
   network_mode             = "awsvpc"
-  cpu                      = 256
-  memory                   = 512
+  cpu                      = 512
+  memory                   = 1024
   execution_role_arn       = aws_iam_role.task_execution_role.arn
   task_role_arn            = aws_iam_role.app_iam_role.arn
   volume {
     name = "static"
   }
+  # Not mounted in the proxy, which serves the static volume
+  volume {
+    name = "metrics"
+  }
 
   tags = local.common_tags
 }
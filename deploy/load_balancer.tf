@@ -80,3 +80,24 @@ resource "aws_security_group" "lb" {
 
   tags = local.common_tags
 }
+
+resource "aws_lb_listener_rule" "block_metrics" {
+  listener_arn = aws_lb_listener.api_https.arn
+  priority     = 10
+
+  action {
+    type = "fixed-response"
+
+    fixed_response {
+      content_type = "text/plain"
+      message_body = "Not Found"
+      status_code  = "404"
+    }
+  }
+
+  condition {
+    path_pattern {
+      values = ["/metrics", "/metrics/*"]
+    }
+  }
+}
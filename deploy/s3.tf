@@ -24,3 +24,15 @@ resource "aws_s3_bucket_public_access_block" "app_public_files" {
   ignore_public_acls      = false
   restrict_public_buckets = false
 }
+
+# Browsers POST images straight to the bucket, see core.direct_uploads
+resource "aws_s3_bucket_cors_configuration" "app_public_files" {
+  bucket = aws_s3_bucket.app_public_files.id
+
+  cors_rule {
+    allowed_methods = ["POST"]
+    allowed_origins = ["https://www.patchbaydev.net", "http://localhost:3000"]
+    allowed_headers = ["*"]
+    max_age_seconds = 3000
+  }
+}
@@ -12,7 +12,10 @@
             {"name": "DB_PASS", "value": "${db_pass}"},
             {"name": "ALLOWED_HOSTS", "value": "${allowed_hosts}"},
             {"name": "S3_STORAGE_BUCKET_NAME", "value": "${s3_storage_bucket_name}"},
-            {"name": "S3_STORAGE_BUCKET_REGION", "value": "${s3_storage_bucket_region}"}
+            {"name": "S3_STORAGE_BUCKET_REGION", "value": "${s3_storage_bucket_region}"},
+            {"name": "MEDIA_CDN_HOST", "value": "${media_cdn_host}"},
+            {"name": "METRICS_DIR", "value": "/vol/metrics"},
+            {"name": "METRICS_SOURCE", "value": "api"}
         ],
         "logConfiguration": {
             "logDriver": "awslogs",
@@ -33,6 +36,51 @@
                 "readOnly": false,
                 "containerPath": "/vol/web",
                 "sourceVolume": "static"
+            },
+            {
+                "readOnly": false,
+                "containerPath": "/vol/metrics",
+                "sourceVolume": "metrics"
+            }
+        ]
+    },
+    {
+        "name": "worker",
+        "image": "${app_image}",
+        "essential": false,
+        "memoryReservation": 256,
+        "command": ["python", "manage.py", "run_workers", "--processes", "2"],
+        "environment": [
+            {"name": "DJANGO_SECRET_KEY", "value": "${django_secret_key}"},
+            {"name": "DB_HOST", "value": "${db_host}"},
+            {"name": "DB_NAME", "value": "${db_name}"},
+            {"name": "DB_USER", "value": "${db_user}"},
+            {"name": "DB_PASS", "value": "${db_pass}"},
+            {"name": "ALLOWED_HOSTS", "value": "${allowed_hosts}"},
+            {"name": "S3_STORAGE_BUCKET_NAME", "value": "${s3_storage_bucket_name}"},
+            {"name": "S3_STORAGE_BUCKET_REGION", "value": "${s3_storage_bucket_region}"},
+            {"name": "MEDIA_CDN_HOST", "value": "${media_cdn_host}"},
+            {"name": "METRICS_DIR", "value": "/vol/metrics"},
+            {"name": "METRICS_SOURCE", "value": "worker"}
+        ],
+        "logConfiguration": {
+            "logDriver": "awslogs",
+            "options": {
+                "awslogs-group": "${log_group_name}",
+                "awslogs-region": "${log_group_region}",
+                "awslogs-stream-prefix": "worker"
+            }
+        },
+        "mountPoints": [
+            {
+                "readOnly": false,
+                "containerPath": "/vol/web",
+                "sourceVolume": "static"
+            },
+            {
+                "readOnly": false,
+                "containerPath": "/vol/metrics",
+                "sourceVolume": "metrics"
             }
         ]
     },
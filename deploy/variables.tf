@@ -49,4 +49,9 @@ variable "subdomain" {
     staging    = "api.staging"
     dev        = "api.dev"
   }
-}
\ No newline at end of file
+}
+
+variable "media_cdn_host" {
+  description = "Host of the CDN serving uploaded media, empty for the bucket"
+  default     = ""
+}
@@ -1,6 +1,10 @@
 #!/bin/sh
 
 set -e
+export METRICS_DIR=${METRICS_DIR:-/tmp/metrics}
+export METRICS_SOURCE=${METRICS_SOURCE:-api}
+# Only this container's files; the worker container writes here too
+mkdir -p "$METRICS_DIR" && rm -f "$METRICS_DIR/$METRICS_SOURCE"-*.json
 python manage.py collectstatic --noinput
 python manage.py wait_for_db
 python manage.py migrate